@@ -1,12 +1,13 @@
 from PyQt6.QtWidgets import QApplication, QMainWindow, QFileDialog, QMessageBox, QColorDialog
 from PyQt6.QtGui import QGuiApplication, QIcon, QShortcut, QKeySequence, QDesktopServices
-from PyQt6.QtCore import QPoint, QDir, pyqtSignal, QUrl
+from PyQt6.QtCore import QPoint, QDir, pyqtSignal, QUrl, QThreadPool, Qt
 from PyQt6 import uic
 # Built-in module :
-import sys, os
+import sys, os, multiprocessing
 
-from core.optimizer import ImageOptimizer
-from ui_util import msg_box, open_folder, ImageHelper, JsonConfig
+from core import metadata
+from core.profiles import DEFAULT_PROFILE, PROFILES
+from ui_util import msg_box, open_folder, ImageHelper, JsonConfig, OptimizeWorker
 
 basedir = os.path.dirname(__file__)
 
@@ -33,6 +34,8 @@ class App(QMainWindow):
 		print(resourcePath('look.ui'))
 		self.basepath = resourcePath('')
 		self.last_folder = '/home'
+		# Background job being run, None when idle
+		self.worker = None
 		# The following config method helps us to set all default behaviours
 		self.config()
 
@@ -45,6 +48,7 @@ class App(QMainWindow):
 		self.center_mainwindow(w=600, h=100)		
 		self.updateQualitySliderLabel()
 		self.setupComboBoxFormats()
+		self.setupComboBoxProfiles()
 		self.setupCheckBoxes()
 		self.setupWidgetConnections()
 		
@@ -65,6 +69,8 @@ class App(QMainWindow):
 		self.btnBrowseFolder.clicked.connect(lambda: open_folder(self.formImageFolder.text()))		
 		self.btnMakeGif.clicked.connect(lambda: self.optimize('build_gif'))
 		self.btnMakeGifBgColor.clicked.connect(self.pickBgColor)
+		self.btnCancel.clicked.connect(self.cancelOptimization)
+		self.btnCancel.setVisible(False)
 
 		# Sliders
 		self.hSliderQuality.valueChanged.connect(self.updateQualitySliderLabel)
@@ -75,9 +81,14 @@ class App(QMainWindow):
 
 	def setupComboBoxFormats(self):
 		# Set up formats in combobox from config
-		formats = self.user_config.get('formats', ['default', 'WebP', 'png', 'jpeg', 'gif', 'ico', 'tiff', 'bmp'])
+		formats = self.user_config.get('formats', ['default', 'auto', 'WebP', 'png', 'jpeg', 'gif', 'ico', 'tiff', 'bmp'])
 		self.comboBoxFormat.addItems(formats)
 
+	def setupComboBoxProfiles(self):
+		# Set up encoder profiles, the default one from config
+		self.comboBoxProfile.addItems(PROFILES)
+		self.comboBoxProfile.setCurrentText(self.user_config.get('profile', DEFAULT_PROFILE))
+
 	def setupCheckBoxes(self):
 		# Set initial checkbox states based on config
 		self.chkReplaceSource.setChecked(self.user_config.get('replace_source', False))
@@ -118,14 +129,27 @@ class App(QMainWindow):
 		dialog.setFileMode(QFileDialog.FileMode.ExistingFile)
 		images = dialog.getOpenFileNames(self, 
 			"Select files", self.last_folder,
-			"images (*.webp *.png *.jpeg *.jpg *.gif *.ico *.bmp)"
+			"images (*.webp *.png *.jpeg *.jpg *.gif *.ico *.tiff *.bmp)"
 		)
 		try:
 			self.last_folder = os.path.dirname(images[0][0])
 			self.listWidgetImages.insertItems(0, images[0])
+			self.setImagesTooltip()
 		except IndexError:
 			pass
 
+	def setImagesTooltip(self):
+		""" Show the size and format of listed images, read from their headers only """
+		for index in range(self.listWidgetImages.count()):
+			item = self.listWidgetImages.item(index)
+			if item.toolTip():
+				continue
+			try:
+				info = metadata.index.get(item.text())
+				item.setToolTip(f'{info.width}x{info.height} {info.format} ({info.file_size // 1024} KB)')
+			except OSError as e:
+				item.setToolTip(str(e))
+
 	def removeImages(self):
 		selected_images = self.listWidgetImages.selectedItems()
 		if not selected_images: return
@@ -228,11 +252,33 @@ class App(QMainWindow):
 		config = {'quality': self.hSliderQuality.value(),
 			'base_width': self.spinBoxBasewidth.value(),
 			'format': self.comboBoxFormat.currentText(),
-			'overwrite': self.chkReplaceSource.isChecked()
+			'profile': self.comboBoxProfile.currentText(),
+			'profiles': self.user_config.get('profiles', {}),
+			'encoder_params': self.user_config.get('encoder_params', {}),
+			'lossless_png': self.user_config.get('lossless_png', True),
+			'overwrite': self.chkReplaceSource.isChecked(),
+			'workers': self.user_config.get('workers', 1),
+			'memory_budget': self.user_config.get('memory_budget', 0),
+			'io_threads': self.user_config.get('io_threads', 2),
+			'prefetch': self.user_config.get('prefetch', 0),
+			'durability': self.user_config.get('durability', 'batch'),
+			'cache_dir': self.user_config.get('cache_dir', ''),
+			'cache_size': self.user_config.get('cache_size', 512),
+			'auto_formats': self.user_config.get('auto_formats', []),
+			'min_ssim': self.user_config.get('min_ssim', 0.95),
+			'max_bytes': self.user_config.get('max_bytes', 0),
+			'max_ratio': self.user_config.get('max_ratio', 0),
+			'renditions': self.user_config.get('renditions', []),
+			'rendition_formats': self.user_config.get('rendition_formats', []),
+			'recursive': self.user_config.get('recursive', False),
+			'include': self.user_config.get('include', []),
+			'exclude': self.user_config.get('exclude', []),
+			'output_dir': self.user_config.get('output_dir', '')
 		}
 
-		# Initialize the image optimizer with the specified configuration
-		opt = ImageOptimizer(self, images_path, config)
+		if self.worker is not None:
+			# A job is already running, its progress stays on the bar
+			return
 
 		# Emit a signal to set the progression bar to 0
 		self.signalProgression.emit(0)
@@ -245,19 +291,18 @@ class App(QMainWindow):
 
 				if optimization_type == 'compress':
 					# Compress the images with overwrite option
-					opt.compress(config['overwrite'], images, filemode=True)
+					self.startWorker(OptimizeWorker(images_path, config, 'compress',
+						config['overwrite'], images, filemode=True, basepath=self.basepath), optimization_type)
 				elif optimization_type == 'build_gif':
 					# Build the GIF from the images
-					dest_path = opt.buildGif(
-				  		images,
+					self.startWorker(OptimizeWorker(images_path, config, 'buildGif',
+						images,
 						filemode=True,
 						duration=self.spinBoxMakeGifDuration.value(),
 						loop=self.spinBoxMakeGifRepeat.value(),
-						bgColor=self.getGifBgColor()
-					)
-
-					if dest_path and self.chkOpenWhenFinished.isChecked():
-						self.openFolder(dest_path)
+						bgColor=self.getGifBgColor(),
+						basepath=self.basepath
+					), optimization_type)
 				else:
 					print('===================>', optimization_type)
 					# Show an error message if the optimization type is not recognized
@@ -280,7 +325,8 @@ class App(QMainWindow):
 			else:
 				if optimization_type == 'compress':
 					# Compress images in the specified folder with overwrite option
-					opt.compress(config['overwrite'])
+					self.startWorker(OptimizeWorker(images_path, config, 'compress',
+						config['overwrite'], basepath=self.basepath), optimization_type)
 				elif optimization_type == 'build_gif':
 					# Show an error message as building GIF from a folder is not supported
 					msg_box(msg_text='Building GIF from a folder is not supported. Please select files in file mode.', 
@@ -290,6 +336,69 @@ class App(QMainWindow):
 					msg_box(msg_text=f'Unknown optimization type: {optimization_type}', msg_title='Optimize image', 
 							autoclose=True, timeout=2000, msg_type=QMessageBox.Icon.Warning)
 
+	def startWorker(self, worker: OptimizeWorker, optimization_type: str) -> None:
+		"""
+		Run an optimization job in the thread pool, so the window stays responsive.
+
+		Args:
+			worker (OptimizeWorker): The job.
+			optimization_type (str): compress or build_gif.
+		"""
+		self.worker = worker
+		worker.signals.progress.connect(self.progressBar.setValue)
+		worker.signals.imageDone.connect(self.showImageResult)
+		worker.signals.finished.connect(lambda result: self.onWorkerFinished(optimization_type, result))
+		worker.signals.failed.connect(self.onWorkerFailed)
+		self.setBusy(True)
+		QThreadPool.globalInstance().start(worker)
+
+	def cancelOptimization(self) -> None:
+		if self.worker is not None:
+			self.btnCancel.setEnabled(False)
+			self.statusbar.showMessage('Cancelling...')
+			self.worker.cancel()
+
+	def setBusy(self, busy: bool) -> None:
+		""" Lock the actions while a job is running and show the Cancel button """
+		self.btnOptimize.setEnabled(not busy)
+		self.btnMakeGif.setEnabled(not busy)
+		self.btnCancel.setEnabled(busy)
+		self.btnCancel.setVisible(busy)
+
+	def showImageResult(self, result: dict) -> None:
+		""" Show the status of an image as soon as it is processed """
+		name = os.path.basename(result['source'])
+		if result.get('cancelled'):
+			return
+		if result['error']:
+			status = f'{name}: {result["error"]}'
+		else:
+			size = f' ({result["bytes"] // 1024} KB)' if result.get('bytes') is not None else ''
+			status = f'{name} -> {os.path.basename(result["dest"])}{size}'
+		self.statusbar.showMessage(status)
+		for item in self.listWidgetImages.findItems(result['source'], Qt.MatchFlag.MatchExactly):
+			item.setToolTip(status)
+
+	def onWorkerFinished(self, optimization_type: str, result) -> None:
+		cancelled = self.worker.optimizer.cancelled.is_set()
+		self.worker = None
+		self.setBusy(False)
+		if cancelled:
+			self.statusbar.showMessage('Cancelled')
+			return
+		if optimization_type == 'compress':
+			failed = sum(1 for image in result if image['error'])
+			self.statusbar.showMessage(f'{len(result) - failed} image(s) optimized, {failed} failed')
+		elif optimization_type == 'build_gif':
+			self.statusbar.showMessage(f'GIF saved: {result}')
+			if result and self.chkOpenWhenFinished.isChecked():
+				self.openFolder(result)
+
+	def onWorkerFailed(self, error: str) -> None:
+		self.worker = None
+		self.setBusy(False)
+		msg_box(msg_text=error, msg_title='Optimize image', msg_type=QMessageBox.Icon.Critical)
+
 	def setOverwriteMode(self):
 		if self.chkReplaceSource.isChecked():
 			self.comboBoxFormat.setCurrentText('default')
@@ -305,6 +414,8 @@ class App(QMainWindow):
 		self.formImageFolder.setVisible(not file_mode)		
 		
 def main(): 
+	# Needed by the worker processes of the frozen (PyInstaller) app
+	multiprocessing.freeze_support()
 	app = QApplication(sys.argv)
 	app.setWindowIcon(QIcon(resourcePath('fav.ico')))
 	form = App()
@@ -0,0 +1,250 @@
+"""
+Benchmark of core/optimizer.py on a reproducible synthetic image corpus.
+
+Usage (from the repository root):
+	python -m benchmarks.bench                                  # run and print the results
+	python -m benchmarks.bench --save-baseline baseline.json    # store the results as baseline
+	python -m benchmarks.bench --baseline baseline.json         # fail if slower than the baseline
+
+Every case runs in a fresh process so the peak memory (RSS) is measured per case.
+"""
+import argparse, json, multiprocessing, os, shutil, sys, tempfile, time
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from core import metadata
+from core.metrics import peakMemory
+from core.optimizer import HeadlessParent, ImageOptimizer
+
+# Size classes: name => (width, height)
+SIZES = {
+	'small': (800, 600),
+	'medium': (2000, 1500),
+	'large': (6000, 4000),
+}
+
+# Corpus kinds: name => file extension
+KINDS = {
+	'photo': 'jpg',
+	'graphic': 'png',
+	'alpha': 'png',
+	'animated': 'gif',
+}
+
+def makeImage(kind: str, size: tuple, rng: np.random.Generator) -> Image.Image:
+	"""
+	Generate a synthetic image.
+
+	Args:
+		kind (str): photo (smooth gradients and blurred noise), graphic (flat shapes),
+			alpha (graphic with a transparency gradient) or animated (first frame of an animation).
+		size (tuple): The image size (width, height).
+		rng (np.random.Generator): The random generator.
+
+	Returns:
+		Image.Image: The generated image.
+	"""
+	width, height = size
+	if kind == 'photo':
+		y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+		base = np.stack([x / width, y / height, (x + y) / (width + height)], axis=-1) * 255
+		noise = Image.fromarray((rng.random((height // 8 + 1, width // 8 + 1, 3)) * 255).astype(np.uint8))
+		noise = np.asarray(noise.resize(size, Image.Resampling.BICUBIC), dtype=np.float32)
+		grain = rng.normal(0, 6, (height, width, 3))
+		return Image.fromarray(np.clip(base * 0.6 + noise * 0.4 + grain, 0, 255).astype(np.uint8))
+
+	pixels = np.full((height, width, 3), 240, dtype=np.uint8)
+	for _ in range(24):
+		x0, y0 = rng.integers(0, width), rng.integers(0, height)
+		x1, y1 = x0 + rng.integers(10, width // 3), y0 + rng.integers(10, height // 3)
+		pixels[y0:y1, x0:x1] = rng.integers(0, 256, 3)
+	if kind == 'alpha':
+		alpha = np.tile(np.linspace(0, 255, width, dtype=np.uint8), (height, 1))
+		return Image.fromarray(np.dstack([pixels, alpha]), 'RGBA')
+	return Image.fromarray(pixels)
+
+def buildCorpus(folder: str, sizes: List[str], frames: int = 12, seed: int = 0) -> Dict[str, List[str]]:
+	"""
+	Write the synthetic corpus. The same seed always gives the same images.
+
+	Args:
+		folder (str): The corpus folder.
+		sizes (List[str]): Size classes to generate.
+		frames (int): Number of frames of the animated GIFs.
+		seed (int): The random seed.
+
+	Returns:
+		Dict[str, List[str]]: '<kind>-<size>' => image file names.
+	"""
+	rng = np.random.default_rng(seed)
+	corpus = {}
+	for size_name in sizes:
+		size = SIZES[size_name]
+		for kind, ext in KINDS.items():
+			names = []
+			count = 1 if kind == 'animated' else 4
+			for i in range(count):
+				name = f'{kind}-{size_name}-{i}.{ext}'
+				if kind == 'animated':
+					name = f'{kind}-{size_name}-{frames}f-{i}.{ext}'
+				path = os.path.join(folder, name)
+				if not os.path.exists(path):
+					if kind == 'animated':
+						images = [makeImage('graphic', size, rng) for _ in range(frames)]
+						images[0].save(path, save_all=True, append_images=images[1:], duration=40, loop=0)
+					else:
+						makeImage(kind, size, rng).save(path, quality=92)
+				names.append(name)
+			corpus[f'{kind}-{size_name}'] = names
+	return corpus
+
+def runCase(case: dict) -> dict:
+	"""
+	Run a benchmark case. Called in a fresh worker process.
+
+	Args:
+		case (dict): `operation`, `folder`, `images`, `config` and `repeat`.
+
+	Returns:
+		dict: `seconds` (best run), `images_per_sec`, `mb_per_sec` and `peak_rss`.
+	"""
+	folder, images = case['folder'], case['images']
+	output = tempfile.mkdtemp(prefix='bench-out-')
+	config = {'timestamp': False, 'prefix': '-bench', **case['config']}
+	best = None
+	try:
+		for _ in range(case['repeat']):
+			# Every run reads the image headers again, as a new process would
+			metadata.index = metadata.MetadataIndex()
+			opt = ImageOptimizer(HeadlessParent(), folder, config)
+			# Preparation, not timed
+			if case['operation'] == 'compress':
+				# File mode writes next to the sources, so work on copies in the output folder
+				copies = [shutil.copy(os.path.join(folder, name), output) for name in images]
+			elif case['operation'] == 'resize':
+				loaded = []
+				for name in images:
+					im = Image.open(os.path.join(folder, name))
+					im.load()
+					loaded.append(im)
+
+			start = time.perf_counter()
+			if case['operation'] == 'compress':
+				opt.compress(images=copies, filemode=True)
+			elif case['operation'] == 'resize':
+				for im in loaded:
+					opt.resize(im)
+			elif case['operation'] == 'buildGif':
+				opt.path = output
+				opt.buildGif([os.path.join(folder, name) for name in images])
+			elif case['operation'] == 'getLargestImage':
+				opt.images = images
+				opt.getLargestImage()
+			elapsed = time.perf_counter() - start
+			best = elapsed if best is None else min(best, elapsed)
+	finally:
+		shutil.rmtree(output, ignore_errors=True)
+
+	input_bytes = sum(os.path.getsize(os.path.join(folder, name)) for name in images)
+	return {
+		'seconds': best,
+		'images_per_sec': len(images) / best if best else None,
+		'mb_per_sec': input_bytes / 1024 / 1024 / best if best else None,
+		'peak_rss': peakMemory()
+	}
+
+def buildCases(folder: str, corpus: Dict[str, List[str]], repeat: int) -> Dict[str, dict]:
+	cases = {}
+	for group, images in corpus.items():
+		kind, size_name = group.split('-')
+		if kind == 'animated':
+			# Every frame is resized and encoded again, as GIF or as animated WebP
+			for format in ['default', 'WebP']:
+				cases[f'compress/{group}/{format}'] = {'operation': 'compress', 'images': images,
+					'config': {'format': format, 'base_width': 600, 'quality': 80}}
+			continue
+		for format in ['default', 'WebP', 'jpg']:
+			cases[f'compress/{group}/{format}'] = {'operation': 'compress', 'images': images,
+				'config': {'format': format, 'base_width': 600, 'quality': 80}}
+		cases[f'resize/{group}'] = {'operation': 'resize', 'images': images, 'config': {'base_width': 600}}
+		cases[f'getLargestImage/{group}'] = {'operation': 'getLargestImage', 'images': images, 'config': {}}
+	for group, images in corpus.items():
+		if group.startswith('graphic-'):
+			cases[f'buildGif/{group}'] = {'operation': 'buildGif', 'images': images, 'config': {'base_width': 600}}
+	for case in cases.values():
+		case['folder'] = folder
+		case['repeat'] = repeat
+	return cases
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+	"""
+	Compare results with a baseline.
+
+	Args:
+		results (Dict[str, dict]): Results of this run.
+		baseline (Dict[str, dict]): Stored results.
+		threshold (float): Allowed slowdown, ex: 0.2 for 20%.
+
+	Returns:
+		List[str]: Description of each regression.
+	"""
+	regressions = []
+	for name, result in results.items():
+		reference = baseline.get(name)
+		if not reference or not reference.get('seconds'):
+			continue
+		slowdown = result['seconds'] / reference['seconds'] - 1
+		if slowdown > threshold:
+			regressions.append(f"{name}: {result['seconds']:.3f}s vs {reference['seconds']:.3f}s (+{slowdown:.0%})")
+	return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+	parser = argparse.ArgumentParser(prog='python -m benchmarks.bench', description='Benchmark the image optimizer.')
+	parser.add_argument('--corpus', default=os.path.join(tempfile.gettempdir(), 'image-optimizer-corpus'),
+		help='Folder of the synthetic corpus (generated once, then reused).')
+	parser.add_argument('--sizes', nargs='+', default=['small', 'medium'], choices=list(SIZES),
+		help='Size classes to benchmark.')
+	parser.add_argument('--filter', default='', help='Only run cases whose name contains this text.')
+	parser.add_argument('--repeat', type=int, default=3, help='Runs per case, the best one is kept.')
+	parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic corpus.')
+	parser.add_argument('--frames', type=int, default=12, help='Number of frames of the animated GIFs.')
+	parser.add_argument('--output', help='Write the results to this JSON file.')
+	parser.add_argument('--save-baseline', help='Write the results to this baseline file.')
+	parser.add_argument('--baseline', help='Compare the results with this baseline file.')
+	parser.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown against the baseline (default 0.2 = 20%%).')
+	args = parser.parse_args(argv)
+
+	os.makedirs(args.corpus, exist_ok=True)
+	corpus = buildCorpus(args.corpus, args.sizes, frames=args.frames, seed=args.seed)
+	cases = {name: case for name, case in buildCases(args.corpus, corpus, args.repeat).items() if args.filter in name}
+
+	results = {}
+	print(f"{'case':<40} {'seconds':>8} {'img/s':>8} {'MB/s':>8} {'RSS MB':>8}")
+	for name, case in cases.items():
+		# A fresh process per case, so the peak memory belongs to this case only
+		with multiprocessing.get_context('spawn').Pool(1) as pool:
+			result = pool.apply(runCase, (case,))
+		results[name] = result
+		rss = f"{result['peak_rss'] / 1024 / 1024:.0f}" if result['peak_rss'] else '-'
+		print(f"{name:<40} {result['seconds']:>8.3f} {result['images_per_sec']:>8.2f} {result['mb_per_sec']:>8.2f} {rss:>8}")
+
+	for path in (args.output, args.save_baseline):
+		if path:
+			with open(path, 'w', encoding='utf-8') as f:
+				json.dump(results, f, indent=1)
+
+	if args.baseline:
+		with open(args.baseline, encoding='utf-8') as f:
+			regressions = compare(results, json.load(f), args.threshold)
+		if regressions:
+			print(f'{len(regressions)} regression(s) over {args.threshold:.0%}:')
+			for regression in regressions:
+				print('  ' + regression)
+			return 1
+		print('No regression')
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,82 @@
+from io import BytesIO
+from typing import Iterator, List, Optional, Tuple
+from PIL import Image, ImageSequence
+
+# Pillow formats that can store an animation (PNG is written as APNG)
+ANIMATION_FORMATS = ['GIF', 'WEBP', 'PNG']
+# GIF disposal method that clears the frame to the background
+DISPOSAL_BACKGROUND = 2
+
+def isAnimated(im: Image.Image) -> bool:
+	return getattr(im, 'is_animated', False)
+
+def hasAlpha(im: Image.Image) -> bool:
+	return 'transparency' in im.info or 'A' in im.getbands()
+
+def iterFrames(im: Image.Image, mode: str) -> Iterator[Tuple[Image.Image, int, int]]:
+	"""
+	Decode the frames of an animation one at a time.
+
+	Pillow composites each frame on the canvas (the disposal of the previous frame is applied),
+	so every frame is a full image of the canvas size.
+
+	Args:
+		im (Image.Image): The opened animation.
+		mode (str): Mode of the yielded frames (RGB or RGBA).
+
+	Yields:
+		Tuple[Image.Image, int, int]: A copy of the frame, its duration in milliseconds and its
+			GIF disposal method (0 for formats without one).
+	"""
+	for frame in ImageSequence.Iterator(im):
+		yield frame.convert(mode), frame.info.get('duration', 0), getattr(frame, 'disposal_method', 0)
+
+def prepareFrame(frame: Image.Image, size: Optional[Tuple[int, int]], save_format: str) -> Image.Image:
+	"""
+	Resize a frame and, for GIF, reduce it to an adaptive palette. Called in worker threads.
+
+	Frames with transparency are left in RGBA: the GIF encoder keeps their transparent color.
+	"""
+	if size and size != frame.size:
+		frame = frame.resize(size, Image.Resampling.LANCZOS)
+	if save_format == 'GIF' and frame.mode == 'RGB':
+		frame = frame.convert('P', palette=Image.Palette.ADAPTIVE)
+	return frame
+
+def encodeAnimation(frames: List[Image.Image],
+		durations: List[int],
+		disposals: List[int],
+		save_format: str,
+		quality: int = 80,
+		loop: Optional[int] = 0,
+		encoder_params: Optional[dict] = None
+	) -> bytes:
+	"""
+	Encode prepared frames into an animated GIF, WebP or APNG.
+
+	Args:
+		frames (List[Image.Image]): The frames, all of the same size.
+		durations (List[int]): Display time of each frame in milliseconds.
+		disposals (List[int]): GIF disposal method of each frame (only used by GIF).
+		save_format (str): The Pillow format, one of `ANIMATION_FORMATS`.
+		quality (int): The WebP quality.
+		loop (int, optional): Number of loops, 0 means forever and None plays the animation once.
+		encoder_params (dict, optional): Save parameters of the encoder profile, ex: the WebP `method`.
+
+	Returns:
+		bytes: The encoded animation.
+	"""
+	params = {'save_all': True, 'append_images': frames[1:], 'duration': durations}
+	if loop is not None:
+		params['loop'] = loop
+	if save_format == 'GIF':
+		params.update(optimize=True, disposal=disposals)
+	elif save_format == 'WEBP':
+		# WebP finds the changed rectangles and the blending of each frame itself
+		params.update(quality=quality, method=4, allow_mixed=True)
+	else:
+		params.update(optimize=True)
+	params.update(encoder_params or {})
+	buffer = BytesIO()
+	frames[0].save(buffer, format=save_format, **params)
+	return buffer.getvalue()
@@ -0,0 +1,304 @@
+import os, secrets, stat, threading
+from collections import deque
+from time import time
+from typing import Callable, Iterable, List, Optional, Tuple
+
+# none: atomic rename only, batch: sync a group of files before renaming them, always: sync every file
+DURABILITY_LEVELS = ['none', 'batch', 'always']
+DEFAULT_DURABILITY = 'batch'
+# Files committed together by the batch durability, and the longest wait of a file
+DURABILITY_BATCH = 64
+BATCH_SECONDS = 2.0
+# Temporary files are hidden, and not images so folder scans skip them
+TEMP_SUFFIX = '.optimizer.tmp'
+# Temporary files left by a killed run are removed after this many seconds
+STALE_SECONDS = 3600
+# Attempts to find a free temporary name
+TEMP_ATTEMPTS = 100
+
+def tempPath(dest_path: str) -> str:
+	"""
+	Create an empty temporary file in the folder of a destination, so it can be renamed over it atomically.
+	It gets the permissions of the file it replaces, or the ones of a new file.
+	"""
+	folder = os.path.dirname(dest_path)
+	for _ in range(TEMP_ATTEMPTS):
+		path = os.path.join(folder, f'.{os.path.basename(dest_path)}.{secrets.token_hex(4)}{TEMP_SUFFIX}')
+		try:
+			# Like any new file, it gets the permissions allowed by the umask
+			fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+		except FileExistsError:
+			continue
+		os.close(fd)
+		try:
+			os.chmod(path, stat.S_IMODE(os.stat(dest_path).st_mode))
+		except FileNotFoundError:
+			pass
+		return path
+	raise FileExistsError(f'No free temporary name for {dest_path}')
+
+def writeTemp(dest_path: str, data: bytes) -> str:
+	"""
+	Write data to a new temporary file next to its destination.
+
+	Args:
+		dest_path (str): The destination path.
+		data (bytes): The file content.
+
+	Returns:
+		str: The path of the temporary file, to commit with `replace` or `AtomicWriter.commit`.
+	"""
+	path = tempPath(dest_path)
+	try:
+		with open(path, 'wb') as f:
+			f.write(data)
+	except BaseException:
+		discard(path)
+		raise
+	return path
+
+def discard(path: str) -> None:
+	try:
+		os.remove(path)
+	except FileNotFoundError:
+		pass
+
+def syncFile(path: str) -> None:
+	fd = os.open(path, os.O_RDWR)
+	try:
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+
+def syncFolder(folder: str) -> None:
+	""" Make the renames of a folder durable. Windows cannot open folders, NTFS journals renames itself """
+	if os.name == 'nt':
+		return
+	fd = os.open(folder or '.', os.O_RDONLY)
+	try:
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+
+def replace(temp_path: str, dest_path: str, durability: str = DEFAULT_DURABILITY) -> None:
+	"""
+	Rename a temporary file over its destination. Unless `durability` is none, the file content is
+	on the disk before the rename, and the rename once this returns.
+	"""
+	if durability != 'none':
+		syncFile(temp_path)
+	os.replace(temp_path, dest_path)
+	if durability != 'none':
+		syncFolder(os.path.dirname(dest_path))
+
+def removeStale(folder: str, max_age: float = STALE_SECONDS) -> int:
+	""" Remove the temporary files of a folder left by a killed run. Returns the number of removed files """
+	removed = 0
+	limit = time() - max_age
+	try:
+		entries = list(os.scandir(folder or '.'))
+	except OSError:
+		return 0
+	for entry in entries:
+		try:
+			if entry.name.endswith(TEMP_SUFFIX) and entry.is_file() and entry.stat().st_mtime < limit:
+				os.remove(entry.path)
+				removed += 1
+		except OSError:
+			pass
+	return removed
+
+class AtomicWriter(object):
+	"""
+	Commits files written to temporary files (see `writeTemp`) by renaming them over their destination,
+	so a destination is always either its previous content or the complete new one, even when the
+	process is killed. This matters when outputs replace their source.
+
+	With the batch durability, commits are grouped: the temporary files of up to `batch_size` commits
+	are synced to the disk, renamed, then their folders are synced once each. A group is flushed when
+	it is full, `batch_seconds` after its first commit (by a timer thread) or when the writer is closed.
+	`commitAll` calls back once its files are renamed, to report them done only then. A commit that
+	fails removes its temporary file and is recorded in `failed`, the destination keeping its
+	previous content. Thread-safe.
+
+	Args:
+		durability (str): One of `DURABILITY_LEVELS`.
+		batch_size (int): Commits grouped by the batch durability.
+		batch_seconds (float): Longest time a commit waits for its group.
+	"""
+
+	def __init__(self, durability: str = DEFAULT_DURABILITY, batch_size: int = DURABILITY_BATCH, batch_seconds: float = BATCH_SECONDS):
+		super(AtomicWriter, self).__init__()
+		if durability not in DURABILITY_LEVELS:
+			raise ValueError(f"Unknown durability: {durability} (expected one of {', '.join(DURABILITY_LEVELS)})")
+		self.durability = durability
+		self.batch_size = max(1, batch_size)
+		self.batch_seconds = batch_seconds
+		# (temporary path, destination path) of the commits waiting for their group
+		self.pending: List[Tuple[str, str]] = []
+		# Callbacks of `commitAll` waiting for the group to be flushed, in commit order
+		self.callbacks: List[Callable[[], None]] = []
+		# Callbacks of the flushed groups, called by one thread at a time so they keep their order
+		self.ready = deque()
+		self.reporting = False
+		# Flushes the group `batch_seconds` after its first commit
+		self.timer = None
+		self.folders = set()
+		self.committed = 0
+		# Error message of each destination that could not be committed
+		self.failed = {}
+		self.lock = threading.Lock()
+		self.reported = threading.Condition(self.lock)
+
+	@staticmethod
+	def fromConfig(config: dict) -> 'AtomicWriter':
+		""" Create the writer described by the `durability`, `durability_batch` and `durability_seconds` settings """
+		return AtomicWriter(config.get('durability') or DEFAULT_DURABILITY, config.get('durability_batch') or DURABILITY_BATCH,
+			config.get('durability_seconds') or BATCH_SECONDS)
+
+	def write(self, dest_path: str, data: bytes) -> None:
+		""" Write data to a temporary file and commit it """
+		self.commit(writeTemp(dest_path, data), dest_path)
+
+	def commit(self, temp_path: str, dest_path: str) -> None:
+		"""
+		Rename a complete temporary file over its destination, now or with its group.
+
+		Args:
+			temp_path (str): The temporary file, in the folder of the destination.
+			dest_path (str): The destination path.
+		"""
+		self.commitAll([(temp_path, dest_path)])
+
+	def commitAll(self, staged: Iterable[Tuple[str, str]], on_committed: Optional[Callable[[], None]] = None) -> None:
+		"""
+		Commit several files, see `commit`.
+
+		Args:
+			staged (Iterable[Tuple[str, str]]): (temporary path, destination path) of each file.
+			on_committed (Callable[[], None], optional): Called once the files replaced their
+				destination (or failed, see `failed`). Callbacks are called in commit order.
+		"""
+		with self.lock:
+			for temp_path, dest_path in staged:
+				folder = os.path.dirname(dest_path)
+				if folder not in self.folders:
+					self.folders.add(folder)
+					removeStale(folder)
+				if self.durability != 'batch':
+					try:
+						replace(temp_path, dest_path, self.durability)
+						self.committed += 1
+					except OSError as e:
+						self.fail([(temp_path, dest_path)], e)
+					continue
+				self.pending.append((temp_path, dest_path))
+			if on_committed:
+				self.callbacks.append(on_committed)
+			if not self.pending or len(self.pending) >= self.batch_size:
+				self._flush()
+			elif self.timer is None:
+				self.timer = threading.Timer(self.batch_seconds, self.expire)
+				self.timer.daemon = True
+				self.timer.start()
+		self.report()
+
+	def flush(self) -> None:
+		""" Commit the waiting group now """
+		with self.lock:
+			self._flush()
+		self.report()
+
+	def expire(self) -> None:
+		""" Timer thread: commit the group once its first commit waited `batch_seconds` """
+		with self.lock:
+			if self.timer is threading.current_thread():
+				self._flush()
+		self.report()
+
+	def _flush(self) -> None:
+		""" Commit the waiting group, its callbacks are then called by `report` """
+		if self.timer is not None:
+			self.timer.cancel()
+			self.timer = None
+		pending, self.pending = self.pending, []
+		self.ready.extend(self.callbacks)
+		self.callbacks = []
+		synced = []
+		for temp_path, dest_path in pending:
+			# The content of every file is on the disk before any of them replaces its destination
+			try:
+				syncFile(temp_path)
+				synced.append((temp_path, dest_path))
+			except OSError as e:
+				self.fail([(temp_path, dest_path)], e)
+		for temp_path, dest_path in synced:
+			try:
+				os.replace(temp_path, dest_path)
+				self.committed += 1
+			except OSError as e:
+				self.fail([(temp_path, dest_path)], e)
+		try:
+			for folder in {os.path.dirname(dest_path) for _, dest_path in synced}:
+				syncFolder(folder)
+		except OSError as e:
+			print(f'Cannot sync the renamed files: {e}')
+
+	def report(self) -> None:
+		""" Call the callbacks of the flushed groups, unless another thread is calling them """
+		with self.lock:
+			if self.reporting:
+				return
+			self.reporting = True
+		while True:
+			with self.lock:
+				if not self.ready:
+					self.reporting = False
+					self.reported.notify_all()
+					return
+				callback = self.ready.popleft()
+			try:
+				callback()
+			except BaseException:
+				with self.lock:
+					self.reporting = False
+					self.reported.notify_all()
+				raise
+
+	def fail(self, commits: List[Tuple[str, str]], error: Exception) -> None:
+		for temp_path, dest_path in commits:
+			discard(temp_path)
+			self.failed[dest_path] = str(error)
+			print(f'Cannot write {dest_path}: {error}')
+
+	def abort(self) -> None:
+		""" Remove the temporary files of the waiting group, their destinations are left untouched (see `failed`) """
+		with self.lock:
+			if self.timer is not None:
+				self.timer.cancel()
+				self.timer = None
+			pending, self.pending = self.pending, []
+			self.ready.extend(self.callbacks)
+			self.callbacks = []
+		for temp_path, dest_path in pending:
+			discard(temp_path)
+			self.failed[dest_path] = 'Aborted'
+		self.report()
+
+	def close(self) -> None:
+		""" Commit the waiting group, and wait until every callback was called """
+		self.flush()
+		while True:
+			self.report()
+			with self.lock:
+				while self.reporting:
+					self.reported.wait()
+				if not self.ready:
+					return
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		# Waiting files are complete: they are committed even when the job stopped on an error
+		self.close()
@@ -0,0 +1,158 @@
+import os, json, hashlib, shutil, tempfile, threading
+from typing import Dict, Optional
+import PIL
+
+# Version of the encoding code, part of every key: bump it when a change of the code changes the
+# optimized images (ex: the PNG lossless pass), so entries written before are not served anymore
+CACHE_VERSION = 2
+
+# Estimated size of each cache folder, shared by the caches of this process (a worker process
+# creates one cache per image): the folder is only scanned once per process, and when it is full
+_sizes: Dict[str, int] = {}
+_sizes_lock = threading.Lock()
+
+class ResultCache(object):
+	"""
+	On-disk cache of optimized images, keyed on the source content and the effective settings.
+
+	Every entry is a single file named after its key. The modification time of an entry is
+	refreshed on each hit, so the oldest entries are the least recently used ones and are
+	evicted first when the cache grows over its maximum size. Entries are written through a
+	temporary file and renamed, so several worker processes can share the same folder. Each
+	process counts the size of its own writes, so the folder can exceed its maximum size by
+	what the other processes wrote until one of them evicts.
+
+	Attributes:
+		folder (str): The cache folder.
+		max_size (int): Maximum size of the cache in bytes.
+		hits (int): Number of images found in the cache.
+		misses (int): Number of images not found in the cache.
+	"""
+
+	# Settings that do not change the content of the optimized image
+	ignored_keys = ['prefix', 'timestamp', 'overwrite', 'workers', 'memory_budget', 'io_threads', 'prefetch', 'durability', 'durability_batch', 'durability_seconds', 'cache_dir', 'cache_size', 'incremental',
+		'metrics', 'metrics_jsonl', 'metrics_prometheus', 'recursive', 'include', 'exclude', 'symlinks', 'output_dir']
+
+	def __init__(self, folder: str, max_size: int = 512 * 1024 * 1024):
+		super(ResultCache, self).__init__()
+		self.folder = folder
+		self.max_size = max_size
+		self.hits = 0
+		self.misses = 0
+		os.makedirs(self.folder, exist_ok=True)
+
+	@staticmethod
+	def key(source_path: str, config: dict, data: Optional[bytes] = None) -> str:
+		"""
+		Build the cache key of an image, from its content, the settings, `CACHE_VERSION` and the
+		Pillow version (its encoders change with it).
+
+		Args:
+			source_path (str): The source image path.
+			config (dict): The optimizer configuration settings.
+			data (bytes, optional): The content of the source, when it is already read.
+
+		Returns:
+			str: The hexadecimal key.
+		"""
+		digest = hashlib.sha256()
+		if data is not None:
+			digest.update(data)
+		else:
+			with open(source_path, 'rb') as f:
+				for chunk in iter(lambda: f.read(1024 * 1024), b''):
+					digest.update(chunk)
+		settings = {key: value for key, value in config.items() if key not in ResultCache.ignored_keys}
+		settings['__version__'] = [CACHE_VERSION, PIL.__version__]
+		digest.update(json.dumps(settings, sort_keys=True, default=str).encode('utf-8'))
+		return digest.hexdigest()
+
+	def entryPath(self, key: str) -> str:
+		return os.path.join(self.folder, key)
+
+	def get(self, key: str, dest_path: str) -> bool:
+		"""
+		Copy a cached optimized image to its destination.
+
+		Args:
+			key (str): The cache key.
+			dest_path (str): The destination path of the optimized image.
+
+		Returns:
+			bool: True on a cache hit, False otherwise.
+		"""
+		entry = self.entryPath(key)
+		try:
+			shutil.copyfile(entry, dest_path)
+			# Mark the entry as recently used
+			os.utime(entry)
+		except FileNotFoundError:
+			self.misses += 1
+			return False
+		self.hits += 1
+		return True
+
+	def put(self, key: str, output_path: str) -> None:
+		"""
+		Store an optimized image in the cache.
+
+		Args:
+			key (str): The cache key.
+			output_path (str): The path of the optimized image.
+		"""
+		fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+		os.close(fd)
+		try:
+			shutil.copyfile(output_path, tmp_path)
+			os.replace(tmp_path, self.entryPath(key))
+		except OSError:
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+			raise
+		folder = os.path.abspath(self.folder)
+		with _sizes_lock:
+			size = _sizes.get(folder)
+			if size is not None:
+				size = _sizes[folder] = size + os.path.getsize(output_path)
+		if size is None or size > self.max_size:
+			self.evict()
+
+	@property
+	def size(self) -> Optional[int]:
+		""" Estimated size of the cache in bytes, None until the folder is scanned """
+		return _sizes.get(os.path.abspath(self.folder))
+
+	def evict(self) -> None:
+		""" Scan the cache, and remove the least recently used entries until it fits in its maximum size """
+		entries = []
+		for entry in os.scandir(self.folder):
+			if entry.is_file() and not entry.name.endswith('.tmp'):
+				stat = entry.stat()
+				entries.append((stat.st_mtime, stat.st_size, entry.path))
+		total = sum(size for _, size, _ in entries)
+		for _, size, path in sorted(entries):
+			if total <= self.max_size:
+				break
+			try:
+				os.remove(path)
+			except FileNotFoundError:
+				# Already evicted by another worker
+				pass
+			total -= size
+		with _sizes_lock:
+			_sizes[os.path.abspath(self.folder)] = total
+
+	@staticmethod
+	def fromConfig(config: dict) -> Optional['ResultCache']:
+		"""
+		Create the cache described by the `cache_dir` and `cache_size` (in MB) settings.
+
+		Args:
+			config (dict): The optimizer configuration settings.
+
+		Returns:
+			ResultCache or None: The cache, or None if caching is disabled.
+		"""
+		if not config.get('cache_dir'):
+			return None
+		return ResultCache(config['cache_dir'], config.get('cache_size', 512) * 1024 * 1024)
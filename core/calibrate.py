@@ -0,0 +1,102 @@
+from time import perf_counter
+from typing import List, Optional
+
+from core import profiles
+from core.optimizer import AUTO_FORMAT, AUTO_FORMATS, DEFAULT_CONFIG, ImageOptimizer
+
+# Formats calibrated when the output format is "default" or "auto"
+CALIBRATION_FORMATS = ['jpg', 'WebP', 'png']
+# Number of images encoded with every profile
+CALIBRATION_SAMPLE = 8
+# Each encode is timed this many times and the fastest run is kept
+CALIBRATION_REPEAT = 2
+
+def sampleImages(images: List[str], sample: int) -> List[str]:
+	""" Pick `sample` images spread over the list, so the sample does not depend on a single folder """
+	if len(images) <= sample:
+		return list(images)
+	return [images[i * len(images) // sample] for i in range(sample)]
+
+def calibrationFormats(config: dict) -> List[str]:
+	""" Formats to calibrate: the output format, or `CALIBRATION_FORMATS` when there is none """
+	format = config.get('format', 'default')
+	if format == AUTO_FORMAT:
+		return config.get('auto_formats') or AUTO_FORMATS
+	if format == 'default':
+		return CALIBRATION_FORMATS
+	return [format]
+
+def calibrate(images: List[str],
+		config: Optional[dict] = None,
+		formats: Optional[List[str]] = None,
+		sample: int = CALIBRATION_SAMPLE,
+		repeat: int = CALIBRATION_REPEAT
+	) -> List[dict]:
+	"""
+	Measure the encode speed and output size of every encoder profile on a sample of images.
+
+	The images are decoded and resized once, as they would be optimized with `config`, then encoded
+	in memory with each profile (nothing is written). The size budget is ignored.
+
+	Args:
+		images (List[str]): Paths of the images to sample.
+		config (dict, optional): The optimizer configuration (quality, base_width, format, encoder_params...).
+		formats (List[str], optional): Extensions of the formats to calibrate (ex: ["jpg", "WebP"]).
+			Defaults to the output format of `config` (see `calibrationFormats`).
+		sample (int): Maximum number of images to encode.
+		repeat (int): Number of timed runs of each encode, the fastest one is kept.
+
+	Returns:
+		List[dict]: One row per format and profile: `format`, `profile`, `images`, `megapixels`,
+			`ms_per_mp` (encode milliseconds per megapixel), `bytes` (total output size) and
+			`ratio` (size relative to the balanced profile).
+	"""
+	config = {**DEFAULT_CONFIG, **(config or {}), 'max_bytes': 0, 'max_ratio': 0}
+	formats = formats or calibrationFormats(config)
+	opt = ImageOptimizer(None, '', config)
+	decoded = []
+	for image_path in sampleImages(images, sample):
+		try:
+			decoded.append(opt.openImage(image_path))
+		except OSError as e:
+			print(f'Skip {image_path}: {e}')
+	if not decoded:
+		raise ValueError('No image to calibrate the encoder profiles with')
+	megapixels = sum(im.width * im.height for im in decoded) / 1e6
+
+	rows = []
+	for extension in formats:
+		save_format = profiles.formatName(extension)
+		if save_format is None:
+			raise ValueError(f'Unknown output format: {extension}')
+		for profile in profiles.PROFILES:
+			encoder = ImageOptimizer(None, '', {**config, 'profile': profile, 'profiles': {}})
+			seconds, size = 0.0, 0
+			for im in decoded:
+				timings = []
+				for _ in range(repeat):
+					start = perf_counter()
+					data, _ = encoder.encodeCandidate(im, save_format)
+					timings.append(perf_counter() - start)
+				seconds += min(timings)
+				size += len(data)
+			rows.append({
+				'format': extension,
+				'profile': profile,
+				'images': len(decoded),
+				'megapixels': round(megapixels, 3),
+				'ms_per_mp': round(seconds * 1000 / megapixels, 1),
+				'bytes': size
+			})
+		balanced = next(row['bytes'] for row in rows[-len(profiles.PROFILES):] if row['profile'] == profiles.DEFAULT_PROFILE)
+		for row in rows[-len(profiles.PROFILES):]:
+			row['ratio'] = round(row['bytes'] / balanced, 4)
+	return rows
+
+def printTable(rows: List[dict]) -> None:
+	""" Print the rows of `calibrate` as a table """
+	if rows:
+		print(f"{rows[0]['images']} image(s), {rows[0]['megapixels']:.2f} MP")
+	print(f"{'Format':<7} {'Profile':<9} {'ms/MP':>9} {'Bytes':>11} {'vs balanced':>12}")
+	for row in rows:
+		print(f"{row['format']:<7} {row['profile']:<9} {row['ms_per_mp']:>9.1f} {row['bytes']:>11} {(row['ratio'] - 1) * 100:>+11.1f}%")
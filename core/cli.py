@@ -0,0 +1,153 @@
+import argparse, json, os, sys
+from typing import List, Optional
+
+from core.optimizer import DEFAULT_CONFIG, HeadlessParent, ImageOptimizer, optimize
+from core.profiles import PROFILES
+from core.atomic import DURABILITY_LEVELS
+from core.calibrate import CALIBRATION_SAMPLE, calibrate, printTable
+
+def buildParser() -> argparse.ArgumentParser:
+	parser = argparse.ArgumentParser(
+		prog='python -m core.optimizer',
+		description='Compress, resize and convert images without the GUI.'
+	)
+	parser.add_argument('paths', nargs='+',
+		help='A folder (every image inside is optimized) or one or more image files.')
+	parser.add_argument('--config', help='JSON file with optimizer settings (quality, base_width, format, prefix, timestamp, workers).')
+	parser.add_argument('-q', '--quality', type=int, help='Output quality from 0 to 100.')
+	parser.add_argument('-w', '--base-width', type=int, help='Resize images wider than this width (0 disables resizing).')
+	parser.add_argument('-f', '--format', help='Output format (default keeps the source format, auto keeps the smallest format that passes --min-ssim).')
+	parser.add_argument('--auto-formats', nargs='+', metavar='FORMAT', help='Candidate formats of --format auto (default: WebP png jpg).')
+	parser.add_argument('--min-ssim', type=float, help='Quality gate of --format auto: minimum SSIM against the resized source (default 0.95).')
+	parser.add_argument('--min-psnr', type=float, help='Quality gate of --format auto: minimum PSNR in dB (disabled by default).')
+	parser.add_argument('--profile', choices=PROFILES, help='Encoder profile: fast (quickest encode), balanced (default) or smallest (smallest output).')
+	parser.add_argument('--calibrate', action='store_true', help='Do not optimize: measure the encode time (ms/MP) and size of every profile on a sample of the images.')
+	parser.add_argument('--calibrate-sample', type=int, default=CALIBRATION_SAMPLE, help='Number of images encoded by --calibrate.')
+	parser.add_argument('--no-lossless-png', action='store_true', help='Encode PNG outputs in one pass, without the palette reduction and the zlib settings search.')
+	parser.add_argument('--prefix', help='Suffix added to output filenames.')
+	parser.add_argument('--no-timestamp', action='store_true', help='Do not add a timestamp to output filenames.')
+	parser.add_argument('--max-bytes', type=int, help='Size budget of each output in bytes: the quality is lowered until it fits.')
+	parser.add_argument('--max-ratio', type=float, help='Size budget of each output as a ratio of its source size (ex: 0.5).')
+	parser.add_argument('--renditions', type=int, nargs='+', metavar='WIDTH', help='Write one output per width (ex: 320 640 1280 1920) from a single decode.')
+	parser.add_argument('--rendition-formats', nargs='+', metavar='FORMAT', help='Output formats of the renditions (default: --format).')
+	parser.add_argument('--no-draft', action='store_true', help='Fully decode JPEG sources before resizing them.')
+	parser.add_argument('-j', '--workers', type=int, help='Number of worker processes (0 uses every CPU core).')
+	parser.add_argument('--memory-budget', type=int, metavar='MB', help='Start images in parallel only while their estimated memory fits in this budget.')
+	parser.add_argument('--io-threads', type=int, help='Threads reading sources ahead and writing outputs while images are encoded (default 2, 0 disables it).')
+	parser.add_argument('--prefetch', type=int, help='Maximum number of images in flight between reading and writing (default: twice the workers plus the I/O threads).')
+	parser.add_argument('--large-pixels', type=int, help='Images above this number of pixels are decoded a strip at a time when possible (default 50000000, 0 disables it).')
+	parser.add_argument('--durability', choices=DURABILITY_LEVELS, help='Outputs are written to temporary files renamed into place. Sync them to the disk: never (none), by groups (batch, default) or one by one (always).')
+	parser.add_argument('--cache-dir', help='Folder of the result cache, used to skip images optimized by a previous run.')
+	parser.add_argument('--cache-size', type=int, help='Maximum size of the result cache in MB (default 512).')
+	parser.add_argument('-r', '--recursive', action='store_true', help='Folder mode: also optimize the images of subfolders.')
+	parser.add_argument('--include', action='append', metavar='GLOB', help='Folder mode: only optimize images matching this pattern (repeatable, ex: "photos/*").')
+	parser.add_argument('--exclude', action='append', metavar='GLOB', help='Folder mode: skip images and folders matching this pattern (repeatable).')
+	parser.add_argument('--symlinks', choices=['skip', 'files', 'follow'], help='Symbolic links: skip them, keep links to files (default) or also walk linked folders.')
+	parser.add_argument('-o', '--output-dir', help='Write outputs to this folder, mirroring the layout of the source folder.')
+	parser.add_argument('--incremental', action='store_true', help='Folder mode: only process new or modified images.')
+	parser.add_argument('--watch', action='store_true', help='Folder mode: keep running and optimize images as they are added.')
+	parser.add_argument('--interval', type=float, default=2.0, help='Seconds between two polls of the watched folder.')
+	parser.add_argument('--metrics', action='store_true', help='Measure the time of each stage (decode, resize, encode...) and print a summary.')
+	parser.add_argument('--metrics-jsonl', help='Append per-image metrics and the batch summary to this JSON lines file.')
+	parser.add_argument('--metrics-prometheus', help='Write the batch metrics to this file in the Prometheus text format.')
+	parser.add_argument('--overwrite', action='store_true', help='Replace the original images.')
+	parser.add_argument('--silent', action='store_true', help='Do not print the progression.')
+	return parser
+
+def readConfig(args: argparse.Namespace) -> dict:
+	"""
+	Merge the default settings, the JSON config file and the command line options.
+
+	Args:
+		args (argparse.Namespace): The parsed command line arguments.
+
+	Returns:
+		dict: The optimizer configuration.
+	"""
+	config = dict(DEFAULT_CONFIG)
+	if args.config:
+		with open(args.config, encoding='utf-8') as json_data:
+			config.update(json.load(json_data))
+	options = {
+		'quality': args.quality,
+		'base_width': args.base_width,
+		'format': args.format,
+		'auto_formats': args.auto_formats,
+		'min_ssim': args.min_ssim,
+		'min_psnr': args.min_psnr,
+		'profile': args.profile,
+		'prefix': args.prefix,
+		'workers': args.workers,
+		'max_bytes': args.max_bytes,
+		'max_ratio': args.max_ratio,
+		'renditions': args.renditions,
+		'rendition_formats': args.rendition_formats,
+		'memory_budget': args.memory_budget,
+		'io_threads': args.io_threads,
+		'prefetch': args.prefetch,
+		'large_pixels': args.large_pixels,
+		'durability': args.durability,
+		'cache_dir': args.cache_dir,
+		'cache_size': args.cache_size,
+		'include': args.include,
+		'exclude': args.exclude,
+		'symlinks': args.symlinks,
+		'output_dir': args.output_dir,
+		'metrics_jsonl': args.metrics_jsonl,
+		'metrics_prometheus': args.metrics_prometheus
+	}
+	config.update({key: value for key, value in options.items() if value is not None})
+	if args.no_timestamp:
+		config['timestamp'] = False
+	if args.no_draft:
+		config['draft'] = False
+	if args.no_lossless_png:
+		config['lossless_png'] = False
+	if args.recursive:
+		config['recursive'] = True
+	if args.incremental:
+		config['incremental'] = True
+	if args.metrics or args.metrics_jsonl or args.metrics_prometheus:
+		config['metrics'] = True
+	return config
+
+def main(argv: Optional[List[str]] = None) -> int:
+	args = buildParser().parse_args(argv)
+	config = readConfig(args)
+
+	def on_progress(value):
+		if not args.silent:
+			print(f'Progression: {value}%', file=sys.stderr)
+
+	folder_mode = len(args.paths) == 1 and os.path.isdir(args.paths[0])
+	if args.calibrate:
+		if folder_mode:
+			images = [os.path.join(args.paths[0], path) for path in ImageOptimizer.parseImages('', args.paths[0], config)]
+		else:
+			images = [os.path.abspath(path) for path in args.paths]
+		printTable(calibrate(images, config, sample=args.calibrate_sample))
+		return 0
+	if args.watch:
+		if not folder_mode:
+			print('Watch mode needs a single folder', file=sys.stderr)
+			return 2
+		opt = ImageOptimizer(HeadlessParent(on_progress), args.paths[0], config)
+		try:
+			opt.watch(args.overwrite, interval=args.interval)
+		except KeyboardInterrupt:
+			pass
+		return 0
+
+	# Folder mode when a single directory is given, file mode otherwise
+	if folder_mode:
+		results = optimize(args.paths[0], config=config, overwrite=args.overwrite, on_progress=on_progress)
+	else:
+		images = [os.path.abspath(path) for path in args.paths]
+		results = optimize(images=images, config=config, overwrite=args.overwrite, filemode=True, on_progress=on_progress)
+
+	failed = [result for result in results if result['error']]
+	print(f'{len(results) - len(failed)} image(s) optimized, {len(failed)} failed', file=sys.stderr)
+	return 1 if failed else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
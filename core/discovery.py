@@ -0,0 +1,205 @@
+import os, fnmatch, time
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+# Extensions of the images handled by the optimizer, without the dot
+IMAGE_EXTENSIONS = ['WebP', 'png', 'jpeg', 'jpg', 'gif', 'ico', 'tiff', 'bmp']
+
+# Folders modified less than this many seconds ago are listed again by `FolderScanner`
+RECENT_SECONDS = 2
+
+# Symlink policies
+SYMLINKS_SKIP = 'skip'
+SYMLINKS_FILES = 'files'
+SYMLINKS_FOLLOW = 'follow'
+
+def _matches(relpath: str, patterns: List[str]) -> bool:
+	name = relpath.rsplit('/', 1)[-1]
+	return any(fnmatch.fnmatchcase(relpath, pattern) or fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+def _scanFolder(directory: str,
+		prefix: str,
+		extensions: Set[str],
+		recursive: bool,
+		include: List[str],
+		exclude: List[str],
+		symlinks: str
+	) -> Iterator[Tuple[os.DirEntry, bool]]:
+	""" List a single folder (see `walkImages`). Yields (entry, whether it is a subfolder to walk) """
+	try:
+		entries = os.scandir(directory)
+	except OSError as e:
+		print(f'Cannot read folder {directory}: {e}')
+		return
+	with entries:
+		for entry in entries:
+			relpath = prefix + entry.name
+			try:
+				if entry.is_symlink() and symlinks == SYMLINKS_SKIP:
+					continue
+				if recursive and entry.is_dir():
+					if entry.is_symlink() and symlinks != SYMLINKS_FOLLOW:
+						continue
+					if exclude and _matches(relpath, exclude):
+						continue
+					yield entry, True
+					continue
+				_, ext = os.path.splitext(entry.name)
+				if ('.' not in ext) or (ext.lstrip('.').lower() not in extensions) or not entry.is_file():
+					continue
+			except OSError:
+				# Broken symlink or file removed during the walk
+				continue
+			if include and not _matches(relpath, include):
+				continue
+			if exclude and _matches(relpath, exclude):
+				continue
+			yield entry, False
+
+def walkImages(folder: str,
+		extensions: List[str] = IMAGE_EXTENSIONS,
+		recursive: bool = False,
+		include: Optional[List[str]] = None,
+		exclude: Optional[List[str]] = None,
+		symlinks: str = SYMLINKS_FILES
+	) -> Iterator[os.DirEntry]:
+	"""
+	List the image files of a folder with os.scandir, lazily: the first images are yielded before
+	the walk of a large tree is over. File types come from the directory listing, so a file is
+	only stat-ed when needed (symlinks, some network file systems).
+
+	Glob patterns are matched against the path relative to `folder` (with `/` separators) and
+	against the file name, ex: `*.png`, `icons/*`, `*-export*`. A directory matching an exclude
+	pattern is not walked.
+
+	Args:
+		folder (str): The folder to walk.
+		extensions (List[str]): Allowed extensions, without the dot, case insensitive.
+		recursive (bool): Whether to walk subfolders. Defaults to False.
+		include (List[str], optional): Keep only the images matching one of these patterns.
+		exclude (List[str], optional): Leave out the images and folders matching one of these patterns.
+		symlinks (str): 'skip' ignores symbolic links, 'files' (default) keeps links to files but does
+			not walk linked folders, 'follow' also walks linked folders (each folder is walked once).
+
+	Yields:
+		os.DirEntry: The directory entry of each image, in directory order, a folder before its subfolders.
+	"""
+	extensions = {ext.lower() for ext in extensions}
+	include = include or []
+	exclude = exclude or []
+	visited = set()
+	if symlinks == SYMLINKS_FOLLOW:
+		stat = os.stat(folder)
+		visited.add((stat.st_dev, stat.st_ino))
+	stack = [(folder, '')]
+	while stack:
+		directory, prefix = stack.pop()
+		subfolders = []
+		for entry, is_folder in _scanFolder(directory, prefix, extensions, recursive, include, exclude, symlinks):
+			if not is_folder:
+				yield entry
+				continue
+			if symlinks == SYMLINKS_FOLLOW:
+				try:
+					stat = entry.stat()
+				except OSError:
+					continue
+				if (stat.st_dev, stat.st_ino) in visited:
+					# Symlink loop or folder linked twice
+					continue
+				visited.add((stat.st_dev, stat.st_ino))
+			subfolders.append((entry.path, prefix + entry.name + '/'))
+		# Depth first, subfolders in directory order
+		stack.extend(reversed(subfolders))
+
+def findImages(folder: str, config: dict, extensions: List[str] = IMAGE_EXTENSIONS) -> Iterator[str]:
+	"""
+	List the images of a folder with the discovery settings of a configuration: `recursive`,
+	`include`, `exclude` and `symlinks`. The `output_dir` folder is never walked.
+
+	Args:
+		folder (str): The folder to walk.
+		config (dict): The optimizer configuration settings.
+		extensions (List[str]): Allowed extensions, without the dot.
+
+	Yields:
+		str: The path of each image, relative to `folder`.
+	"""
+	for entry in walkImages(folder, extensions, **_settings(folder, config)):
+		yield os.path.relpath(entry.path, folder)
+
+def _settings(folder: str, config: dict) -> dict:
+	""" Arguments of `walkImages` from the discovery settings of a configuration """
+	exclude = list(config.get('exclude') or [])
+	output_dir = config.get('output_dir')
+	if output_dir:
+		relative_output = os.path.relpath(os.path.abspath(output_dir), os.path.abspath(folder))
+		if not relative_output.startswith('..'):
+			exclude.append(relative_output.replace(os.sep, '/'))
+	return {
+		'recursive': config.get('recursive', False),
+		'include': config.get('include'),
+		'exclude': exclude,
+		'symlinks': config.get('symlinks', SYMLINKS_FILES)
+	}
+
+class FolderScanner(object):
+	"""
+	Lists the images of a folder again and again (watch mode) without walking the whole tree:
+	each poll only stats the folders, and lists again the ones whose modification time changed
+	(a file was added, removed or renamed in them). The listings of the other folders are reused.
+
+	Args:
+		folder (str): The folder to watch.
+		config (dict): The optimizer configuration settings (discovery settings, see `findImages`).
+		extensions (List[str]): Allowed extensions, without the dot.
+	"""
+	def __init__(self, folder: str, config: dict, extensions: List[str] = IMAGE_EXTENSIONS):
+		super(FolderScanner, self).__init__()
+		self.folder = folder
+		self.extensions = {ext.lower() for ext in extensions}
+		self.settings = _settings(folder, config)
+		# Folder path => (modification time, image paths relative to `folder`, subfolders as (path, prefix))
+		self.listings: Dict[str, Tuple[int, List[str], List[Tuple[str, str]]]] = {}
+
+	def scan(self) -> Tuple[List[str], List[str]]:
+		"""
+		Poll the folder.
+
+		Returns:
+			Tuple[List[str], List[str]]: Every image, and the images of the folders listed again
+				(new or changed folders), relative to the folder.
+		"""
+		images, changed = [], []
+		listings = {}
+		visited = set()
+		stack = [(self.folder, '')]
+		while stack:
+			directory, prefix = stack.pop()
+			try:
+				stat = os.stat(directory)
+			except OSError as e:
+				print(f'Cannot read folder {directory}: {e}')
+				continue
+			if (stat.st_dev, stat.st_ino) in visited:
+				# Symlink loop or folder linked twice
+				continue
+			visited.add((stat.st_dev, stat.st_ino))
+			listing = self.listings.get(directory)
+			if listing is None or listing[0] != stat.st_mtime_ns:
+				names, subfolders = [], []
+				for entry, is_folder in _scanFolder(directory, prefix, self.extensions, **self.settings):
+					if is_folder:
+						subfolders.append((entry.path, prefix + entry.name + '/'))
+					else:
+						names.append(os.path.relpath(entry.path, self.folder))
+				# A folder modified within the timestamp resolution of its file system (2 seconds on
+				# FAT) could change again with the same time: it is listed again on the next poll
+				mtime = stat.st_mtime_ns if time.time() - stat.st_mtime > RECENT_SECONDS else None
+				listing = (mtime, names, subfolders)
+				changed.extend(names)
+			listings[directory] = listing
+			images.extend(listing[1])
+			stack.extend(reversed(listing[2]))
+		# Removed folders are forgotten
+		self.listings = listings
+		return images, changed
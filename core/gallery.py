@@ -0,0 +1,97 @@
+import os, json, tempfile, threading, time
+from typing import Dict, Optional
+
+class GalleryCache(object):
+	"""
+	Local copy of the Kitbuilder gallery pages, revalidated with conditional requests.
+
+	Each page is stored with the ETag and Last-Modified validators of its response. A page
+	fetched less than `ttl` seconds ago is used without any request, an older one is
+	revalidated: the server answers 304 Not Modified, without the page content, when it did
+	not change.
+
+	Attributes:
+		path (str): The path of the cache file.
+		ttl (float): Seconds during which a page is used without being revalidated.
+		entries (dict): Page key => {'etag', 'last_modified', 'fetched', 'body'}.
+	"""
+
+	def __init__(self, path: str, ttl: float = 0):
+		super(GalleryCache, self).__init__()
+		self.path = path
+		self.ttl = ttl
+		self.entries: Dict[str, dict] = {}
+		self.lock = threading.Lock()
+		self.load()
+
+	@staticmethod
+	def key(page: int, user: str) -> str:
+		return f'{user}:{page}'
+
+	def load(self) -> None:
+		try:
+			with open(self.path, encoding='utf-8') as json_data:
+				self.entries = json.load(json_data)
+		except FileNotFoundError:
+			self.entries = {}
+		except ValueError:
+			print(f'Invalid gallery cache, every page will be downloaded: {self.path}')
+			self.entries = {}
+
+	def save(self) -> None:
+		""" Write the cache through a temporary file so a crash never leaves it truncated """
+		fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix='.tmp')
+		try:
+			with os.fdopen(fd, 'w', encoding='utf-8') as f, self.lock:
+				json.dump(self.entries, f)
+			os.replace(tmp_path, self.path)
+		except OSError:
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+			raise
+
+	def get(self, key: str) -> Optional[dict]:
+		return self.entries.get(key)
+
+	def isFresh(self, entry: dict) -> bool:
+		return time.time() - entry['fetched'] < self.ttl
+
+	@staticmethod
+	def validators(entry: Optional[dict]) -> dict:
+		"""
+		Conditional request headers of a cached page.
+
+		Args:
+			entry (dict, optional): The cached page.
+
+		Returns:
+			dict: If-None-Match and If-Modified-Since headers, empty if the page is not cached.
+		"""
+		headers = {}
+		if entry and entry.get('etag'):
+			headers['If-None-Match'] = entry['etag']
+		if entry and entry.get('last_modified'):
+			headers['If-Modified-Since'] = entry['last_modified']
+		return headers
+
+	def put(self, key: str, body, headers) -> None:
+		"""
+		Store a downloaded page.
+
+		Args:
+			key (str): The page key.
+			body: The decoded JSON content of the page.
+			headers: The response headers.
+		"""
+		with self.lock:
+			self.entries[key] = {
+				'etag': headers.get('ETag'),
+				'last_modified': headers.get('Last-Modified'),
+				'fetched': time.time(),
+				'body': body
+			}
+
+	def touch(self, key: str) -> None:
+		""" Mark a cached page as just revalidated """
+		with self.lock:
+			self.entries[key]['fetched'] = time.time()
@@ -0,0 +1,350 @@
+import io
+import numpy as np
+from collections import deque
+from concurrent.futures import Executor
+from typing import List, Optional, Tuple
+from PIL import Image, ImageChops
+from core import atomic
+
+# Palette index of transparent pixels in frames encoded with a global palette
+TRANSPARENT_INDEX = 255
+# GIF disposal method that leaves the frame in place for the next one
+DISPOSAL_KEEP = 1
+# Width of the frames sampled to build a global palette, and maximum number of sampled frames
+PALETTE_SAMPLE_WIDTH = 160
+PALETTE_SAMPLE_FRAMES = 16
+# Pixels of the samples used to refine the palette, and number of refinement (k-means) steps
+PALETTE_SAMPLE_PIXELS = 16384
+PALETTE_KMEANS_STEPS = 4
+
+class GifStreamWriter(object):
+	"""
+	Write an animated GIF one frame at a time, so memory use does not depend on the number of frames.
+
+	Pillow's `save(save_all=True)` keeps every frame in memory until the whole animation is
+	encoded. Here each frame is encoded on its own, with its own color table, and its bytes are
+	appended to the file as soon as the frames before it are written.
+
+	Like Pillow, `addFrame` only encodes the rectangle that changed since the previous frame and
+	merges identical frames into the previous one by extending its duration. Encoding can be
+	spread across the threads of an executor: at most `window` encoded frames wait to be written.
+
+	With a global `palette` (see `buildPalette`), frames are given as palette images mapped on it
+	(see `mapFrame`) and written without their own color table. Frames are then compared as arrays
+	of palette indexes, and the pixels of the changed rectangle that did not change are written as
+	transparent, which leaves the previous frame visible and compresses well.
+
+	Usage:
+		with GifStreamWriter(dest_path, (width, height), loop=0) as writer:
+			for frame in frames:
+				writer.addFrame(frame, duration=30)
+
+	Attributes:
+		path (str): The destination path of the GIF file.
+		size (tuple): The canvas size (width, height).
+		frames (int): Number of frames written so far.
+	"""
+
+	def __init__(self,
+			path: str,
+			size: Tuple[int, int],
+			loop: Optional[int] = 0,
+			background: int = 0,
+			executor: Optional[Executor] = None,
+			window: int = 4,
+			palette: Optional[bytes] = None,
+			durability: str = atomic.DEFAULT_DURABILITY
+		):
+		super(GifStreamWriter, self).__init__()
+		self.path = path
+		self.size = size
+		self.frames = 0
+		self.executor = executor
+		self.window = window
+		self.palette = palette
+		# Frames being encoded: [future or block, offset, duration, transparency]
+		self.pending = deque()
+		self.previous = None
+		self.durability = durability
+		# Frames are written to a temporary file, renamed to the destination once complete
+		self.temp_path = atomic.tempPath(path)
+		self.fp = open(self.temp_path, 'wb')
+		self.writeHeader(loop, background)
+
+	def writeHeader(self, loop: Optional[int], background: int) -> None:
+		width, height = self.size
+		if self.palette is None:
+			# Logical screen descriptor without a global color table: every frame has a local one
+			self.fp.write(b'GIF89a' + _o16(width) + _o16(height) + bytes([0, background, 0]))
+		else:
+			# Global color table of 256 colors
+			table = self.palette.ljust(768, b'\x00')[:768]
+			self.fp.write(b'GIF89a' + _o16(width) + _o16(height) + bytes([0xF7, background, 0]) + table)
+		if loop is not None:
+			# NETSCAPE2.0 application extension: number of loops, 0 means forever
+			self.fp.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + _o16(loop) + b'\x00')
+
+	@staticmethod
+	def encodeFrame(frame: Image.Image, optimize: bool = True) -> bytes:
+		"""
+		Encode a single frame into a GIF image block (descriptor, local color table and LZW data).
+
+		Args:
+			frame (Image.Image): The frame. Frames not in P or L mode are quantized with an adaptive palette.
+			optimize (bool): Whether to remove unused colors from the palette. Defaults to True.
+
+		Returns:
+			bytes: The image block.
+		"""
+		if frame.mode not in ('P', 'L'):
+			frame = frame.convert('P', palette=Image.Palette.ADAPTIVE)
+		buffer = io.BytesIO()
+		frame.save(buffer, format='GIF', optimize=optimize)
+		return _extractImageBlock(buffer.getvalue())
+
+	def writeBlock(self,
+			block: bytes,
+			duration: int = 0,
+			offset: Tuple[int, int] = (0, 0),
+			disposal: int = 0,
+			transparency: Optional[int] = None
+		) -> None:
+		"""
+		Append an image block produced by `encodeFrame`.
+
+		Args:
+			block (bytes): The image block.
+			duration (int): Display time of the frame in milliseconds.
+			offset (tuple): Position of the frame on the canvas.
+			disposal (int): GIF disposal method of the frame.
+			transparency (int, optional): Palette index of the transparent color.
+		"""
+		packed = (disposal << 2) | (1 if transparency is not None else 0)
+		# Graphic control extension: disposal, duration (in 1/100 s) and transparency
+		self.fp.write(b'!\xf9\x04' + bytes([packed]) + _o16(int(duration / 10)) + bytes([transparency or 0, 0]))
+		self.fp.write(b',' + _o16(offset[0]) + _o16(offset[1]) + block[5:])
+		self.frames += 1
+
+	@staticmethod
+	def encodeIndexed(indexes: np.ndarray) -> bytes:
+		"""
+		Encode palette indexes into a GIF image block without color table, for a global palette.
+
+		Args:
+			indexes (np.ndarray): 2D array of palette indexes (uint8).
+
+		Returns:
+			bytes: The image block.
+		"""
+		frame = Image.fromarray(indexes, 'P')
+		# A full palette keeps the indexes as they are and sets the LZW code size to 8 bits
+		frame.putpalette(bytes(768))
+		buffer = io.BytesIO()
+		frame.save(buffer, format='GIF', optimize=False, interlace=False)
+		return _extractImageBlock(buffer.getvalue(), local_table=False)
+
+	def writeFrame(self, frame: Image.Image, duration: int = 0, **params) -> None:
+		""" Encode and append a frame as is. See `writeBlock` for the parameters """
+		self.writeBlock(GifStreamWriter.encodeFrame(frame), duration, **params)
+
+	def addFrame(self, frame: Image.Image, duration: int = 0) -> None:
+		"""
+		Add a full canvas frame, encoding only the part that changed since the previous one.
+
+		Args:
+			frame (Image.Image): The frame, with the canvas size. All frames must have the same mode,
+				P mapped on the global palette when there is one.
+			duration (int): Display time of the frame in milliseconds.
+		"""
+		if self.palette is not None:
+			return self.addIndexedFrame(np.asarray(frame), duration)
+		if self.previous is None:
+			bbox = (0, 0) + self.size
+		else:
+			bbox = ImageChops.difference(frame, self.previous).getbbox()
+		self.previous = frame
+
+		if bbox is None:
+			# Same as the previous frame: display the previous one longer
+			if self.pending:
+				self.pending[-1][2] += duration
+				return
+			bbox = (0, 0, 1, 1)
+
+		self.queueBlock(GifStreamWriter.encodeFrame, frame.crop(bbox), bbox[:2], duration)
+
+	def addIndexedFrame(self, indexes: np.ndarray, duration: int = 0) -> None:
+		"""
+		Add a full canvas frame given as indexes of the global palette (see `addFrame`).
+
+		Args:
+			indexes (np.ndarray): 2D array of palette indexes, with the canvas size.
+			duration (int): Display time of the frame in milliseconds.
+		"""
+		previous, self.previous = self.previous, indexes
+		if previous is None:
+			self.queueBlock(GifStreamWriter.encodeIndexed, indexes, (0, 0), duration)
+			return
+		changed = indexes != previous
+		rows = np.flatnonzero(changed.any(axis=1))
+		columns = np.flatnonzero(changed.any(axis=0))
+		if not len(rows):
+			# Same as the previous frame: display the previous one longer
+			if self.pending:
+				self.pending[-1][2] += duration
+				return
+			rows = columns = np.array([0])
+		top, bottom, left, right = rows[0], rows[-1] + 1, columns[0], columns[-1] + 1
+		crop = np.where(changed[top:bottom, left:right], indexes[top:bottom, left:right], np.uint8(TRANSPARENT_INDEX))
+		self.queueBlock(GifStreamWriter.encodeIndexed, crop, (int(left), int(top)), duration, TRANSPARENT_INDEX)
+
+	def queueBlock(self, encode, frame, offset: Tuple[int, int], duration: int, transparency: Optional[int] = None) -> None:
+		"""
+		Encode a frame (in the executor if any) and write the frames waiting for more than `window`
+		frames. The last frame stays pending, its duration may still be extended.
+		"""
+		block = self.executor.submit(encode, frame) if self.executor else encode(frame)
+		self.pending.append([block, offset, duration, transparency])
+		while len(self.pending) > self.window:
+			self.writePending()
+
+	def writePending(self) -> None:
+		block, offset, duration, transparency = self.pending.popleft()
+		if not isinstance(block, bytes):
+			block = block.result()
+		if self.palette is None:
+			self.writeBlock(block, duration, offset)
+		else:
+			self.writeBlock(block, duration, offset, DISPOSAL_KEEP, transparency)
+
+	def close(self) -> None:
+		while self.pending:
+			self.writePending()
+		if not self.fp.closed:
+			# Trailer
+			self.fp.write(b';')
+			self.fp.close()
+			atomic.replace(self.temp_path, self.path, self.durability)
+
+	def abort(self) -> None:
+		""" Close and remove the incomplete file, the destination is left untouched """
+		self.pending.clear()
+		self.fp.close()
+		atomic.discard(self.temp_path)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type:
+			self.abort()
+		else:
+			self.close()
+
+def buildPalette(samples: List[Image.Image]) -> bytes:
+	"""
+	Build a palette shared by every frame of an animation, from small samples of its frames.
+
+	The samples are stacked into a single image and reduced to 255 colors at once (octree in
+	Pillow's C code), the last index of the 256 colors being kept for transparency. The colors are
+	then refined by a few k-means steps over a random subset of the sampled pixels, computed with
+	NumPy on all pixels and colors at once.
+
+	Args:
+		samples (List[Image.Image]): RGB frames, reduced to `PALETTE_SAMPLE_WIDTH` here.
+
+	Returns:
+		bytes: The palette, 3 bytes (RGB) per color, at most 255 colors.
+	"""
+	samples = [
+		sample.resize((PALETTE_SAMPLE_WIDTH, max(1, sample.height * PALETTE_SAMPLE_WIDTH // sample.width)), Image.Resampling.BOX)
+		if sample.width > PALETTE_SAMPLE_WIDTH else sample
+		for sample in samples
+	]
+	width = max(sample.width for sample in samples)
+	mosaic = Image.new('RGB', (width, sum(sample.height for sample in samples)))
+	top = 0
+	for sample in samples:
+		mosaic.paste(sample.convert('RGB'), (0, top))
+		top += sample.height
+	quantized = mosaic.quantize(TRANSPARENT_INDEX, method=Image.Quantize.FASTOCTREE)
+	colors = np.array(quantized.getpalette()[:3 * TRANSPARENT_INDEX], dtype=np.float32).reshape(-1, 3)
+
+	pixels = np.asarray(mosaic, dtype=np.float32).reshape(-1, 3)
+	if len(pixels) > PALETTE_SAMPLE_PIXELS:
+		# Same samples, same palette
+		pixels = pixels[np.random.default_rng(0).choice(len(pixels), PALETTE_SAMPLE_PIXELS, replace=False)]
+	for _ in range(PALETTE_KMEANS_STEPS):
+		# Nearest color of every pixel: |p - c|^2 = |c|^2 - 2 p.c + |p|^2 (the last term does not change the nearest)
+		nearest = ((colors * colors).sum(axis=1) - 2 * pixels @ colors.T).argmin(axis=1)
+		counts = np.bincount(nearest, minlength=len(colors))
+		used = counts > 0
+		# Move every used color to the mean of its pixels
+		for channel in range(3):
+			sums = np.bincount(nearest, weights=pixels[:, channel], minlength=len(colors))
+			colors[used, channel] = sums[used] / counts[used]
+	return np.clip(np.rint(colors), 0, 255).astype(np.uint8).tobytes()
+
+def mapFrame(frame: Image.Image, palette: bytes) -> Image.Image:
+	"""
+	Map a frame on a global palette (nearest color, without dithering so unchanged areas of
+	consecutive frames keep the same indexes).
+
+	Args:
+		frame (Image.Image): The RGB frame.
+		palette (bytes): The palette built by `buildPalette`.
+
+	Returns:
+		Image.Image: The frame in P mode, with indexes of the palette.
+	"""
+	palette_image = Image.new('P', (1, 1))
+	palette_image.putpalette(palette)
+	return frame.convert('RGB').quantize(palette=palette_image, dither=Image.Dither.NONE)
+
+def _o16(value: int) -> bytes:
+	return value.to_bytes(2, 'little')
+
+def _skipSubBlocks(data: bytes, pos: int) -> int:
+	while data[pos]:
+		pos += data[pos] + 1
+	return pos + 1
+
+def _extractImageBlock(data: bytes, local_table: bool = True) -> bytes:
+	"""
+	Extract the image block of a single frame GIF file, turning its global color table into a local one.
+
+	Args:
+		data (bytes): The GIF file content.
+		local_table (bool): Whether to keep a local color table, False for frames of a global palette.
+
+	Returns:
+		bytes: The image descriptor, local color table and LZW data.
+	"""
+	# Header (6 bytes) and logical screen descriptor (7 bytes)
+	screen_flags = data[10]
+	pos = 13
+	color_table = b''
+	if screen_flags & 0x80:
+		table_size = 3 << ((screen_flags & 7) + 1)
+		color_table = data[pos:pos + table_size]
+		pos += table_size
+	# Skip extensions written by Pillow (graphic control, comments...)
+	while data[pos] == 0x21:
+		pos = _skipSubBlocks(data, pos + 2)
+	if data[pos] != 0x2C:
+		raise ValueError('No image block found in GIF data')
+	descriptor = bytearray(data[pos:pos + 10])
+	pos += 10
+	if descriptor[9] & 0x80:
+		table_size = 3 << ((descriptor[9] & 7) + 1)
+		color_table = data[pos:pos + table_size]
+		pos += table_size
+	else:
+		# Keep the interlace flag, move the global color table into the local one
+		descriptor[9] = (descriptor[9] & 0x40) | 0x80 | (screen_flags & 7)
+	if not local_table:
+		descriptor[9] &= 0x40
+		color_table = b''
+	# LZW minimum code size followed by data sub-blocks
+	end = _skipSubBlocks(data, pos + 1)
+	return bytes(descriptor) + color_table + data[pos:end]
@@ -1,93 +1,440 @@
-import requests, os
+import requests, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib.parse import urljoin
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from core.gallery import GalleryCache
+from core.uploads import UploadIndex
 
 class Kitbuilder(object):
-	"""docstring for Kitbuilder"""
+	"""
+	Client of the Kitbuilder image gallery api.
+
+	The CSRF token received at login is reused by every request until the server rejects it
+	(HTTP 419), then it is fetched again once and shared by all threads. Bulk methods run a
+	bounded number of requests at the same time over the connection pool of a single session
+	and retry transient errors with an exponential backoff. Uploads (POST) are only retried when
+	the server cannot have processed them, so a retry never adds the same image twice.
+
+	Attributes:
+		url (str): Base url of the api.
+		workers (int): Maximum number of concurrent requests of the bulk methods.
+		retries (int): Number of retries of a request after a transient error.
+		backoff (float): Delay before the first retry in seconds, doubled on each retry.
+		timeout (float): Timeout of each request in seconds.
+		gallery_cache (GalleryCache): Local copy of the gallery pages, None to always download them.
+		upload_index (UploadIndex): Images already uploaded, None to upload every image.
+	"""
 	url = 'https://127.0.0.1:9000/kitbuilder/'
-	def __init__(self, user_creds):
+	# Statuses worth retrying: rate limited, server errors and gateway errors
+	transient_statuses = [429, 500, 502, 503, 504]
+	# Methods that have the same effect when they are sent twice
+	idempotent_methods = ['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE']
+	# Statuses of requests the server refused without processing them, retried for every method
+	unprocessed_statuses = [429, 503]
+	# Laravel answers 419 when the CSRF token expired
+	token_mismatch_status = 419
+
+	def __init__(self,
+			user_creds,
+			base_url: Optional[str] = None,
+			workers: int = 4,
+			retries: int = 3,
+			backoff: float = 0.5,
+			timeout: float = 30,
+			gallery_cache: Optional[GalleryCache] = None,
+			upload_index: Optional[UploadIndex] = None
+		):
 		super(Kitbuilder, self).__init__()
-		self.url = ''
+		self.url = base_url or Kitbuilder.url
+		self.workers = workers
+		self.retries = retries
+		self.backoff = backoff
+		self.timeout = timeout
+		self.gallery_cache = gallery_cache
+		self.upload_index = upload_index
 		self.session = requests.Session()
+		# One connection per concurrent request, kept alive between requests
+		adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, workers))
+		self.session.mount('http://', adapter)
+		self.session.mount('https://', adapter)
+		self.token_lock = threading.Lock()
 		self.user_creds = user_creds
 		self.user = None
 		self.headers = None
-		self.cookies = None		
+		self.cookies = None
 		try:
 			self.login()
 			self.status = 'on'
-		except:
-			print('Could not connect to Kitbuilder api')
-			self.status = 'off'		
+		except Exception as e:
+			print(f'Could not connect to Kitbuilder api: {e}')
+			self.status = 'off'
 
 	def getToken(self, url, token={}):
-		page = self.session.get(url)
-		soup = BeautifulSoup(page.text, 'html.parser')		
+		page = self.session.get(url, timeout=self.timeout)
+		soup = BeautifulSoup(page.text, 'html.parser')
 		tag = token.get('tag', 'meta')
 		search = token.get('search', {"name": "csrf-token"})
 		attr = token.get('value', 'content')
-		token = soup.find(tag, search).get(attr)			
+		token = soup.find(tag, search).get(attr)
 		return token
 
 	def login(self):
-		login_url = f'{Kitbuilder.url}login'
-		sanctum_url = f'{Kitbuilder.url}sanctum/csrf-cookie'
+		login_url = f'{self.url}login'
+		sanctum_url = f'{self.url}sanctum/csrf-cookie'
 		payload = {
 			'email': self.user_creds['username'],
 			'password': self.user_creds['password']
 		}
-		sanctum_page_response = self.session.get(sanctum_url)
-		if 'XSRF-TOKEN' in self.session.cookies:
-			xsrf_token = self.session.cookies['XSRF-TOKEN']		
+		self.session.get(sanctum_url, timeout=self.timeout).raise_for_status()
+		xsrf_token = self.session.cookies.get('XSRF-TOKEN')
 		csrf_token = self.getToken(login_url)
-		self.headers = {			
+		self.headers = {
 			'X-CSRF-TOKEN': csrf_token,
     		'Accept': "application/json",
-    		'Referer': Kitbuilder.url
+    		'Referer': self.url
 		}
 		self.cookies = {
 			'csrftoken': csrf_token,
 			'XSRF-TOKEN': xsrf_token
-		}		
-		r = self.session.post(login_url, data=payload, headers=self.headers)		
-
-	def getImages(self, page=1, user='all'):		
-		gallery_url = f'{Kitbuilder.url}api/images/?page=1&user=all'
-		print('Reach endpoint: ', gallery_url)
-		print('Open this url: ', gallery_url)		
-		r = self.session.get(gallery_url, headers=self.headers)		
-		images = r.json()		
+		}
+		r = self.session.post(login_url, data=payload, headers=self.headers, timeout=self.timeout)
+		# A rejected login would otherwise only show up later, as 401 or 419 answers
+		r.raise_for_status()
+
+	def refreshToken(self, rejected_token: str) -> None:
+		"""
+		Fetch a new CSRF token after the server rejected `rejected_token`. When several threads
+		get rejected at the same time, only the first one fetches the token.
+		"""
+		with self.token_lock:
+			if self.headers['X-CSRF-TOKEN'] == rejected_token:
+				print('CSRF token expired, fetching a new one')
+				self.headers = {**self.headers, 'X-CSRF-TOKEN': self.getToken(f'{self.url}api/images')}
+
+	@staticmethod
+	def isConnectError(error: requests.RequestException) -> bool:
+		""" Whether a request failed while connecting, so the server never received it """
+		if isinstance(error, requests.ConnectTimeout):
+			return True
+		reason = getattr(error.args[0], 'reason', None) if error.args else None
+		return isinstance(reason, (ConnectTimeoutError, NewConnectionError))
+
+	def request(self, method: str, url: str, **kwargs) -> requests.Response:
+		"""
+		Send a request with the cached CSRF token, retrying transient errors with an exponential backoff.
+
+		Idempotent methods are retried on connection errors, timeouts and `transient_statuses`.
+		Other methods (uploads) may already have been processed when the connection drops or the
+		server fails, so they are only retried when the connection could not be opened and on
+		`unprocessed_statuses`.
+
+		Args:
+			method (str): The HTTP method.
+			url (str): The request url.
+			**kwargs: Passed to `requests.Session.request` (files, params...). Bodies must be
+				bytes, not open files, so they can be sent again. `headers` are added to the
+				default ones.
+
+		Returns:
+			requests.Response: The response. Transient error statuses are returned after the last retry.
+
+		Raises:
+			requests.RequestException: The connection still failed after the last retry.
+		"""
+		extra_headers = kwargs.pop('headers', {})
+		idempotent = method.upper() in Kitbuilder.idempotent_methods
+		retried_statuses = Kitbuilder.transient_statuses if idempotent else Kitbuilder.unprocessed_statuses
+		refreshed = False
+		attempt = 0
+		while True:
+			headers = self.headers
+			try:
+				r = self.session.request(method, url, headers={**headers, **extra_headers}, timeout=self.timeout, **kwargs)
+			except (requests.ConnectionError, requests.Timeout) as e:
+				if attempt >= self.retries or not (idempotent or Kitbuilder.isConnectError(e)):
+					raise
+			else:
+				if r.status_code == Kitbuilder.token_mismatch_status and not refreshed:
+					# Not a transient error: retry at once with a new token
+					refreshed = True
+					self.refreshToken(headers['X-CSRF-TOKEN'])
+					continue
+				if r.status_code not in retried_statuses or attempt >= self.retries:
+					return r
+			time.sleep(self.backoff * 2 ** attempt)
+			attempt += 1
+
+	def getImages(self, page=1, user='all'):
+		images = self.fetchPage(page, user)
+		if self.gallery_cache:
+			self.gallery_cache.save()
 		return images
 
+	def fetchPage(self, page: int = 1, user: str = 'all'):
+		"""
+		Get a page of the gallery, from the gallery cache when it did not change.
 
-	def storeImage(self, image_url):
-		gallery_url = f'{Kitbuilder.url}api/images'
-		print('POST to following endpoint: ', gallery_url)
-		files = {'image_to_upload': open(image_url,'rb')}
-		payload = {
-			'name': os.path.basename(image_url)
-		}
-		self.headers['X-CSRF-TOKEN'] = self.getToken(gallery_url)
-		r = self.session.post(gallery_url, headers=self.headers, files=files, params=payload)
-		image = r.json()
-		print('====> ', image)
+		Args:
+			page (int): The page number, from 1.
+			user (str): The owner of the images, 'all' for every user.
+
+		Returns:
+			The decoded JSON page.
+		"""
+		cache = self.gallery_cache
+		key = GalleryCache.key(page, user)
+		entry = cache.get(key) if cache else None
+		if entry and cache.isFresh(entry):
+			return entry['body']
+		gallery_url = f'{self.url}api/images/'
+		print('Reach endpoint: ', gallery_url, f'page={page} user={user}')
+		r = self.request('GET', gallery_url, params={'page': page, 'user': user}, headers=GalleryCache.validators(entry))
+		if r.status_code == 304:
+			if not entry:
+				raise requests.HTTPError(f'Gallery page {page} not modified, but it is not in the gallery cache', response=r)
+			cache.touch(key)
+			return entry['body']
+		r.raise_for_status()
+		images = r.json()
+		if cache:
+			cache.put(key, images, r.headers)
+		return images
+
+	@staticmethod
+	def pageImages(body, page: int) -> Tuple[list, bool]:
+		"""
+		Read a gallery page.
+
+		Args:
+			body: The decoded JSON page, a paginator ({'data', 'current_page', 'last_page'...}) or a list.
+			page (int): The page number.
+
+		Returns:
+			Tuple[list, bool]: The images of the page and whether there is a next page.
+		"""
+		if isinstance(body, list):
+			return body, False
+		images = body.get('data') or []
+		if 'next_page_url' in body:
+			has_next = bool(body['next_page_url'])
+		else:
+			has_next = page < body.get('last_page', page)
+		return images, has_next and bool(images)
+
+	def iterImages(self, user: str = 'all', start_page: int = 1) -> Iterator[dict]:
+		"""
+		Walk the whole gallery lazily, one page at a time. The next page is downloaded in the
+		background while the caller handles the images of the current one.
+
+		Args:
+			user (str): The owner of the images, 'all' for every user.
+			start_page (int): The first page.
+
+		Yields:
+			dict: Each image of the gallery.
+		"""
+		page = start_page
 		try:
-			return image['url']
-		except KeyError:
-			return ''
-		return ''
+			with ThreadPoolExecutor(max_workers=1) as executor:
+				future = executor.submit(self.fetchPage, page, user)
+				while future:
+					images, has_next = Kitbuilder.pageImages(future.result(), page)
+					page += 1
+					future = executor.submit(self.fetchPage, page, user) if has_next else None
+					yield from images
+		finally:
+			if self.gallery_cache:
+				self.gallery_cache.save()
 
-	def deleteImage(self, image_id):
-		gallery_url = f'{Kitbuilder.url}api/images/{image_id}'
-		print('DEL to following endpoint: ', gallery_url)		
-		self.headers['X-CSRF-TOKEN'] = self.getToken(gallery_url)
-		r = self.session.delete(gallery_url, headers=self.headers)
-		response = r.json()		
+	def uploadImage(self, image_path: str) -> dict:
+		"""
+		Upload an image.
+
+		Args:
+			image_path (str): The image path.
+
+		Returns:
+			dict: `path` and the upload result (see `uploadBytes`).
+		"""
 		try:
-			return response['response']
-		except KeyError:
-			return response['error']
+			with open(image_path, 'rb') as f:
+				content = f.read()
+		except OSError as e:
+			return {'path': image_path, 'url': '', 'id': None, 'error': str(e), 'duplicate': False}
+		return {'path': image_path, **self.uploadBytes(content, os.path.basename(image_path))}
+
+	def uploadBytes(self, content: bytes, name: str) -> dict:
+		"""
+		Upload an image from memory. With an upload index, content that was already uploaded is
+		not sent again: the url of the existing image is returned.
+
+		Args:
+			content (bytes): The image file content.
+			name (str): The image file name.
+
+		Returns:
+			dict: `url` of the image (empty on failure), gallery `id`, `error` (None on success)
+				and `duplicate` (True if the content was already uploaded).
+		"""
+		index = self.upload_index
+		if index is None:
+			return self.postImage(content, name)
+		digest = UploadIndex.hashBytes(content)
+		with index.uploadLock(digest):
+			entry = index.get(digest)
+			if entry:
+				return {'url': entry['url'], 'id': entry['id'], 'error': None, 'duplicate': True}
+			result = self.postImage(content, name)
+			if result['error'] is None:
+				index.add(digest, result['url'], result['id'])
+		return result
+
+	def postImage(self, content: bytes, name: str) -> dict:
+		try:
+			r = self.request('POST', f'{self.url}api/images',
+				files={'image_to_upload': (name, content)}, params={'name': name})
+			image = r.json()
+		except (ValueError, requests.RequestException) as e:
+			return {'url': '', 'id': None, 'error': str(e), 'duplicate': False}
+		if 'url' not in image:
+			error = image.get('error') or image.get('message') or f'HTTP {r.status_code}'
+			return {'url': '', 'id': None, 'error': error, 'duplicate': False}
+		return {'url': image['url'], 'id': image.get('id'), 'error': None, 'duplicate': False}
+
+	def removeImage(self, image_id) -> dict:
+		"""
+		Delete an image of the gallery.
+
+		Args:
+			image_id: The image id.
+
+		Returns:
+			dict: `id`, server `response` and `error` (None on success).
+		"""
+		try:
+			r = self.request('DELETE', f'{self.url}api/images/{image_id}')
+			response = r.json()
+		except (ValueError, requests.RequestException) as e:
+			return {'id': image_id, 'response': None, 'error': str(e)}
+		if 'response' not in response:
+			return {'id': image_id, 'response': None, 'error': response.get('error') or f'HTTP {r.status_code}'}
+		if self.upload_index is not None:
+			self.upload_index.removeId(image_id)
+		return {'id': image_id, 'response': response['response'], 'error': None}
+
+	def storeImages(self, image_paths: List[str], on_result: Optional[Callable[[dict], None]] = None) -> List[dict]:
+		"""
+		Upload images concurrently, at most `workers` at a time.
+
+		Args:
+			image_paths (List[str]): The image paths.
+			on_result (Callable[[dict], None]): Called with the result of each image as soon as it is uploaded.
+
+		Returns:
+			List[dict]: One result per image, in the same order (see `uploadImage`).
+		"""
+		results = self.runBulk(self.uploadImage, image_paths, on_result)
+		self.saveUploadIndex()
+		return results
+
+	def deleteImages(self, image_ids: list, on_result: Optional[Callable[[dict], None]] = None) -> List[dict]:
+		"""
+		Delete images concurrently, at most `workers` at a time.
+
+		Args:
+			image_ids (list): The image ids.
+			on_result (Callable[[dict], None]): Called with the result of each image as soon as it is deleted.
+
+		Returns:
+			List[dict]: One result per image, in the same order (see `removeImage`).
+		"""
+		results = self.runBulk(self.removeImage, image_ids, on_result)
+		self.saveUploadIndex()
+		return results
+
+	def saveUploadIndex(self) -> None:
+		if self.upload_index is not None:
+			self.upload_index.save()
+
+	def rebuildUploadIndex(self, user: str = 'all') -> int:
+		"""
+		Rebuild the upload index from the gallery listing. Images are downloaded to hash their
+		content, unless the gallery provides a `sha256` field. Urls are stored as the server
+		returns them, like uploads do.
+
+		When every image is indexed, the index is replaced (images deleted from the gallery are
+		forgotten). When some images cannot be downloaded, the indexed ones are merged into the
+		existing entries, so a failing server never empties the index.
+
+		Args:
+			user (str): The owner of the images, 'all' for every user.
+
+		Returns:
+			int: Number of distinct images indexed.
+
+		Raises:
+			ValueError: The client has no upload index.
+		"""
+		if self.upload_index is None:
+			raise ValueError('Cannot rebuild the upload index: the Kitbuilder client has no upload index')
+
+		def hashImage(image):
+			url = urljoin(self.url, image['url'])
+			try:
+				digest = image.get('sha256')
+				if not digest:
+					r = self.request('GET', url)
+					r.raise_for_status()
+					digest = UploadIndex.hashBytes(r.content)
+			except requests.RequestException as e:
+				print(f'Could not index image {url}: {e}')
+				return None
+			return digest, {'url': image['url'], 'id': image.get('id')}
+
+		images = [image for image in self.iterImages(user) if image.get('url')]
+		entries = {}
+		indexed = self.runBulk(hashImage, images)
+		for entry in indexed:
+			# The first image wins when the gallery already holds duplicates
+			if entry and entry[0] not in entries:
+				entries[entry[0]] = entry[1]
+		failed = indexed.count(None)
+		if failed:
+			print(f'{failed} image(s) could not be indexed, the previous entries are kept')
+			self.upload_index.update(entries)
+		else:
+			self.upload_index.replace(entries)
+		self.upload_index.save()
+		return len(entries)
+
+	def runBulk(self, action: Callable, items: list, on_result: Optional[Callable[[dict], None]] = None) -> List[dict]:
+		def run(item):
+			result = action(item)
+			if on_result:
+				on_result(result)
+			return result
+		if len(items) <= 1 or self.workers <= 1:
+			return [run(item) for item in items]
+		with ThreadPoolExecutor(max_workers=min(self.workers, len(items))) as executor:
+			return list(executor.map(run, items))
+
+	def storeImage(self, image_url):
+		print('POST to following endpoint: ', f'{self.url}api/images')
+		result = self.uploadImage(image_url)
+		self.saveUploadIndex()
+		print('====> ', result)
+		return result['url']
+
+	def deleteImage(self, image_id):
+		print('DEL to following endpoint: ', f'{self.url}api/images/{image_id}')
+		result = self.removeImage(image_id)
+		self.saveUploadIndex()
+		return result['response'] if result['error'] is None else result['error']
 
 	@staticmethod
 	def save(content):
 		with open('report.html', 'a', encoding='utf-8') as f:
-			f.write(content)
\ No newline at end of file
+			f.write(content)
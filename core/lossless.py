@@ -0,0 +1,148 @@
+import time, zlib
+import numpy as np
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from PIL import Image
+
+# Pillow picks the zlib strategy from the image mode (filtered, or default for palette images)
+PILLOW_STRATEGY = -1
+# Plain encode, the previous behavior: the baseline of the report and the fallback
+PNG_BASELINE = (9, PILLOW_STRATEGY)
+# zlib settings tried on every PNG: (compress_level, strategy). Level 9 also turns on Pillow's `optimize`
+PNG_TRIALS = [
+	(9, zlib.Z_DEFAULT_STRATEGY),
+	(9, zlib.Z_FILTERED),
+	(9, zlib.Z_RLE),
+	(9, zlib.Z_HUFFMAN_ONLY),
+]
+# Settings of the smallest profile: lower levels and fixed Huffman codes sometimes beat level 9
+PNG_TRIALS_SMALLEST = PNG_TRIALS + [(9, zlib.Z_FIXED)] + [
+	(level, strategy) for level in (6, 7, 8) for strategy in (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED)
+]
+# Save parameters set by each trial, the other ones (ex: `dpi`) are passed to every encode
+TRIAL_PARAMS = ('optimize', 'compress_level', 'compress_type')
+STRATEGY_NAMES = {
+	PILLOW_STRATEGY: 'pillow',
+	zlib.Z_DEFAULT_STRATEGY: 'default',
+	zlib.Z_FILTERED: 'filtered',
+	zlib.Z_RLE: 'rle',
+	zlib.Z_HUFFMAN_ONLY: 'huffman',
+	zlib.Z_FIXED: 'fixed',
+}
+# Modes whose colors are counted to try a palette
+PALETTE_MODES = ('RGB', 'RGBA', 'LA', 'P', 'PA')
+
+def encodePng(im: Image.Image, compress_level: int = 9, strategy: int = PILLOW_STRATEGY, params: Optional[dict] = None) -> bytes:
+	buffer = BytesIO()
+	# Pillow keeps the save parameters on the image: every thread saves its own copy
+	im.copy().save(buffer, format='PNG', **(params or {}), optimize=compress_level == 9, compress_level=compress_level, compress_type=strategy)
+	return buffer.getvalue()
+
+def toPalette(im: Image.Image) -> Tuple[Optional[Image.Image], int]:
+	"""
+	Convert an image with 256 colors or less to palette mode, keeping every pixel exactly
+	(with its alpha: palette entries get their own transparency, in a tRNS chunk).
+
+	Colors are counted with NumPy, each pixel packed into a 32 bits integer.
+
+	Args:
+		im (Image.Image): The image.
+
+	Returns:
+		Tuple[Image.Image or None, int]: The palette image (None when there are more than 256
+			colors) and the number of colors.
+	"""
+	alpha = 'A' in im.getbands() or 'transparency' in im.info
+	pixels = np.asarray(im.convert('RGBA' if alpha else 'RGB'))
+	height, width, bands = pixels.shape
+	packed = np.zeros((height, width), dtype=np.uint32)
+	for band in range(bands):
+		packed |= pixels[..., band].astype(np.uint32) << (8 * band)
+	colors, inverse = np.unique(packed.ravel(), return_inverse=True)
+	if len(colors) > 256:
+		return None, len(colors)
+
+	palette = np.stack([(colors >> (8 * band)) & 0xFF for band in range(bands)], axis=-1).astype(np.uint8)
+	# Transparent colors first: the tRNS chunk stops at the last transparent entry
+	order = np.argsort(palette[:, 3] == 255, kind='stable') if alpha else np.arange(len(colors))
+	rank = np.empty_like(order)
+	rank[order] = np.arange(len(order))
+	palette = palette[order]
+
+	reduced = Image.fromarray(rank[inverse].reshape(height, width).astype(np.uint8), 'P')
+	reduced.putpalette(palette[:, :3].tobytes())
+	if alpha:
+		transparent = int(np.count_nonzero(palette[:, 3] < 255))
+		if transparent:
+			reduced.info['transparency'] = palette[:transparent, 3].tobytes()
+	return reduced, len(colors)
+
+def samePixels(im: Image.Image, data: bytes) -> bool:
+	""" Whether an encoded PNG decodes to exactly the pixels of an image """
+	with Image.open(BytesIO(data)) as decoded:
+		mode = 'RGBA' if 'A' in im.getbands() or 'transparency' in im.info else im.mode
+		if mode == 'P':
+			mode = 'RGB'
+		return np.array_equal(np.asarray(im.convert(mode)), np.asarray(decoded.convert(mode)))
+
+def optimizePng(im: Image.Image,
+		trials: List[Tuple[int, int]] = PNG_TRIALS,
+		params: Optional[dict] = None
+	) -> Tuple[bytes, dict]:
+	"""
+	Encode a PNG as small as possible without changing any pixel.
+
+	Images with 256 colors or less are written as palette images, and the alpha channel of fully
+	opaque images is dropped. Every zlib setting of `trials` is then tried in parallel threads
+	(zlib releases the GIL) and the smallest output is kept. A reduced output is decoded and
+	compared with `im`, and the plain encode is kept if a pixel differs.
+
+	Args:
+		im (Image.Image): The image.
+		trials (List[Tuple[int, int]]): (compress_level, strategy) settings to try.
+		params (dict, optional): Other Pillow save parameters (ex: `dpi`). The ones of `TRIAL_PARAMS`
+			are left out, the trials set them.
+
+	Returns:
+		Tuple[bytes, dict]: The PNG and its report: `colors` (None when not counted), `mode`,
+			`compress_level`, `strategy`, `baseline_bytes` (plain `optimize=True` encode),
+			`saved_bytes` and `cpu_seconds` (CPU time of the whole stage, over all threads).
+	"""
+	start = time.thread_time()
+	candidate, colors = im, None
+	if im.mode in PALETTE_MODES:
+		reduced, colors = toPalette(im)
+		if reduced is not None:
+			candidate = reduced
+		elif im.mode == 'RGBA' and im.getchannel('A').getextrema()[0] == 255:
+			# Fully opaque: the alpha channel is only weight
+			candidate = im.convert('RGB')
+	params = {key: value for key, value in (params or {}).items() if key not in TRIAL_PARAMS}
+
+	def trial(job):
+		begin = time.thread_time()
+		data = encodePng(*job, params)
+		return data, time.thread_time() - begin
+
+	jobs = [(im,) + PNG_BASELINE] + [(candidate,) + settings for settings in trials]
+	with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+		outputs = list(executor.map(trial, jobs))
+
+	baseline = outputs[0][0]
+	best = min(range(1, len(outputs)), key=lambda i: len(outputs[i][0]))
+	data, (chosen, compress_level, strategy) = outputs[best][0], jobs[best]
+	if len(data) >= len(baseline) or (chosen is not im and not samePixels(im, data)):
+		if len(data) < len(baseline):
+			print(f'PNG {chosen.mode} reduction changed pixels, keep the plain encode')
+		data, (chosen, compress_level, strategy) = baseline, jobs[0]
+	cpu = time.thread_time() - start + sum(seconds for _, seconds in outputs)
+	return data, {
+		'colors': colors,
+		'mode': chosen.mode,
+		'compress_level': compress_level,
+		'strategy': STRATEGY_NAMES.get(strategy, strategy),
+		'baseline_bytes': len(baseline),
+		'saved_bytes': len(baseline) - len(data),
+		'cpu_seconds': round(cpu, 4)
+	}
@@ -0,0 +1,122 @@
+import os, json, tempfile
+from typing import Dict, Iterable, Iterator, List, Optional
+
+class Manifest(object):
+	"""
+	Per-folder record of the images already optimized, used by the incremental folder mode.
+
+	Each source image is stored with the size and modification time it had once optimized and
+	the names of every output written from it, so only new or modified images are processed on
+	the next run and the outputs themselves (of this run or earlier ones) are never taken as new
+	sources. Images that failed are recorded with their error and skipped until they change.
+
+	Attributes:
+		folder (str): The folder containing the images.
+		path (str): The path of the manifest file.
+		entries (dict): Source image path, relative to the folder => {'size', 'mtime', 'outputs'},
+			and 'error' when the image could not be optimized.
+	"""
+
+	filename = '.optimizer-manifest.json'
+
+	def __init__(self, folder: str):
+		super(Manifest, self).__init__()
+		self.folder = folder
+		self.path = os.path.join(folder, Manifest.filename)
+		self.entries: Dict[str, dict] = {}
+		self.load()
+
+	def load(self) -> None:
+		try:
+			with open(self.path, encoding='utf-8') as json_data:
+				self.entries = json.load(json_data)
+		except FileNotFoundError:
+			self.entries = {}
+		except ValueError:
+			print(f'Invalid manifest, every image will be processed: {self.path}')
+			self.entries = {}
+
+	def save(self) -> None:
+		""" Write the manifest through a temporary file so a crash never leaves it truncated """
+		fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+		try:
+			with os.fdopen(fd, 'w', encoding='utf-8') as f:
+				json.dump(self.entries, f, indent=1)
+			os.replace(tmp_path, self.path)
+		except OSError:
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+			raise
+
+	@staticmethod
+	def entryOutputs(entry: dict) -> List[str]:
+		# Manifests written before outputs were kept have a single 'output'
+		outputs = list(entry.get('outputs', []))
+		if entry.get('output') and entry['output'] not in outputs:
+			outputs.append(entry['output'])
+		return outputs
+
+	def outputs(self) -> set:
+		return {output for entry in self.entries.values() for output in Manifest.entryOutputs(entry)}
+
+	def isChanged(self, name: str, stat: os.stat_result) -> bool:
+		"""
+		Check whether an image is new or was modified since it was optimized.
+
+		Args:
+			name (str): The image name, relative to the folder.
+			stat (os.stat_result): The current stat of the image.
+
+		Returns:
+			bool: True if the image needs to be processed.
+		"""
+		entry = self.entries.get(name)
+		return entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns
+
+	def pending(self, images: List[str]) -> List[str]:
+		"""
+		Keep the images that are new or modified, leaving out outputs of previous runs.
+
+		Args:
+			images (List[str]): Image names, relative to the folder.
+
+		Returns:
+			List[str]: The images to process.
+		"""
+		return list(self.filter(images))
+
+	def filter(self, images: Iterable[str]) -> Iterator[str]:
+		""" Lazy version of `pending`: images are checked as they come """
+		outputs = self.outputs()
+		for name in images:
+			if name in outputs and name not in self.entries:
+				continue
+			try:
+				stat = os.stat(os.path.join(self.folder, name))
+			except FileNotFoundError:
+				continue
+			if self.isChanged(name, stat):
+				yield name
+
+	def update(self, name: str, outputs: Iterable[str] = (), error: Optional[str] = None) -> None:
+		"""
+		Record an optimized image. The image is stat-ed after processing so that, in overwrite
+		mode, the optimized file replacing the source is not seen as modified on the next run.
+		The outputs of previous runs stay recorded, so they are not taken as new sources once
+		a modified image gets new output names.
+
+		Args:
+			name (str): The image name, relative to the folder.
+			outputs (Iterable[str]): The output paths of the image.
+			error (str, optional): The error of an image that could not be optimized: it is
+				skipped until its size or modification time changes.
+		"""
+		stat = os.stat(os.path.join(self.folder, name))
+		recorded = Manifest.entryOutputs(self.entries.get(name, {}))
+		for output in outputs:
+			output = os.path.relpath(output, self.folder)
+			if output not in recorded:
+				recorded.append(output)
+		self.entries[name] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'outputs': recorded}
+		if error:
+			self.entries[name]['error'] = error
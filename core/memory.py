@@ -0,0 +1,181 @@
+import math
+from typing import Optional, Tuple
+from PIL import Image
+from core.metadata import ImageInfo
+
+# Images above this number of pixels take the large image path (0 disables it)
+LARGE_PIXELS = 50_000_000
+# Source rows decoded at once by the strip path, in bytes
+STRIP_BYTES = 32 * 1024 * 1024
+# Bits per pixel of the raw modes the strip path can split into rows
+RAW_BITS = {
+	'1': 1, 'L': 8, 'P': 8, 'LA': 16, 'RGB': 24, 'BGR': 24, 'RGBA': 32, 'RGBX': 32, 'BGRA': 32, 'BGRX': 32,
+	'RGBa': 32, 'CMYK': 32, 'I;16': 16, 'I;16B': 16, 'I': 32, 'F': 32, 'I;32': 32, 'F;32F': 32
+}
+# Support of the LANCZOS filter, in pixels of the output
+LANCZOS_SUPPORT = 3
+
+def pixelBytes(mode: str) -> int:
+	""" Bytes per pixel of an image decoded in memory by Pillow (3 band modes are stored on 4 bytes) """
+	if mode in ('1', 'L', 'P'):
+		return 1
+	if mode.startswith('I;16'):
+		return 2
+	return 4
+
+def draftScale(info: ImageInfo, size: Tuple[int, int]) -> int:
+	""" Scale (1, 2, 4 or 8) of the JPEG DCT scaling used by `Image.draft` for a requested size """
+	scale = 1
+	while scale < 8 and info.width // (scale * 2) >= size[0] and info.height // (scale * 2) >= size[1]:
+		scale *= 2
+	return scale
+
+def estimateMemory(info: ImageInfo, config: dict) -> int:
+	"""
+	Estimate the memory used to optimize an image, from its header only: the decoded source,
+	the resized image and the copies made to convert and encode it.
+
+	Args:
+		info (ImageInfo): The image metadata.
+		config (dict): The optimizer configuration settings.
+
+	Returns:
+		int: The estimated peak memory in bytes.
+	"""
+	widths = [width for width in (config.get('renditions') or [config.get('base_width', 0)]) if width]
+	width = min(max(widths), info.width) if widths else info.width
+	size = (width, max(1, int(info.height * width / info.width)))
+	decoded = info.area
+	if size[0] < info.width and info.format == 'JPEG' and (config.get('draft', True) or isLarge(info.area, config)):
+		decoded = info.area // draftScale(info, size) ** 2
+	bytes_per_pixel = pixelBytes(info.mode)
+	# Resized image, converted copy and encoder buffers
+	return decoded * bytes_per_pixel + 3 * size[0] * size[1] * 4
+
+def isLarge(pixels: int, config: dict) -> bool:
+	threshold = config.get('large_pixels', LARGE_PIXELS)
+	return bool(threshold) and pixels > threshold
+
+class MemoryBudget(object):
+	"""
+	Admission control of the images processed at the same time.
+
+	An image is admitted while the estimated memory of the running images plus its own stays
+	under the limit. An image larger than the whole budget is admitted alone.
+
+	Usage:
+		cost = MemoryBudget.estimate(info, config)
+		while not budget.fits(cost):
+			... wait for a running image and release its cost
+		budget.acquire(cost)
+
+	Attributes:
+		limit (int): The memory budget in bytes.
+		used (int): Estimated memory of the admitted images.
+	"""
+	def __init__(self, limit: int):
+		super(MemoryBudget, self).__init__()
+		self.limit = limit
+		self.used = 0
+
+	@staticmethod
+	def estimate(info: Optional[ImageInfo], config: dict) -> int:
+		# Unreadable images fail at once in the worker
+		return estimateMemory(info, config) if info else 0
+
+	def fits(self, amount: int) -> bool:
+		return self.used == 0 or self.used + amount <= self.limit
+
+	def acquire(self, amount: int) -> None:
+		self.used += amount
+
+	def release(self, amount: int) -> None:
+		self.used -= amount
+
+	@staticmethod
+	def fromConfig(config: dict) -> Optional['MemoryBudget']:
+		"""
+		Create the budget described by the `memory_budget` setting (in MB).
+
+		Returns:
+			MemoryBudget or None: The budget, or None without limit.
+		"""
+		if not config.get('memory_budget'):
+			return None
+		return MemoryBudget(int(config['memory_budget'] * 1024 * 1024))
+
+def _rowLayout(im: Image.Image) -> Optional[list]:
+	"""
+	Row layout of an uncompressed image: [(y0, y1, offset, stride, rawmode, orientation)] for each
+	strip of rows, or None if the image data cannot be read a few rows at a time.
+	"""
+	layout = []
+	for tile in im.tile:
+		codec, (x0, y0, x1, y1), offset, args = tile
+		if codec != 'raw' or x0 != 0 or x1 != im.width:
+			return None
+		rawmode, stride, orientation = (args, 0, 1) if isinstance(args, str) else (tuple(args) + (0, 1))[:3]
+		if not stride:
+			if rawmode not in RAW_BITS:
+				return None
+			stride = (RAW_BITS[rawmode] * im.width + 7) // 8
+		layout.append((y0, y1, offset, stride, rawmode, orientation or 1))
+	return layout or None
+
+def _decodeRows(path: str, im: Image.Image, layout: list, top: int, bottom: int) -> Image.Image:
+	""" Decode the rows [top, bottom) of an uncompressed image """
+	band = Image.new(im.mode, (im.width, bottom - top))
+	with open(path, 'rb') as fp:
+		for y0, y1, offset, stride, rawmode, orientation in layout:
+			start, end = max(y0, top), min(y1, bottom)
+			if start >= end:
+				continue
+			# Bottom-up strips (ex: BMP) store their last row first
+			skipped = start - y0 if orientation > 0 else y1 - end
+			fp.seek(offset + skipped * stride)
+			data = fp.read((end - start) * stride)
+			rows = Image.frombytes(im.mode, (im.width, end - start), data, 'raw', rawmode, stride, orientation)
+			band.paste(rows, (0, start - top))
+	return band
+
+def resizeInStrips(path: str, im: Image.Image, size: Tuple[int, int], strip_bytes: int = STRIP_BYTES) -> Optional[Image.Image]:
+	"""
+	Resize an uncompressed image (ex: TIFF without compression, BMP) without decoding it whole.
+
+	Rows of the source are decoded a strip at a time and resized into their part of the output.
+	Each strip is decoded with a margin of rows around it, so the LANCZOS filter sees the same
+	pixels as when resizing the full image.
+
+	Args:
+		path (str): The image path.
+		im (Image.Image): The opened, not loaded, image.
+		size (tuple): The output size.
+		strip_bytes (int): Approximate memory of each strip of decoded rows.
+
+	Returns:
+		Image.Image or None: The resized image, or None if the image data is compressed.
+	"""
+	layout = _rowLayout(im)
+	if layout is None or im.mode not in ('1', 'L', 'P', 'LA', 'RGB', 'RGBA', 'RGBX', 'CMYK', 'I', 'F', 'I;16', 'I;16B'):
+		return None
+	width, height = im.size
+	scale = height / size[1]
+	margin = math.ceil(LANCZOS_SUPPORT * max(scale, 1)) + 1
+	source_rows = max(1, strip_bytes // (width * pixelBytes(im.mode)))
+	output_rows = max(1, int(source_rows / scale))
+
+	output = None
+	for top in range(0, size[1], output_rows):
+		bottom = min(size[1], top + output_rows)
+		box_top, box_bottom = top * scale, bottom * scale
+		rows_top = max(0, math.floor(box_top) - margin)
+		rows_bottom = min(height, math.ceil(box_bottom) + margin)
+		band = _decodeRows(path, im, layout, rows_top, rows_bottom)
+		part = band.resize((size[0], bottom - top), Image.Resampling.LANCZOS,
+			box=(0, box_top - rows_top, width, box_bottom - rows_top))
+		if output is None:
+			output = Image.new(part.mode, size)
+			if im.mode == 'P':
+				output.putpalette(im.getpalette())
+		output.paste(part, (0, top))
+	return output
@@ -0,0 +1,171 @@
+import os, threading
+from collections import OrderedDict
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+from PIL import Image
+from core.discovery import walkImages
+
+# EXIF tag of the image orientation
+ORIENTATION = 0x0112
+# Images kept by a metadata index, the least recently used ones are dropped first
+MAX_ENTRIES = 10000
+
+class ImageInfo(NamedTuple):
+	"""
+	Image metadata read from the file header only, without decoding any pixel data.
+
+	Attributes:
+		path (str): The image path.
+		size (tuple): The image size (width, height).
+		mode (str): The Pillow mode (RGB, RGBA, P...).
+		format (str): The Pillow format (JPEG, PNG...).
+		animated (bool): Whether the image has more than one frame.
+		orientation (int): EXIF orientation (1 when missing).
+		file_size (int): The file size in bytes.
+		mtime (int): The file modification time in nanoseconds.
+	"""
+	path: str
+	size: Tuple[int, int]
+	mode: str
+	format: str
+	animated: bool
+	orientation: int
+	file_size: int
+	mtime: int
+
+	@property
+	def width(self) -> int:
+		return self.size[0]
+
+	@property
+	def height(self) -> int:
+		return self.size[1]
+
+	@property
+	def area(self) -> int:
+		return self.size[0] * self.size[1]
+
+	@property
+	def frames(self) -> int:
+		""" Number of frames, counted from the file: a GIF has to be read to its end """
+		if not self.animated:
+			return 1
+		with Image.open(self.path) as im:
+			return im.n_frames
+
+def readOrientation(im: Image.Image) -> int:
+	"""
+	Read the EXIF orientation of an opened (not loaded) image.
+
+	Args:
+		im (Image.Image): The image.
+
+	Returns:
+		int: The orientation, 1 when missing.
+	"""
+	try:
+		if 'exif' in im.info:
+			exif = Image.Exif()
+			exif.load(im.info['exif'])
+		elif im.format == 'TIFF':
+			# TIFF tags are read with the header
+			exif = im.getexif()
+		else:
+			# Other formats would have to decode the image to find EXIF data (ex: PNG)
+			return 1
+		return int(exif.get(ORIENTATION, 1))
+	except Exception:
+		return 1
+
+def probe(path: str, stat: Optional[os.stat_result] = None) -> ImageInfo:
+	"""
+	Read the metadata of an image from its header.
+
+	Args:
+		path (str): The image path.
+		stat (os.stat_result, optional): The stat of the file, if already known.
+
+	Returns:
+		ImageInfo: The image metadata.
+	"""
+	stat = stat or os.stat(path)
+	with Image.open(path) as im:
+		# Only looks for a second frame, counting them all would read a whole GIF
+		return ImageInfo(path, im.size, im.mode, im.format, getattr(im, 'is_animated', False),
+			readOrientation(im), stat.st_size, stat.st_mtime_ns)
+
+class MetadataIndex(object):
+	"""
+	Cache of image metadata. An entry is reused as long as the size and modification time
+	of its file do not change. Up to `max_entries` images are kept, the least recently used
+	ones are dropped first.
+
+	Args:
+		max_entries (int): Images kept.
+
+	Attributes:
+		entries (OrderedDict): Absolute path => ImageInfo, the most recently used last.
+	"""
+	def __init__(self, max_entries: int = MAX_ENTRIES):
+		super(MetadataIndex, self).__init__()
+		self.max_entries = max(1, max_entries)
+		self.entries: Dict[str, ImageInfo] = OrderedDict()
+		self.lock = threading.Lock()
+
+	def get(self, path: str, stat: Optional[os.stat_result] = None) -> ImageInfo:
+		"""
+		Get the metadata of an image, reading its header only if it is not cached or changed.
+
+		Args:
+			path (str): The image path.
+			stat (os.stat_result, optional): The stat of the file, if already known (ex: from os.scandir).
+
+		Returns:
+			ImageInfo: The image metadata.
+		"""
+		path = os.path.abspath(path)
+		stat = stat or os.stat(path)
+		with self.lock:
+			info = self.entries.get(path)
+			if info is not None:
+				self.entries.move_to_end(path)
+		if info is None or info.file_size != stat.st_size or info.mtime != stat.st_mtime_ns:
+			info = probe(path, stat)
+			with self.lock:
+				self.entries[path] = info
+				self.entries.move_to_end(path)
+				while len(self.entries) > self.max_entries:
+					self.entries.popitem(last=False)
+		return info
+
+	def scan(self, folder: str, extensions: List[str]) -> Iterator[ImageInfo]:
+		"""
+		Get the metadata of every image of a folder, reusing the stat of the directory entries.
+
+		Args:
+			folder (str): The folder to scan.
+			extensions (List[str]): Allowed extensions, without the dot.
+
+		Yields:
+			ImageInfo: The metadata of each readable image.
+		"""
+		for entry in scanImages(folder, extensions):
+			try:
+				yield self.get(entry.path, entry.stat())
+			except OSError as e:
+				print(f'Error reading image {entry.path}: {e}')
+
+def scanImages(folder: str, extensions: List[str]) -> Iterator[os.DirEntry]:
+	"""
+	List the image files of a folder (not its subfolders), see `core.discovery.walkImages`.
+
+	Args:
+		folder (str): The folder to scan.
+		extensions (List[str]): Allowed extensions, without the dot.
+
+	Yields:
+		os.DirEntry: The directory entry of each image.
+	"""
+	return walkImages(folder, extensions)
+
+# Shared cache used by the optimizer and the UI
+index = MetadataIndex()
@@ -0,0 +1,191 @@
+import json, math, sys, time
+from typing import Dict, List, Optional
+
+def peakMemory() -> Optional[int]:
+	""" Peak resident memory of the current process in bytes, None when not available """
+	# ru_maxrss survives exec on Linux (it would include the parent process), VmHWM does not
+	try:
+		with open('/proc/self/status') as status:
+			for line in status:
+				if line.startswith('VmHWM:'):
+					return int(line.split()[1]) * 1024
+	except OSError:
+		pass
+	try:
+		import resource
+		# Kilobytes on Linux, bytes on macOS
+		peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		return peak if sys.platform == 'darwin' else peak * 1024
+	except ImportError:
+		return None
+
+class _Stage(object):
+	__slots__ = ('timer', 'name', 'start')
+
+	def __init__(self, timer: 'StageTimer', name: str):
+		self.timer = timer
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		stages = self.timer.stages
+		stages[self.name] = stages.get(self.name, 0.0) + time.perf_counter() - self.start
+
+class StageTimer(object):
+	"""
+	Per-image instrumentation: wall time of each stage of the pipeline and counters.
+
+	Usage:
+		with timer.stage('decode'):
+			im.load()
+		timer.count('pixels', im.width * im.height)
+
+	Attributes:
+		stages (dict): Stage name => seconds.
+		counters (dict): Counter name => value (input_bytes, output_bytes, pixels...).
+	"""
+	enabled = True
+
+	def __init__(self):
+		super(StageTimer, self).__init__()
+		self.stages: Dict[str, float] = {}
+		self.counters: Dict[str, int] = {}
+
+	def stage(self, name: str) -> _Stage:
+		return _Stage(self, name)
+
+	def count(self, name: str, value: int) -> None:
+		self.counters[name] = self.counters.get(name, 0) + value
+
+	def record(self) -> dict:
+		return {'stages': self.stages, **self.counters, 'peak_memory': peakMemory()}
+
+class _NullStage(object):
+	__slots__ = ()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		return None
+
+class NullTimer(object):
+	""" Disabled instrumentation: same interface as StageTimer, does nothing """
+	enabled = False
+	_stage = _NullStage()
+
+	def stage(self, name: str) -> _NullStage:
+		return NullTimer._stage
+
+	def count(self, name: str, value: int) -> None:
+		pass
+
+	def record(self) -> Optional[dict]:
+		return None
+
+NULL_TIMER = NullTimer()
+
+def percentile(values: List[float], q: float) -> float:
+	""" Nearest-rank percentile of a list of values, q between 0 and 100 """
+	if not values:
+		return 0.0
+	ordered = sorted(values)
+	rank = max(1, math.ceil(q / 100 * len(ordered)))
+	return ordered[rank - 1]
+
+class BatchMetrics(object):
+	"""
+	Aggregate of the per-image records of a batch.
+
+	Attributes:
+		records (List[dict]): Per-image records (source, stages, counters, peak memory).
+		wall_time (float): Wall time of the batch in seconds.
+	"""
+	quantiles = [50, 90, 99]
+
+	def __init__(self, records: List[dict], wall_time: float):
+		super(BatchMetrics, self).__init__()
+		self.records = records
+		self.wall_time = wall_time
+
+	def total(self, name: str) -> int:
+		return sum(record.get(name) or 0 for record in self.records)
+
+	def summary(self) -> dict:
+		"""
+		Returns:
+			dict: Per-stage percentiles and totals, counters totals, throughput and peak memory.
+		"""
+		stages = {}
+		for record in self.records:
+			for name, seconds in record['stages'].items():
+				stages.setdefault(name, []).append(seconds)
+		wall_time = self.wall_time or float('nan')
+		peaks = [record['peak_memory'] for record in self.records if record.get('peak_memory')]
+		return {
+			'images': len(self.records),
+			'wall_time': self.wall_time,
+			'images_per_sec': len(self.records) / wall_time,
+			'input_mb_per_sec': self.total('input_bytes') / 1024 / 1024 / wall_time,
+			'input_bytes': self.total('input_bytes'),
+			'output_bytes': self.total('output_bytes'),
+			'pixels': self.total('pixels'),
+			'peak_memory': max(peaks) if peaks else None,
+			'stages': {
+				name: {
+					'count': len(values),
+					'sum': sum(values),
+					**{f'p{q}': percentile(values, q) for q in BatchMetrics.quantiles},
+					'max': max(values)
+				}
+				for name, values in stages.items()
+			}
+		}
+
+	def toJsonLines(self, path: str) -> None:
+		""" Write one JSON line per image, then a line with the batch summary """
+		with open(path, 'a', encoding='utf-8') as f:
+			for record in self.records:
+				f.write(json.dumps(record) + '\n')
+			f.write(json.dumps({'summary': self.summary()}) + '\n')
+
+	def toPrometheus(self, path: Optional[str] = None, prefix: str = 'image_optimizer') -> str:
+		"""
+		Format the batch summary in the Prometheus text exposition format.
+
+		Args:
+			path (str, optional): Write the text to this file (ex: for the node exporter textfile collector).
+			prefix (str): Prefix of the metric names.
+
+		Returns:
+			str: The metrics text.
+		"""
+		summary = self.summary()
+		lines = [
+			f'# HELP {prefix}_stage_seconds Wall time of each pipeline stage per image.',
+			f'# TYPE {prefix}_stage_seconds summary'
+		]
+		for name, stage in summary['stages'].items():
+			for q in BatchMetrics.quantiles:
+				lines.append(f'{prefix}_stage_seconds{{stage="{name}",quantile="{q / 100}"}} {stage[f"p{q}"]:.6f}')
+			lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stage["sum"]:.6f}')
+			lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+		gauges = {
+			'images': ('Images processed by the batch.', summary['images']),
+			'input_bytes': ('Bytes read from the source images.', summary['input_bytes']),
+			'output_bytes': ('Bytes written to the optimized images.', summary['output_bytes']),
+			'pixels': ('Source pixels decoded.', summary['pixels']),
+			'wall_seconds': ('Wall time of the batch.', summary['wall_time']),
+			'images_per_second': ('Throughput of the batch.', summary['images_per_sec']),
+			'peak_memory_bytes': ('Peak resident memory of the workers.', summary['peak_memory'] or 0)
+		}
+		for name, (help_text, value) in gauges.items():
+			lines += [f'# HELP {prefix}_{name} {help_text}', f'# TYPE {prefix}_{name} gauge', f'{prefix}_{name} {value}']
+		text = '\n'.join(lines) + '\n'
+		if path:
+			with open(path, 'w', encoding='utf-8') as f:
+				f.write(text)
+		return text
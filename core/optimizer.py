@@ -1,7 +1,43 @@
-import os, string, random
-from time import time
-from PIL import Image, ImageSequence
-from typing import List, Optional
+import os, queue, string, random, threading
+from time import time, perf_counter
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from PIL import Image
+from core.cache import ResultCache
+from core.manifest import Manifest
+from core.gifwriter import PALETTE_SAMPLE_FRAMES, GifStreamWriter, buildPalette, mapFrame
+from core import metadata
+from core.metadata import ImageInfo
+from core.discovery import IMAGE_EXTENSIONS, FolderScanner, findImages
+from core.metrics import BatchMetrics, NULL_TIMER, StageTimer
+from core.memory import MemoryBudget, isLarge, resizeInStrips
+from core.quality import compare, hasTransparency
+from core.lossless import optimizePng
+from core import profiles
+from core import animation
+from core import atomic
+from core.atomic import AtomicWriter
+from io import BytesIO
+from typing import Callable, Iterator, List, Optional, Tuple
+
+DEFAULT_CONFIG = {
+	'quality': 80, 
+	'base_width': 600,
+	'format': 'default', 
+	'prefix': '-export', 
+	'timestamp': True
+}
+
+# Format setting that selects the smallest acceptable output among the `auto_formats`
+AUTO_FORMAT = 'auto'
+AUTO_FORMATS = ['WebP', 'png', 'jpg']
+# Default quality gate of the auto format
+MIN_SSIM = 0.95
+# Threads reading sources and writing outputs while the workers encode (0 disables the staged pipeline)
+IO_THREADS = 2
+
+class OptimizationCancelled(Exception):
+	""" Raised inside a job stopped by `ImageOptimizer.cancel` """
 
 class ImageOptimizer(object):
 	"""
@@ -22,7 +58,7 @@ class ImageOptimizer(object):
 		images (list): A list of image file paths to be processed.
 
 	Methods:
-		parseImages(basepath, folder):
+		parseImages(basepath, folder, config=None):
 			Parse and filter images in the specified folder based on allowed extensions.
 		
 		setName(image_path, overwrite, timestamp=True, prefix='-export', extension='default'):
@@ -34,56 +70,69 @@ class ImageOptimizer(object):
 		resize(pillow_image):
 			Resize the given Pillow image to the base width while maintaining aspect ratio.
 		
+		searchQuality(im, save_format, max_bytes):
+			Find the highest quality whose output fits in a size budget.
+
+		encodeAuto(im, image_path, dest_path):
+			Keep the smallest output among several formats that passes a quality threshold.
+
+		compressImage(image_path, dest_path):
+			Compress and resize a single image based on the current configuration settings.
+
+		encodeAnimation(image_path, dest_path):
+			Resize and encode an animated GIF, WebP or APNG frame by frame.
+
+		compressRenditions(image_path, renditions):
+			Write several widths and formats of an image from a single decode.
+
 		compress(overwrite=False, images=None, filemode=False):
-			Compress and resize images based on the current configuration settings.
+			Compress and resize images based on the current configuration settings, optionally in parallel.
+
+		compressStaged(sources, makeJob):
+			Overlap reading sources and writing outputs with the encoding of other images.
 
 		buildGif(images, output_path):
 			Build a GIF image from multiple images.
 	"""
 
-	allowed_extensions = ['WebP', 'png', 'jpeg', 'jpg', 'gif', 'ico', 'tiff' 'bmp']
+	allowed_extensions = IMAGE_EXTENSIONS
+	# Formats whose output size depends on the quality setting
+	quality_formats = ['JPEG', 'WEBP', 'AVIF']
 
-	def __init__(self, parent, path, config={
-			'quality': 80, 
-			'base_width': 600,
-			'format': 'default', 
-			'prefix': '-export', 
-			'timestamp': True
-		}
-	):
+	def __init__(self, parent, path, config=DEFAULT_CONFIG):
 		super(ImageOptimizer, self).__init__()
 		self.parent = parent
 		self.path = path
 		self.images = []
 		self.config = config
 		self.base_width = self.config.get('base_width', 600)		
+		self.cache = ResultCache.fromConfig(self.config)
+		# Serializes the cache accesses of the I/O threads of `compressStaged`
+		self.cache_lock = threading.Lock()
+		self.cancelled = threading.Event()
+		# Per-stage instrumentation of the image being processed (does nothing when disabled)
+		self.timer = StageTimer() if self.config.get('metrics') else NULL_TIMER
+		# (temporary path, destination path) of the outputs written but not committed yet
+		self.staged = []
 
 	@staticmethod
-	def parseImages(basepath: str, folder: str) -> List[str]:
+	def parseImages(basepath: str, folder: str, config: Optional[dict] = None) -> List[str]:
 		"""
 		Parse and filter images in the specified folder based on allowed extensions.
 
 		Args:
 			basepath (str): The base path where images are stored.
 			folder (str): The folder to search for images.
+			config (dict, optional): Discovery settings (`recursive`, `include`, `exclude`, `symlinks`).
 
 		Returns:
-			List[str]: A list of image file names with allowed extensions.
-		"""		
-		images = []
-		# List of allowed extensions in lowercase
-		extensions = [ext.lower() for ext in ImageOptimizer.allowed_extensions]		
-
-		# Iterate through items in the folder
-		for item in os.listdir(folder):			
-			item_abs_path = os.path.join(folder, item)
-			# Check if the item is a file
-			if os.path.isfile(item_abs_path):				
-				_, ext = os.path.splitext(os.path.basename(item))
-				# Check if the file has an allowed extension
-				if ('.' in ext) and (ext.lstrip('.').lower() in extensions):
-					images.append(item)
-		return images
+			List[str]: A list of image paths relative to the folder (file names without `recursive`).
+		"""
+		return list(findImages(folder, config or {}, ImageOptimizer.allowed_extensions))
+
+	def findImages(self) -> Iterator[str]:
+		""" Walk the current path lazily with the discovery settings, see `core.discovery.findImages` """
+		return findImages(self.path, self.config, ImageOptimizer.allowed_extensions)
 	
 	@staticmethod
 	def generateRandomName(prefix="", extension="jpg"):
@@ -106,7 +155,8 @@ class ImageOptimizer(object):
 			overwrite: bool,
 			timestamp: bool = True,
 			prefix: str = '-export',
-			extension: str = 'default'
+			extension: str = 'default',
+			suffix: str = ''
 		):
 		"""
 		Generate a new filename for the image based on the specified options.
@@ -117,6 +167,7 @@ class ImageOptimizer(object):
 			timestamp (bool): Whether to include a timestamp in the filename. Defaults to True.
 			prefix (str): A prefix to add to the filename. Defaults to '-export'.
 			extension (str): The file extension to use. Defaults to 'default'.
+			suffix (str): Added after the prefix, ex: the width of a rendition. Defaults to ''.
 
 		Returns:
 			str: The new filename.
@@ -132,11 +183,11 @@ class ImageOptimizer(object):
 			ext = f'.{extension}'
 			
 		# Generate the filename with the prefix
-		filename = f'{basename}{prefix}{ext}'
+		filename = f'{basename}{prefix}{suffix}{ext}'
 
 		# Add timestamp to the filename if required
 		if timestamp:            	
-			filename = f'{basename}{prefix}-{time()}{ext}'
+			filename = f'{basename}{prefix}{suffix}-{time()}{ext}'
 				
 		return filename
 
@@ -159,7 +210,7 @@ class ImageOptimizer(object):
 
 		Args:
 			width (int): The desired width of the image.
-			image (Image.Image): The original image.
+			image (Image.Image or ImageInfo): The original image, or its metadata.
 
 		Returns:
 			int: The new height of the image to maintain the aspect ratio.
@@ -173,17 +224,19 @@ class ImageOptimizer(object):
 		print(f'-- 01 --> Calculated new height: {hSize}')
 		return hSize
 
-	def resize(self, pillow_image: Image.Image) -> Image.Image:
+	def resize(self, pillow_image: Image.Image, hSize: Optional[int] = None) -> Image.Image:
 		"""
 		Resize an image to a new width while maintaining the aspect ratio.
 		
 		Args:
 			pillow_image (Image.Image): The original image to resize.
+			hSize (int, optional): The new height. If None, it is calculated from the image size.
 		
 		Returns:
 			PIL.Image.Image: The resized image.
 		"""		
-		hSize = self.calculateAspectRatioHeight(self.base_width, pillow_image)
+		if hSize is None:
+			hSize = self.calculateAspectRatioHeight(self.base_width, pillow_image)
 		# Resize the image using the calculated dimensions and high-quality resampling
 		if (self.base_width > 0 and hSize > 0):
 			print(f'-- 2 --> Resized to {self.base_width}x{hSize}')
@@ -191,96 +244,1221 @@ class ImageOptimizer(object):
 		else:
 			return pillow_image	
 
+	def getDestPath(self,
+			image_path: str,
+			overwrite: bool,
+			filemode: bool = False,
+			format: Optional[str] = None,
+			suffix: str = ''
+		) -> str:
+		"""
+		Get the destination path of the optimized version of an image.
+
+		Args:
+			image_path (str): The source image path.
+			overwrite (bool): Whether to overwrite the original image.
+			filemode (bool): Whether the image path is absolute (file mode) or relative to the current path.
+			format (str, optional): The output format. Defaults to the `format` setting.
+			suffix (str): Added to the filename after the prefix. Defaults to ''.
+
+		Returns:
+			str: The destination path.
+		"""
+		# Set the export filename with options like timestamp and prefix
+		filename = ImageOptimizer.setName(image_path, 
+			overwrite,
+			timestamp=self.config.get('timestamp', True),
+			prefix=self.config.get('prefix', '-export'), 
+			extension=format or self.config.get('format', 'default'),
+			suffix=suffix
+		)
+		
+		output_dir = self.config.get('output_dir')
+		# File mode: determine the destination path for the image
+		if filemode:				
+			return os.path.join(output_dir or os.path.dirname(image_path), filename)
+		# Folder mode: keep the subfolder of the image, under the output folder if any
+		if output_dir:
+			dest_folder = os.path.join(output_dir, os.path.dirname(image_path))
+			os.makedirs(dest_folder, exist_ok=True)
+			return os.path.join(dest_folder, filename)
+		return self.setAbsPath(os.path.join(os.path.dirname(image_path), filename))
+
+	def openSource(self, image_path: str, data: Optional[bytes] = None) -> Image.Image:
+		"""
+		Open a source image, from its content when it was already read (see `compressStaged`).
+
+		Args:
+			image_path (str): The image path (absolute, or relative to the current path).
+			data (bytes, optional): The content of the image file.
+
+		Returns:
+			Image.Image: The opened image (only its header is read).
+		"""
+		with self.timer.stage('open'):
+			im = Image.open(self.setAbsPath(image_path) if data is None else BytesIO(data))
+		if self.timer.enabled:
+			self.timer.count('input_bytes', os.path.getsize(self.setAbsPath(image_path)) if data is None else len(data))
+		return im
+
+	def openImage(self, image_path: str, data: Optional[bytes] = None) -> Image.Image:
+		"""
+		Open an image and resize it if its width exceeds the base width.
+
+		Args:
+			image_path (str): The image path (absolute, or relative to the current path).
+			data (bytes, optional): The content of the image file, when it was already read.
+
+		Returns:
+			Image.Image: The image, resized if needed.
+		"""
+		# Open the image
+		im = self.openSource(image_path, data)
+		if self.timer.enabled:
+			self.timer.count('pixels', im.width * im.height)
+		
+		# Resize the image if the width exceeds the specified base width
+		w, h = im.size
+		hSize = None
+		if self.base_width:				
+			if w > self.base_width:
+				# The height is calculated from the full size so draft mode does not change the output size
+				hSize = self.calculateAspectRatioHeight(self.base_width, im)
+
+		im = self.decode(im, image_path, (self.base_width, hSize) if hSize else None)
+		if hSize and im.size != (self.base_width, hSize):
+			with self.timer.stage('resize'):
+				im = self.resize(im, hSize)
+		return im
+
+	def decode(self, im: Image.Image, image_path: str, size: Optional[Tuple[int, int]] = None) -> Image.Image:
+		"""
+		Decode an opened image, for a given output size.
+
+		JPEG images are decoded at the smallest DCT scale still larger than the output size
+		(`draft` setting). Images above `large_pixels` are never decoded at full size when they
+		are downscaled: JPEG always uses the DCT scaling and uncompressed images are resized a
+		strip of rows at a time. Other large images are decoded whole.
+
+		Args:
+			im (Image.Image): The opened image.
+			image_path (str): The image path (absolute, or relative to the current path).
+			size (tuple, optional): The output size, None to keep the full size.
+
+		Returns:
+			Image.Image: The decoded image, at the output size when resized in strips.
+		"""
+		large = size is not None and isLarge(im.width * im.height, self.config)
+		# Let the JPEG decoder downscale (DCT scaling) to the smallest size still larger
+		# than the target, then finish with the high-quality resampling
+		if size and im.format == 'JPEG' and (self.config.get('draft', True) or large):
+			im.draft(im.mode, size)
+		elif large:
+			with self.timer.stage('decode'):
+				resized = resizeInStrips(self.setAbsPath(image_path), im, size)
+			if resized is not None:
+				print(f'-- 2 --> Resized to {size[0]}x{size[1]} in strips')
+				return resized
+		with self.timer.stage('decode'):
+			im.load()
+		return im
+
+	@staticmethod
+	def getSaveFormat(dest_path: str) -> Optional[str]:
+		"""
+		Get the Pillow format matching the extension of a destination path (ex: .jpg => JPEG).
+
+		Args:
+			dest_path (str): The destination path.
+
+		Returns:
+			str or None: The Pillow format, or None if the extension is unknown.
+		"""
+		_, ext = os.path.splitext(dest_path)
+		return Image.registered_extensions().get(ext.lower())
+
+	@staticmethod
+	def encode(im: Image.Image, save_format: str, quality: int, params: Optional[dict] = None) -> bytes:
+		"""
+		Encode an image in memory.
+
+		Args:
+			im (Image.Image): The image.
+			save_format (str): The Pillow format.
+			quality (int): The quality setting (ignored by lossless formats).
+			params (dict, optional): Other save parameters, from the encoder profile (see `profiles.saveParams`).
+				Defaults to `optimize=True`.
+
+		Returns:
+			bytes: The encoded image.
+		"""
+		buffer = BytesIO()
+		im.save(buffer, format=save_format, quality=quality, **(profiles.DEFAULT_PARAMS if params is None else params))
+		return buffer.getvalue()
+
+	def searchQuality(self, im: Image.Image, save_format: str, max_bytes: int) -> Tuple[bytes, int]:
+		"""
+		Find by bisection the highest quality (up to the configured one) whose output fits in a size budget.
+
+		Every probe encodes the same decoded and resized image in memory.
+
+		Args:
+			im (Image.Image): The image.
+			save_format (str): The Pillow format.
+			max_bytes (int): The maximum size of the output in bytes.
+
+		Returns:
+			Tuple[bytes, int]: The encoded image and its quality. When even the lowest quality does
+				not fit in the budget, the smallest output is returned.
+		"""
+		quality = self.config.get('quality', 80)
+		params = profiles.saveParams(self.config, save_format)
+		data = ImageOptimizer.encode(im, save_format, quality, params)
+		# Lossless formats ignore the quality: there is nothing to search
+		if len(data) <= max_bytes or save_format not in ImageOptimizer.quality_formats:
+			return data, quality
+
+		best = None
+		low, high = 1, quality - 1
+		while low <= high:
+			middle = (low + high) // 2
+			data = ImageOptimizer.encode(im, save_format, middle, params)
+			if len(data) <= max_bytes:
+				best = (data, middle)
+				low = middle + 1
+			else:
+				high = middle - 1
+		if best is None:
+			print(f'Cannot fit in {max_bytes} bytes, keep the lowest quality')
+			return ImageOptimizer.encode(im, save_format, 1, params), 1
+		return best
+
+	@staticmethod
+	def isAutoPath(dest_path: str) -> bool:
+		""" Whether a destination path was set with the auto format (its format is selected when encoding) """
+		return os.path.splitext(dest_path)[1].lower() == f'.{AUTO_FORMAT}'
+
+	def autoFormats(self) -> List[Tuple[str, str]]:
+		"""
+		Get the candidate formats of the auto format, from the `auto_formats` setting.
+
+		Returns:
+			List[Tuple[str, str]]: (extension, Pillow format) of each candidate, ex: ('WebP', 'WEBP').
+		"""
+		formats = []
+		for extension in self.config.get('auto_formats') or AUTO_FORMATS:
+			save_format = Image.registered_extensions().get(f'.{extension.lower()}')
+			if save_format is None:
+				raise ValueError(f'Unknown output format: {extension}')
+			formats.append((extension, save_format))
+		return formats
+
+	def cachedAutoPath(self, cache_key: str, dest_path: str) -> Optional[str]:
+		"""
+		Get the destination path of an image cached with the auto format, from the format of the cached image.
+
+		Returns:
+			str or None: The destination path, or None if the image is not cached.
+		"""
+		try:
+			with Image.open(self.cache.entryPath(cache_key)) as cached:
+				save_format = cached.format
+		except OSError:
+			return None
+		for extension, candidate_format in self.autoFormats():
+			if candidate_format == save_format:
+				return f'{os.path.splitext(dest_path)[0]}.{extension}'
+		return None
+
+	def encodeCandidate(self, im: Image.Image, save_format: str, max_bytes: Optional[int] = None) -> Tuple[bytes, int]:
+		"""
+		Encode an image in a format, searching the quality when there is a size budget.
+
+		Returns:
+			Tuple[bytes, int]: The encoded image and its quality.
+		"""
+		if save_format == 'JPEG' and im.mode not in ('RGB', 'L', 'CMYK'):
+			im = im.convert('RGB')
+		quality = self.config.get('quality', 80)
+		if save_format == 'PNG' and profiles.losslessPng(self.config):
+			return optimizePng(im, **profiles.losslessPngArgs(self.config))[0], quality
+		if max_bytes:
+			return self.searchQuality(im, save_format, max_bytes)
+		return ImageOptimizer.encode(im, save_format, quality, profiles.saveParams(self.config, save_format)), quality
+
+	def encodeAuto(self, im: Image.Image, image_path: str, dest_path: str) -> Tuple[bytes, dict]:
+		"""
+		Encode an image in each of the `auto_formats` and keep the smallest output that passes the
+		quality gate: its SSIM (and PSNR) against `im`, the resized image, must be at least `min_ssim`
+		(and `min_psnr`). When no candidate passes, the one with the best SSIM is kept.
+
+		Candidates are encoded and scored in parallel threads, Pillow encoders and NumPy release the GIL.
+		JPEG is left out for images with transparent pixels.
+
+		Args:
+			im (Image.Image): The decoded (and resized) image.
+			image_path (str): The source image path, used for the size budget.
+			dest_path (str): The destination path of the optimized image, with the `.auto` extension.
+
+		Returns:
+			Tuple[bytes, dict]: The encoded image, its `dest` (with the extension of the selected format),
+				`format`, `quality`, `bytes` and the `scores` of every candidate (`format`, `quality`,
+				`bytes`, `ssim`, `psnr` and `passed`).
+		"""
+		alpha = hasTransparency(im)
+		formats = [(extension, save_format) for extension, save_format in self.autoFormats() if not (alpha and save_format == 'JPEG')]
+		if not formats:
+			raise ValueError('No auto format can store transparency')
+		max_bytes = self.getMaxBytes(image_path)
+		min_ssim = self.config.get('min_ssim', MIN_SSIM)
+		min_psnr = self.config.get('min_psnr', 0)
+
+		def candidate(extension, save_format):
+			data, quality = self.encodeCandidate(im, save_format, max_bytes)
+			scores = compare(im, data, alpha)
+			passed = scores['ssim'] >= min_ssim and scores['psnr'] >= min_psnr
+			return data, {'format': extension, 'quality': quality, 'bytes': len(data), **scores, 'passed': passed}
+
+		with self.timer.stage('encode'):
+			with ThreadPoolExecutor(max_workers=len(formats)) as executor:
+				candidates = list(executor.map(lambda format: candidate(*format), formats))
+		passed = [(data, scores) for data, scores in candidates if scores['passed']]
+		if passed:
+			data, selected = min(passed, key=lambda candidate: candidate[1]['bytes'])
+		else:
+			data, selected = max(candidates, key=lambda candidate: candidate[1]['ssim'])
+			print(f'No format passes the quality gate (SSIM {min_ssim}), keep the best one')
+
+		dest_path = f"{os.path.splitext(dest_path)[0]}.{selected['format']}"
+		for _, scores in candidates:
+			print(f"  {scores['format']:<5} {scores['bytes']:>9} bytes  SSIM {scores['ssim']:.4f}  PSNR {scores['psnr']:.2f}{'' if scores['passed'] else '  (rejected)'}")
+
+		self.timer.count('output_bytes', len(data))
+		return data, {
+			'cached': False,
+			'dest': dest_path,
+			'format': selected['format'],
+			'quality': selected['quality'],
+			'bytes': len(data),
+			'scores': [scores for _, scores in candidates]
+		}
+
+	def getMaxBytes(self, image_path: str) -> Optional[int]:
+		"""
+		Get the size budget of an image from the `max_bytes` and `max_ratio` settings.
+
+		Args:
+			image_path (str): The source image path.
+
+		Returns:
+			int or None: The maximum size of the output in bytes, or None without budget.
+		"""
+		budgets = []
+		if self.config.get('max_bytes'):
+			budgets.append(int(self.config['max_bytes']))
+		if self.config.get('max_ratio'):
+			budgets.append(int(os.path.getsize(self.setAbsPath(image_path)) * self.config['max_ratio']))
+		return min(budgets) if budgets else None
+
+	def compressImage(self, image_path: str, dest_path: str) -> dict:
+		"""
+		Compress and resize a single image based on configuration settings.
+
+		When a size budget is set (`max_bytes` in bytes, or `max_ratio` of the source size),
+		the quality is searched so the output fits in it. Only the selected encode is written.
+
+		Args:
+			image_path (str): The source image path (absolute, or relative to the current path).
+			dest_path (str): The destination path of the optimized image.
+
+		Returns:
+			dict: Details of the result: `cached` (True if the optimized image was copied from the
+				result cache), `quality` (the quality used) and `bytes` (the output size). With the
+				auto format, also `dest` (the path with the extension of the selected format),
+				`format` and `scores`.
+		"""
+		# Reuse the output of a previous run with the same source and settings
+		if self.cache:
+			with self.timer.stage('cache'):
+				cache_key = ResultCache.key(self.setAbsPath(image_path), self.config)
+				cached = self.copyCached(cache_key, dest_path)
+			if cached:
+				self.staged.append(cached)
+				temp_path, cached_path = cached
+				return {'cached': True, 'dest': cached_path, 'bytes': os.path.getsize(temp_path), 'metrics': self.timer.record()}
+
+		data, details = self.encodeFile(image_path, dest_path)
+		temp_path = self.writeOutput(details.get('dest', dest_path), data)
+
+		if self.cache:
+			with self.timer.stage('cache'):
+				self.cache.put(cache_key, temp_path)
+		details['metrics'] = self.timer.record()
+		return details
+
+	def copyCached(self, cache_key: str, dest_path: str) -> Optional[Tuple[str, str]]:
+		"""
+		Copy the cached output of an image to a temporary file next to its destination.
+
+		Args:
+			cache_key (str): The cache key of the image.
+			dest_path (str): The destination path of the optimized image.
+
+		Returns:
+			Tuple[str, str] or None: The temporary path and the destination path (with the auto
+				format, the extension of the cached format), None on a cache miss.
+		"""
+		cached_path = dest_path
+		if ImageOptimizer.isAutoPath(dest_path):
+			# The format selected by a previous run is the one of the cached image
+			cached_path = self.cachedAutoPath(cache_key, dest_path) or dest_path
+		temp_path = atomic.tempPath(cached_path)
+		if not self.cache.get(cache_key, temp_path):
+			atomic.discard(temp_path)
+			return None
+		print(cached_path, '(cached)')
+		return temp_path, cached_path
+
+	def encodeFile(self, image_path: str, dest_path: str, data: Optional[bytes] = None) -> Tuple[bytes, dict]:
+		"""
+		Open, resize and encode an image in memory. Animations are kept animated when the output
+		format can store them (GIF, WebP, PNG), otherwise their first frame is used.
+
+		Args:
+			image_path (str): The source image path (absolute, or relative to the current path).
+			dest_path (str): The destination path of the optimized image, used for the format.
+			data (bytes, optional): The content of the source file, when it was already read.
+
+		Returns:
+			Tuple[bytes, dict]: The encoded image and its details (see `encodeImage`).
+		"""
+		save_format = self.animationFormat(dest_path)
+		if save_format:
+			if data is None:
+				animated = metadata.index.get(self.setAbsPath(image_path)).animated
+			else:
+				with Image.open(BytesIO(data)) as im:
+					animated = getattr(im, 'is_animated', False)
+			if animated:
+				return self.encodeAnimation(image_path, dest_path, save_format, data)
+		return self.encodeImage(self.openImage(image_path, data), image_path, dest_path)
+
+	def animationFormat(self, dest_path: str) -> Optional[str]:
+		"""
+		Get the Pillow format an animation is written in, None if the output format cannot store one.
+		With the auto format, animations are written in the first of the `auto_formats` that can.
+		"""
+		if ImageOptimizer.isAutoPath(dest_path):
+			formats = [save_format for _, save_format in self.autoFormats()]
+		else:
+			formats = [ImageOptimizer.getSaveFormat(dest_path)]
+		return next((save_format for save_format in formats if save_format in animation.ANIMATION_FORMATS), None)
+
+	def encodeAnimation(self,
+			image_path: str,
+			dest_path: str,
+			save_format: str,
+			data: Optional[bytes] = None,
+			width: Optional[int] = None
+		) -> Tuple[bytes, dict]:
+		"""
+		Resize and encode an animation frame by frame, keeping the duration of each frame, the loop
+		count and, from GIF to GIF, the disposal of each frame.
+
+		Frames are decoded one after another (each one is drawn over the previous ones), then resized
+		and, for GIF, reduced to a palette by a pool of threads. At most `window` decoded frames wait
+		for a thread; the resized frames are kept until the animation is encoded.
+
+		Args:
+			image_path (str): The source image path (absolute, or relative to the current path).
+			dest_path (str): The destination path of the optimized image.
+			save_format (str): The Pillow format of the output (GIF, WEBP or PNG).
+			data (bytes, optional): The content of the source file, when it was already read.
+			width (int, optional): The width of the output, the `base_width` setting by default.
+
+		Returns:
+			Tuple[bytes, dict]: The encoded animation, with its `quality`, `bytes` and `frames`. With
+				the auto format, also its `dest` and `format`.
+		"""
+		im = self.openSource(image_path, data)
+		if self.timer.enabled:
+			self.timer.count('pixels', im.width * im.height * im.n_frames)
+
+		width = self.base_width if width is None else width
+		size = None
+		if width and im.width > width:
+			size = (width, self.calculateAspectRatioHeight(width, im))
+		alpha = animation.hasAlpha(im)
+		loop = im.info.get('loop')
+		keep_disposal = im.format == 'GIF' and save_format == 'GIF'
+
+		workers = os.cpu_count() or 1
+		window = workers * 2
+		frames, durations, disposals = [], [], []
+		with self.timer.stage('frames'):
+			with ThreadPoolExecutor(max_workers=workers) as executor:
+				prepared = deque()
+				for frame, duration, disposal in animation.iterFrames(im, 'RGBA' if alpha else 'RGB'):
+					prepared.append(executor.submit(animation.prepareFrame, frame, size, save_format))
+					durations.append(duration)
+					# Composited frames with transparency are cleared before the next one
+					disposals.append(disposal if keep_disposal else (animation.DISPOSAL_BACKGROUND if alpha else 0))
+					while len(prepared) > window:
+						frames.append(prepared.popleft().result())
+				frames.extend(future.result() for future in prepared)
+		if size:
+			print(f'-- 2 --> Resized {len(frames)} frames to {size[0]}x{size[1]}')
+
+		quality = self.config.get('quality', 80)
+		with self.timer.stage('encode'):
+			data = animation.encodeAnimation(frames, durations, disposals, save_format, quality, loop, profiles.saveParams(self.config, save_format))
+		details = {'cached': False, 'quality': quality, 'bytes': len(data), 'frames': len(frames)}
+		if ImageOptimizer.isAutoPath(dest_path):
+			extension = next(extension for extension, candidate in self.autoFormats() if candidate == save_format)
+			details.update(dest=f'{os.path.splitext(dest_path)[0]}.{extension}', format=extension)
+		print(details.get('dest', dest_path))
+		self.timer.count('output_bytes', len(data))
+		return data, details
+
+	def saveImage(self, im: Image.Image, image_path: str, dest_path: str) -> dict:
+		"""
+		Encode an image in the format of its destination and write it.
+
+		Args:
+			im (Image.Image): The decoded (and resized) image.
+			image_path (str): The source image path, used for the size budget.
+			dest_path (str): The destination path of the optimized image.
+
+		Returns:
+			dict: The quality used (`quality`) and the output size (`bytes`), and the details of
+				the selected format with the auto format (see `encodeAuto`).
+		"""
+		data, details = self.encodeImage(im, image_path, dest_path)
+		self.writeOutput(details.get('dest', dest_path), data)
+		return details
+
+	def writeOutput(self, dest_path: str, data: bytes) -> str:
+		"""
+		Write an output to a temporary file next to its destination. The file is renamed over the
+		destination when `compress` commits it (see `core.atomic.AtomicWriter`), so a crash never
+		leaves a destination, or a source being replaced, half written.
+
+		Args:
+			dest_path (str): The destination path.
+			data (bytes): The encoded image.
+
+		Returns:
+			str: The path of the temporary file.
+		"""
+		with self.timer.stage('write'):
+			temp_path = atomic.writeTemp(dest_path, data)
+		self.staged.append((temp_path, dest_path))
+		return temp_path
+
+	def discardStaged(self) -> None:
+		""" Remove the outputs written but not committed, after an error """
+		for temp_path, _ in self.staged:
+			atomic.discard(temp_path)
+		self.staged = []
+
+
+	def encodeImage(self, im: Image.Image, image_path: str, dest_path: str) -> Tuple[bytes, dict]:
+		"""
+		Encode an image in memory, in the format of its destination.
+
+		Args:
+			im (Image.Image): The decoded (and resized) image.
+			image_path (str): The source image path, used for the size budget.
+			dest_path (str): The destination path of the optimized image, used for the format.
+
+		Returns:
+			Tuple[bytes, dict]: The encoded image, the quality used (`quality`), the output size (`bytes`),
+				`over_budget` when it does not fit in the size budget and, for PNG, the report of the
+				lossless pass (`png`, see `optimizePng`).
+		"""
+		if ImageOptimizer.isAutoPath(dest_path):
+			return self.encodeAuto(im, image_path, dest_path)
+		format = self.config.get('format', 'default')
+		save_format = ImageOptimizer.getSaveFormat(dest_path)
+		if save_format is None:
+			raise ValueError(f'Unknown output format: {dest_path}')
+
+		# Print debug information
+		print(dest_path)
+		print('Format: ', format)
+
+		# Convert the image to RGB mode if the format is JPEG, as JPEG does not support RGBA
+		if save_format == 'JPEG' and im.mode not in ('RGB', 'L', 'CMYK'):
+			with self.timer.stage('convert'):
+				im = im.convert('RGB')
+		
+		# Encode the image with the specified quality and format
+		quality = self.config.get('quality', 80)
+		max_bytes = self.getMaxBytes(image_path)
+		details = {}
+		with self.timer.stage('encode'):
+			# PNG is lossless: the size budget cannot lower its quality
+			if save_format == 'PNG' and profiles.losslessPng(self.config):
+				data, details['png'] = optimizePng(im, **profiles.losslessPngArgs(self.config))
+			elif max_bytes:
+				data, quality = self.searchQuality(im, save_format, max_bytes)
+			else:
+				data = ImageOptimizer.encode(im, save_format, quality, profiles.saveParams(self.config, save_format))
+		if 'png' in details:
+			png = details['png']
+			print(f"====> PNG {png['mode']} ({png['colors'] or 'not counted'} colors, {png['strategy']}): {len(data)} bytes, {png['saved_bytes']} saved in {png['cpu_seconds']:.3f}s CPU")
+		elif max_bytes:
+			print(f'====> Quality {quality} for {len(data)} bytes (budget: {max_bytes})')
+		if max_bytes and len(data) > max_bytes:
+			# Kept anyway: the lossy formats warn when even their lowest quality does not fit (see `searchQuality`)
+			if save_format not in ImageOptimizer.quality_formats:
+				print(f'Cannot fit in {max_bytes} bytes, {save_format} is lossless: keep {len(data)} bytes')
+			details['over_budget'] = True
+
+		self.timer.count('output_bytes', len(data))
+		return data, {'cached': False, 'quality': quality, 'bytes': len(data), **details}
+
+	def getRenditionPaths(self, image_path: str, filemode: bool = False) -> List[Tuple[int, str]]:
+		"""
+		Get the destination paths of the renditions of an image, from the `renditions` (widths)
+		and `rendition_formats` settings. Filenames get the width as suffix, ex: photo-export-640w.jpg.
+
+		Images are never upscaled: widths at or above the source width give a single rendition,
+		named with the source width so srcset descriptors stay true.
+
+		Args:
+			image_path (str): The source image path.
+			filemode (bool): Whether the image path is absolute (file mode) or relative to the current path.
+
+		Returns:
+			List[Tuple[int, str]]: (width, destination path) of each rendition.
+		"""
+		formats = self.config.get('rendition_formats') or [self.config.get('format', 'default')]
+		try:
+			source_width = metadata.index.get(self.setAbsPath(image_path)).width
+		except Exception:
+			# Unreadable image: its job fails with the actual error
+			source_width = None
+		widths = []
+		for width in self.config['renditions']:
+			if source_width and (not width or width >= source_width):
+				width = source_width
+			if width not in widths:
+				widths.append(width)
+		return [
+			(width, self.getDestPath(image_path, False, filemode, format=format, suffix=f'-{width}w'))
+			for width in widths
+			for format in formats
+		]
+
+	def compressRenditions(self, image_path: str, renditions: List[Tuple[int, str]]) -> dict:
+		"""
+		Write several renditions (widths and formats) of an image from a single decode.
+
+		Each width is resized from the previous, larger one (resize pyramid) rather than from
+		the source. Images are never upscaled.
+
+		Animations, as with `compress`, stay animated in the formats that can store them: those
+		renditions are resized and encoded frame by frame, each one from the source (see
+		`encodeAnimation`). The other formats get the first frame.
+
+		Args:
+			image_path (str): The source image path (absolute, or relative to the current path).
+			renditions (List[Tuple[int, str]]): (width, destination path) of each rendition.
+
+		Returns:
+			dict: `renditions`, the details of each output (`width`, `dest`, `quality`, `bytes`,
+				and `frames` for animations).
+		"""
+		with self.timer.stage('open'):
+			source = metadata.index.get(self.setAbsPath(image_path))
+		self.timer.count('input_bytes', source.file_size)
+
+		outputs = []
+		if source.animated:
+			stills = []
+			for width, dest_path in renditions:
+				save_format = self.animationFormat(dest_path)
+				if not save_format:
+					stills.append((width, dest_path))
+					continue
+				data, details = self.encodeAnimation(image_path, dest_path, save_format, width=width)
+				dest_path = details.get('dest', dest_path)
+				self.writeOutput(dest_path, data)
+				outputs.append({'width': min(width or source.width, source.width), 'dest': dest_path,
+					'quality': details['quality'], 'bytes': details['bytes'], 'frames': details['frames']})
+			renditions = stills
+			if not renditions:
+				return {'renditions': outputs, 'bytes': sum(output['bytes'] for output in outputs), 'metrics': self.timer.record()}
+
+		with self.timer.stage('open'):
+			im = Image.open(self.setAbsPath(image_path))
+		self.timer.count('pixels', source.area)
+		widths = sorted({width for width, _ in renditions}, reverse=True)
+
+		# Decode once, at the smallest size still larger than the largest rendition
+		size = None
+		if widths[0] and widths[0] < source.width:
+			size = (widths[0], self.calculateAspectRatioHeight(widths[0], source))
+		im = self.decode(im, image_path, size)
+
+		for width in widths:
+			if width and width < im.width:
+				with self.timer.stage('resize'):
+					im = im.resize((width, self.calculateAspectRatioHeight(width, source)), Image.Resampling.LANCZOS)
+			for rendition_width, dest_path in renditions:
+				if rendition_width == width:
+					details = self.saveImage(im, image_path, dest_path)
+					outputs.append({'width': im.width, 'dest': details.get('dest', dest_path), 'quality': details['quality'], 'bytes': details['bytes']})
+					if 'scores' in details:
+						outputs[-1].update(format=details['format'], scores=details['scores'])
+					if 'png' in details:
+						outputs[-1]['png'] = details['png']
+					if 'over_budget' in details:
+						outputs[-1]['over_budget'] = True
+		return {'renditions': outputs, 'bytes': sum(output['bytes'] for output in outputs), 'metrics': self.timer.record()}
+
 	def compress(self,
 			overwrite: bool = False,
 			images: List[str] = None,
-			filemode: bool = False
-		) -> None:
+			filemode: bool = False,
+			manifest: Optional[Manifest] = None
+		) -> List[dict]:
 		"""
 		Compress and resize images based on configuration settings.
 
+		When the `workers` config key is greater than 1 (or 0 to use every CPU core), images
+		are spread across a pool of processes. Otherwise they are processed one after another.
+		Without renditions, disk reads and writes are overlapped with encoding (see `compressStaged`).
+
+		Outputs are written to temporary files and committed (renamed over their destination) by
+		this process with an `AtomicWriter`, grouped according to the `durability` setting.
+
 		Args:
 			overwrite (bool): Whether to overwrite the original images. Defaults to False.
 			images (list[str]): List of image file paths to be compressed. If None, parse images from the base path. Defaults to None.
 			filemode (bool): Whether to use file mode for saving the images. Defaults to False.
+			manifest (Manifest, optional): The manifest of the incremental folder mode, loaded from
+				the folder when not given (`watch` keeps its own between polls).
+
+		Returns:
+			List[dict]: One result per image, in the same order as the images, with the keys
+				`source`, `dest`, `error` (None on success, the error message otherwise)
+				and the details returned by `compressImage` (`cached`, `quality`, `bytes`).
 		"""
-		# Set the list of images to be processed
-		if images:
-			self.images = images
-		else:
-			self.images = ImageOptimizer.parseImages(self.parent.basepath, self.path)
+		# Set the images to be processed. Images of a folder are found while the first ones are
+		# already being processed by the pool
+		sources = images or self.findImages()
 
-		# Process each image
-		for i,image_path in enumerate(self.images):
-			# Open the image
-			im = Image.open(self.setAbsPath(image_path))
-			
-			# Resize the image if the width exceeds the specified base width
-			w, h = im.size
-			if self.base_width:				
-				if w > self.base_width:
-					im = self.resize(im)
-
-			# Set the export filename with options like timestamp and prefix
-			format = self.config.get('format', 'default')
-			filename = ImageOptimizer.setName(image_path, 
-				overwrite,
-				timestamp=self.config.get('timestamp', True),
-				prefix=self.config.get('prefix', '-export'), 
-				extension=format
-			)
-			
-			# File mode: determine the destination path for the image
-			if filemode:				
-				dest_path = os.path.join(os.path.dirname(image_path), filename)
-			else:
-				dest_path = self.setAbsPath(filename)
+		# Incremental folder mode: skip images already optimized and outputs of previous runs
+		if not self.config.get('incremental') or filemode:
+			manifest = None
+		elif manifest is None:
+			manifest = Manifest(self.path)
+		if manifest:
+			sources = manifest.filter(sources)
 
-			# Print debug information
-			# print('Save to ', dest_path)
-			print(dest_path, filename)
-			print('Format: ', format)
+		start_time = perf_counter()
+		# Destination names are set here so both modes produce the same outputs
+		worker = _renditionsWorker if self.config.get('renditions') else _compressWorker
+		def makeJob(image_path):
+			if worker is _renditionsWorker:
+				return image_path, self.getRenditionPaths(image_path, filemode)
+			return image_path, self.getDestPath(image_path, overwrite, filemode)
+		jobs = []
+		results = []
 
-			# Convert the image to RGB mode if the format is JPEG, as JPEG does not support RGBA
-			if (format == 'jpg'):
-				im = im.convert('RGB')
-			
-			# Save the image with the specified quality and format
-			if format == 'default':
-				im.save(dest_path, quality=self.config.get('quality', 80), optimize=True)
+		# Outputs are written to temporary files, then renamed over their destination by groups
+		self.writer = AtomicWriter.fromConfig(self.config)
+		with self.writer:
+			workers = self.config.get('workers', 1) or os.cpu_count()
+			if worker is _compressWorker and self.config.get('io_threads', IO_THREADS) > 0:
+				jobs, results = self.compressStaged(sources, makeJob)
+			elif workers > 1 and (not images or len(images) > 1):
+				# Images are admitted while their estimated memory fits in the budget with the running ones
+				budget = MemoryBudget.fromConfig(self.config)
+				with ProcessPoolExecutor(max_workers=min(workers, len(images)) if images else workers) as executor:
+					futures = {}
+					costs = {}
+					pending = set()
+					for image_path in sources:
+						if self.cancelled.is_set():
+							break
+						cost = self.estimateMemory(image_path) if budget else 0
+						while pending and budget and not budget.fits(cost):
+							done, pending = wait(pending, return_when=FIRST_COMPLETED)
+							for future in done:
+								budget.release(costs.pop(future))
+								self.collectResult(future, futures[future], jobs, results)
+						jobs.append(makeJob(image_path))
+						results.append(None)
+						future = executor.submit(worker, self.path, self.config, *jobs[-1])
+						futures[future] = len(jobs) - 1
+						costs[future] = cost
+						pending.add(future)
+						if budget:
+							budget.acquire(cost)
+					for future in as_completed(pending):
+						pending.discard(future)
+						self.collectResult(future, futures[future], jobs, results, len(jobs) - len(pending))
+						if self.cancelled.is_set():
+							# Images being processed are finished, the others are never started
+							executor.shutdown(wait=True, cancel_futures=True)
+							for future in [future for future in pending if not future.cancelled()]:
+								pending.discard(future)
+								self.collectResult(future, futures[future], jobs, results, len(jobs) - len(pending))
+							break
 			else:
-				print('====> Save into this format: ', format)
-				im.save(dest_path, quality=self.config.get('quality', 80), optimize=True, format=format)
+				jobs = [makeJob(image_path) for image_path in sources]
+				results = [None] * len(jobs)
+				for i, (image_path, dest_path) in enumerate(jobs):
+					if self.cancelled.is_set():
+						break
+					results[i] = worker(self.path, self.config, image_path, dest_path)
+					self.commitResult(results[i], ((i+1) * 100) // len(jobs))
+		self.images = [image_path for image_path, _ in jobs]
+		if manifest:
+			print(f'Incremental mode: {len(jobs)} new or modified image(s)')
+		if not jobs:
+			self.parent.signalProgression.emit(100)
 
-			# Emit the progress signal
-			progress_value = ((i+1) * 100) // len(self.images)
-			self.parent.signalProgression.emit(progress_value)
+		# Images left out by a cancellation
+		for i, result in enumerate(results):
+			if result is None:
+				results[i] = _result(*_jobPaths(jobs[i]), error='Cancelled', cancelled=True)
 
-	def getLargestImage(self) -> Optional[Image.Image]:
+		for result in results:
+			if result['error']:
+				print(f"Error optimizing image {result['source']}: {result['error']}")
+		if self.cache:
+			hits = sum(1 for result in results if result['cached'])
+			print(f'Result cache: {hits} hit(s), {len(results) - hits} miss(es)')
+		if manifest:
+			for result in results:
+				if result.get('cancelled'):
+					continue
+				dests = [output['dest'] for output in result['renditions']] if 'renditions' in result else [result['dest']]
+				try:
+					manifest.update(result['source'], [] if result['error'] else dests, result['error'])
+				except FileNotFoundError:
+					pass
+			manifest.save()
+		if self.config.get('metrics'):
+			self.reportMetrics(results, perf_counter() - start_time)
+		return results
+
+	def compressStaged(self, sources: Iterator[str], makeJob: Callable[[str], Tuple[str, str]]) -> Tuple[list, list]:
 		"""
-		Finds the largest image in terms of dimensions from the `self.images` list.
+		Compress images in a staged pipeline, so the disk and the CPU work at the same time:
+
+		- a thread walks the sources (see `findImages`), the first images start before the walk ends,
+		- `io_threads` threads read the sources ahead (and look them up in the result cache),
+		- the workers (`workers` processes, or a thread) decode, resize and encode them in memory,
+		- the same threads write the outputs to temporary files, committed in the order of the images.
+
+		At most `prefetch` images are in the pipeline, from their read to their commit: reading waits
+		when a later stage falls behind, so memory stays bounded (the `memory_budget` also applies to
+		the images being encoded). Results, commits and progress signals follow the order of the
+		images, whatever order they complete in. The progress is computed on the images found so far
+		(it never goes back), then on the total once the walk is over: when the walk ends before the
+		first image is done, the signals are the same as one image after another.
+
+		Args:
+			sources (Iterator[str]): The images to compress.
+			makeJob (Callable[[str], Tuple[str, str]]): Builds the (source, destination) job of an image.
 
 		Returns:
-			Image.Image or None: The largest image found, or None if no images are found or if dimensions are not determined.
+			Tuple[list, list]: The jobs and their results (None for the images left out by a cancellation).
 		"""
-		largest_image = None
-		max_area = 0
+		jobs = []
+		results = {}
+		workers = self.config.get('workers', 1) or os.cpu_count()
+		if isinstance(sources, list):
+			workers = min(workers, len(sources))
+		io_threads = self.config.get('io_threads', IO_THREADS)
+		prefetch = max(1, self.config.get('prefetch') or workers * 2 + io_threads)
+		budget = MemoryBudget.fromConfig(self.config)
+		# Reads and writes of the I/O threads: writes first (they free memory), then by image order
+		tasks = queue.PriorityQueue()
+		# (stage, image index, value) sent back to this thread, which alone drives the pipeline
+		events = queue.Queue()
 
-		# Iterate through all images to find the largest one
-		for image_path in self.images:
+		def walkThread():
+			error = None
 			try:
-				im = Image.open(self.setAbsPath(image_path))
-				width, height = im.size
-				area = width * height
+				for image_path in sources:
+					if self.cancelled.is_set():
+						break
+					jobs.append(makeJob(image_path))
+					events.put(('found', len(jobs) - 1, None))
+			except Exception as e:
+				error = e
+			events.put(('walked', len(jobs), error))
+
+		def ioThread():
+			while True:
+				_, i, task = tasks.get()
+				if task is None:
+					return
+				if task == 'read':
+					events.put(('read', i, None if self.cancelled.is_set() else self.readSource(*jobs[i])))
+				else:
+					events.put(('written', i, self.writeStaged(*task)))
+
+		# The worker processes are started before the threads (see `_processPool`)
+		executor = _processPool(workers) if workers > 1 else ThreadPoolExecutor(max_workers=1)
+		threads = [threading.Thread(target=walkThread, daemon=True)]
+		threads += [threading.Thread(target=ioThread, daemon=True) for _ in range(io_threads)]
+		for thread in threads:
+			thread.start()
+
+		# Read images waiting for a worker, and images being encoded: index => (read, future)
+		ready = deque()
+		running = {}
+		# Images out of the pipeline, waiting for the previous ones: index => result (None when cancelled)
+		finished = {}
+		fed = emitted = progress = 0
+		walked = False
+		try:
+			while True:
+				cancelled = self.cancelled.is_set()
+				# Images being processed are finished, the others are never started
+				if cancelled:
+					while ready:
+						finished[ready.popleft()[0]] = None
+					for _, future in running.values():
+						future.cancel()
+
+				# Emit the results in order, and the progress signal as if images were done one after another
+				while emitted in finished:
+					result = finished.pop(emitted)
+					if result is not None:
+						results[emitted] = result
+						progress = max(progress, ((emitted + 1) * 100) // len(jobs) if walked else min(99, ((emitted + 1) * 100) // len(jobs)))
+						self.commitResult(result, progress)
+					emitted += 1
+				if walked and (emitted == len(jobs) or (cancelled and emitted == fed)):
+					break
+
+				# Read the next images while there is room in the pipeline
+				while not cancelled and fed < len(jobs) and fed - emitted < prefetch:
+					tasks.put((1, fed, 'read'))
+					fed += 1
+				# Start the read images while their estimated memory fits in the budget with the running ones
+				while ready and (not running or not budget or budget.fits(ready[0][1]['cost'])):
+					i, read = ready.popleft()
+					if budget:
+						budget.acquire(read['cost'])
+					future = executor.submit(_encodeWorker, self.path, self.config, *jobs[i], read.pop('data'))
+					running[i] = (read, future)
+					future.add_done_callback(lambda future, i=i: events.put(('encoded', i, future)))
+
+				stage, i, value = events.get()
+				if stage == 'walked':
+					walked = True
+					if value is not None:
+						raise value
+				elif stage == 'read':
+					if value is None or self.cancelled.is_set():
+						finished[i] = value and value.get('result')
+					elif 'result' in value:
+						# Cache hit, or unreadable source
+						finished[i] = value['result']
+					else:
+						ready.append((i, value))
+				elif stage == 'encoded':
+					read, _ = running.pop(i)
+					if budget:
+						budget.release(read['cost'])
+					if value.cancelled():
+						finished[i] = None
+						continue
+					try:
+						result = value.result()
+					except Exception as e:
+						# The worker process itself died (ex: out of memory)
+						result = _result(*_jobPaths(jobs[i]), error=str(e))
+					if result['error']:
+						finished[i] = result
+					else:
+						tasks.put((0, i, (result, read['cache_key'], read['timer'])))
+				elif stage == 'written':
+					finished[i] = value
+		finally:
+			executor.shutdown(wait=True, cancel_futures=True)
+			for thread in threads[1:]:
+				tasks.put((2, len(jobs), None))
+			for thread in threads[1:]:
+				thread.join()
+			# Outputs written for images whose result was never emitted (the job stopped on an error)
+			for result in finished.values():
+				if result:
+					for temp_path, _ in result.get('staged', []):
+						atomic.discard(temp_path)
+		return jobs, [results.get(i) for i in range(len(jobs))]
+
+	def readSource(self, image_path: str, dest_path: str) -> dict:
+		"""
+		Read a source image ahead of its encode (I/O stage of `compressStaged`), and look it up in the result cache.
+
+		Large images (see `core.memory.isLarge`) are not read: they are decoded from the disk a strip at a time.
+		Neither are images whose header cannot be read.
+
+		Args:
+			image_path (str): The source image path (absolute, or relative to the current path).
+			dest_path (str): The destination path of the optimized image.
+
+		Returns:
+			dict: The `result` of the image on a cache hit or a read error. Otherwise the source
+				content (`data`), its estimated memory (`cost`), its `cache_key` and its `timer`.
+		"""
+		timer = StageTimer() if self.config.get('metrics') else NULL_TIMER
+		try:
+			abs_path = self.setAbsPath(image_path)
+			with timer.stage('read'):
+				try:
+					info = metadata.index.get(abs_path)
+				except Exception:
+					# Unreadable images are opened from the disk by the worker, to fail with the error of the decoder
+					info = None
+				data = None
+				if info is not None and not isLarge(info.area, self.config):
+					with open(abs_path, 'rb') as f:
+						data = f.read()
+			cache_key = None
+			if self.cache:
+				with timer.stage('cache'):
+					cache_key = ResultCache.key(abs_path, self.config, data)
+					with self.cache_lock:
+						cached = self.copyCached(cache_key, dest_path)
+				if cached:
+					temp_path, cached_path = cached
+					return {'result': _result(image_path, cached_path, cached=True, bytes=os.path.getsize(temp_path), staged=[cached], metrics=timer.record())}
+		except Exception as e:
+			return {'result': _result(image_path, dest_path, error=str(e))}
+		return {'data': data, 'cost': MemoryBudget.estimate(info, self.config), 'cache_key': cache_key, 'timer': timer}
+
+	def writeStaged(self, result: dict, cache_key: Optional[str], timer: StageTimer) -> dict:
+		"""
+		Write an output encoded by a worker to a temporary file, and store it in the result cache
+		(I/O stage of `compressStaged`).
+
+		Args:
+			result (dict): The result of `_encodeWorker`, with the encoded image in `data`.
+			cache_key (str, optional): The cache key of the image, None without cache.
+			timer (StageTimer): The instrumentation of the image, since its read.
+
+		Returns:
+			dict: The result, with the temporary file in `staged`.
+		"""
+		data = result.pop('data')
+		temp_path = None
+		try:
+			with timer.stage('write'):
+				temp_path = atomic.writeTemp(result['dest'], data)
+			if cache_key:
+				with timer.stage('cache'), self.cache_lock:
+					self.cache.put(cache_key, temp_path)
+		except Exception as e:
+			if temp_path:
+				atomic.discard(temp_path)
+			return _result(result['source'], result['dest'], error=str(e))
+		if timer.enabled and result.get('metrics'):
+			stages = result['metrics']['stages']
+			for name, seconds in timer.stages.items():
+				stages[name] = stages.get(name, 0.0) + seconds
+		result['staged'] = [(temp_path, result['dest'])]
+		return result
+
+	def reportMetrics(self, results: List[dict], wall_time: float) -> BatchMetrics:
+		"""
+		Aggregate the per-image instrumentation of a batch, print a summary and export it to
+		the `metrics_jsonl` (JSON lines) and `metrics_prometheus` (Prometheus text format) files.
+
+		Args:
+			results (List[dict]): The results of `compress`.
+			wall_time (float): Wall time of the batch in seconds.
+
+		Returns:
+			BatchMetrics: The batch metrics, also kept in `self.batch_metrics`.
+		"""
+		records = [
+			{'source': result['source'], **result['metrics'], **{key: result[key] for key in ('scores', 'png') if key in result}}
+			for result in results if result.get('metrics')
+		]
+		self.batch_metrics = BatchMetrics(records, wall_time)
+		summary = self.batch_metrics.summary()
+		print(f"Metrics: {summary['images']} image(s) in {wall_time:.2f}s ({summary['images_per_sec']:.1f} images/s)")
+		for name, stage in summary['stages'].items():
+			print(f"  {name:<8} total {stage['sum']:.3f}s  p50 {stage['p50'] * 1000:.1f}ms  p90 {stage['p90'] * 1000:.1f}ms  max {stage['max'] * 1000:.1f}ms")
+		if self.config.get('metrics_jsonl'):
+			self.batch_metrics.toJsonLines(self.config['metrics_jsonl'])
+		if self.config.get('metrics_prometheus'):
+			self.batch_metrics.toPrometheus(self.config['metrics_prometheus'])
+		return self.batch_metrics
+
+	def collectResult(self, future, i: int, jobs: list, results: list, done: Optional[int] = None) -> None:
+		"""
+		Store the result of a finished compress job and commit it, see `commitResult`. The progress
+		signal is emitted when the number of `done` jobs is given (the total is only known once every
+		job is submitted).
+		"""
+		try:
+			results[i] = future.result()
+		except Exception as e:
+			# The worker process itself died (ex: out of memory)
+			results[i] = _result(*_jobPaths(jobs[i]), error=str(e))
+		self.commitResult(results[i], None if done is None else (done * 100) // len(jobs))
+
+	def commitResult(self, result: dict, progress: Optional[int] = None) -> None:
+		"""
+		Commit the staged outputs of a result. Once they replaced their destination, emit the result
+		signal and the progress signal (when `progress` is given): an image is only reported done
+		when its outputs are on the disk.
+		"""
+		def committed():
+			# Outputs that could not replace their destination, which keeps its previous content
+			dests = [result['dest']] + [output['dest'] for output in result.get('renditions', [])]
+			errors = [self.writer.failed[dest] for dest in dests if dest in self.writer.failed]
+			if errors and not result['error']:
+				result['error'] = errors[0]
+			self.emitResult(result)
+			if progress is not None:
+				# Emit the progress signal
+				self.parent.signalProgression.emit(progress)
+
+		self.writer.commitAll(result.pop('staged', []), committed)
 
-				if area > max_area:
-					max_area = area
-					largest_image = im
+	def estimateMemory(self, image_path: str) -> int:
+		""" Estimated memory used to optimize an image, from its header (0 if it cannot be read) """
+		try:
+			info = metadata.index.get(self.setAbsPath(image_path))
+		except Exception:
+			return 0
+		return MemoryBudget.estimate(info, self.config)
 
+	def cancel(self) -> None:
+		""" Stop the running `compress` or `buildGif` (thread-safe). Images being processed are finished """
+		self.cancelled.set()
+
+	def emitResult(self, result: dict) -> None:
+		""" Send the result of an image to the parent, if it has a `signalImageDone` signal """
+		signal = getattr(self.parent, 'signalImageDone', None)
+		if signal is not None:
+			signal.emit(result)
+
+	def watch(self,
+			overwrite: bool = False,
+			interval: float = 2.0,
+			stop: Optional[threading.Event] = None
+		) -> None:
+		"""
+		Optimize images as they land in the folder (incremental folder mode), until `stop` is set.
+
+		An image is processed once its size and modification time did not change between two
+		polls, so files still being copied into the folder are left for the next poll.
+
+		The manifest and the folder listings are kept between polls: a poll only stats the
+		folders, lists again the ones that changed (see `core.discovery.FolderScanner`) and stats
+		their images and the images waiting to be processed. An image rewritten in place, without
+		any change to its folder, is not seen.
+
+		Args:
+			overwrite (bool): Whether to overwrite the original images. Defaults to False.
+			interval (float): Seconds between two polls of the folder. Defaults to 2.0.
+			stop (threading.Event, optional): Event to set to stop watching. Defaults to None (watch forever).
+		"""
+		self.config = {**self.config, 'incremental': True}
+		stop = stop or threading.Event()
+		manifest = Manifest(self.path)
+		scanner = FolderScanner(self.path, self.config, ImageOptimizer.allowed_extensions)
+		# Images not processed yet => (size, modification time) at the previous poll
+		waiting = {}
+		while not stop.is_set():
+			current = {}
+			_, changed = scanner.scan()
+			outputs = manifest.outputs()
+			for name in dict.fromkeys(changed + list(waiting)):
+				if name in outputs and name not in manifest.entries:
+					continue
+				try:
+					stat = os.stat(self.setAbsPath(name))
+				except FileNotFoundError:
+					continue
+				if manifest.isChanged(name, stat):
+					current[name] = (stat.st_size, stat.st_mtime_ns)
+			ready = [name for name, signature in current.items() if waiting.get(name) == signature]
+			waiting = {name: signature for name, signature in current.items() if name not in ready}
+			if ready:
+				self.compress(overwrite, ready, manifest=manifest)
+				# Images left out (ex: cancelled) are checked again on the next poll
+				waiting.update({name: None for name in ready if name not in manifest.entries})
+			stop.wait(interval)
+
+	def getImagesInfo(self) -> List[ImageInfo]:
+		"""
+		Get the metadata of the images from the `self.images` list, reading image headers only.
+
+		Returns:
+			List[ImageInfo]: The metadata of each readable image.
+		"""
+		images_info = []
+		for image_path in self.images:
+			try:
+				images_info.append(metadata.index.get(self.setAbsPath(image_path)))
 			except IOError as e:
 				print(f"Error opening image {image_path}: {e}")
+		return images_info
+
+	def getLargestImage(self) -> Optional[ImageInfo]:
+		"""
+		Finds the largest image in terms of dimensions from the `self.images` list.
+
+		Returns:
+			ImageInfo or None: The metadata of the largest image found, or None if no images are found or if dimensions are not determined.
+		"""
+		return max(self.getImagesInfo(), key=lambda info: info.area, default=None)
+
+	def prepareGifFrame(self, image_path: str, size: tuple, bgColor: tuple = (0, 0, 0), palette: Optional[bytes] = None) -> Image.Image:
+		"""
+		Resize an image and center it on the GIF background.
 
-		return largest_image
+		Args:
+			image_path (str): The image path.
+			size (tuple): The GIF canvas size (width, height).
+			bgColor (tuple): Background color as RGB.
+			palette (bytes, optional): Global palette of the GIF the frame is mapped on.
+
+		Returns:
+			Image.Image: The GIF frame, in P mode with a palette.
+		"""
+		max_width, max_height = size
+		# Open the image
+		im = Image.open(self.setAbsPath(image_path))			
+		# Resize the image while maintaining the aspect ratio
+		resized_frame = self.resize(im)			
+		# Create a black background if the image is smaller than the base size
+		background = Image.new("RGB", (max_width, max_height), bgColor)
+		# Center the image on the background
+		position = ((max_width - resized_frame.width) // 2, (max_height - resized_frame.height) // 2)
+		background.paste(resized_frame, position)
+		if palette is not None:
+			return mapFrame(background, palette)
+		return background
+
+	def buildGifPalette(self, executor: ThreadPoolExecutor, size: tuple, bgColor: tuple = (0, 0, 0)) -> Tuple[bytes, dict]:
+		"""
+		Build the palette shared by every frame of a GIF, from up to `PALETTE_SAMPLE_FRAMES` frames
+		spread over `self.images`.
+
+		Returns:
+			Tuple[bytes, dict]: The global palette (see `core.gifwriter.buildPalette`) and the sampled
+				frames by index in `self.images`, kept so they are not decoded again.
+		"""
+		step = -(-len(self.images) // PALETTE_SAMPLE_FRAMES)
+		indexes = range(0, len(self.images), step)
+		frames = dict(zip(indexes, executor.map(lambda i: self.prepareGifFrame(self.images[i], size, bgColor), indexes)))
+		return buildPalette(list(frames.values())), frames
 
 	def buildGif(self,
 		images: List[str] = [],
@@ -299,37 +1477,20 @@ class ImageOptimizer(object):
 			loop (int): The number of times the GIF should loop. 0 means loop indefinitely.
 			bgColor (tuple): Background color as RGB.
 		Returns:
-			dest_path (str): Destination path of the final GIF file.
+			dest_path (str): Destination path of the final GIF file, None if cancelled.
 		"""
 		# Set the list of images to be processed
 		if images:
 			self.images = images
 		else:
-			self.images = ImageOptimizer.parseImages(self.parent.basepath, self.path)
+			self.images = ImageOptimizer.parseImages(self.parent.basepath, self.path, self.config)
 
-		frames = []
 		# first_image = Image.open(self.setAbsPath(self.images[0]))		
 		largest_image = self.getLargestImage()
 		max_width, max_height = largest_image.size
 		if self.base_width > 0:
 			max_width = self.base_width
 			max_height = self.calculateAspectRatioHeight(max_width, largest_image)
-		for i, image_path in enumerate(self.images):
-			# Open the image
-			im = Image.open(self.setAbsPath(image_path))			
-			# Resize the image while maintaining the aspect ratio
-			resized_frame = self.resize(im)			
-			# Create a black background if the image is smaller than the base size
-			background = Image.new("RGB", (max_width, max_height), bgColor)
-			# Center the image on the background
-			position = ((max_width - resized_frame.width) // 2, (max_height - resized_frame.height) // 2)
-			background.paste(resized_frame, position)
-			# Append the resized frame to the frames list
-			frames.append(background)
-
-			# Emit the progress signal (Keep 25% to saving process)
-			progress_value = ((i + 1) * 100) // len(self.images) - 25
-			self.parent.signalProgression.emit(progress_value)
 
 		filename = self.generateRandomName('GIF_', 'gif')
 
@@ -339,18 +1500,206 @@ class ImageOptimizer(object):
 		else:
 			dest_path = self.setAbsPath(filename)
 
-		# Save the frames as a GIF
-		if frames:
-			frames[0].save(
-				dest_path,
-				save_all=True,
-				append_images=frames[1:],
-				loop=loop,
-				duration=duration,
-				optimize=True
-			)
+		# Every frame is mapped on one palette built from samples of the images, so frames are
+		# compared as palette indexes and only their changed pixels are written.
+		# Frames are prepared and encoded by a pool of threads, and written in order as soon
+		# as they are ready. At most `window` frames are held in memory at each stage.
+		workers = os.cpu_count() or 1
+		window = workers * 2
+		try:
+			with ThreadPoolExecutor(max_workers=workers) as executor:
+				palette, sampled = self.buildGifPalette(executor, (max_width, max_height), bgColor)
+				if self.cancelled.is_set():
+					raise OptimizationCancelled()
+				with GifStreamWriter(dest_path, (max_width, max_height), loop=loop, executor=executor, window=window, palette=palette, durability=self.config.get('durability') or atomic.DEFAULT_DURABILITY) as writer:
+					self.writeGifFrames(writer, executor, window, (max_width, max_height), duration, bgColor, palette, sampled)
+		except OptimizationCancelled:
+			print('GIF creation cancelled')
+			return None
+
 		self.parent.signalProgression.emit(100)
 		return dest_path
 
-# opt = ImageOptimizer(r'C:\Users\Usera\Pictures\bank\pixabay')
-# opt.compress()
\ No newline at end of file
+	def writeGifFrames(self,
+			writer: GifStreamWriter,
+			executor: ThreadPoolExecutor,
+			window: int,
+			size: tuple,
+			duration: int,
+			bgColor: tuple,
+			palette: Optional[bytes] = None,
+			sampled: Optional[dict] = None
+		) -> None:
+		"""
+		Prepare the frames of `self.images` in the executor and add them to the writer in order.
+		Frames already prepared to build the palette (`sampled`) are only mapped on it.
+		"""
+		sampled = sampled or {}
+		prepared = deque()
+		done = 0
+		for i, image_path in enumerate(self.images):
+			if i in sampled:
+				prepared.append(executor.submit(mapFrame, sampled.pop(i), palette))
+			else:
+				prepared.append(executor.submit(self.prepareGifFrame, image_path, size, bgColor, palette))
+			last = i == len(self.images) - 1
+			while prepared and (len(prepared) >= window or last):
+				if self.cancelled.is_set():
+					for future in prepared:
+						future.cancel()
+					# The writer removes the incomplete file
+					raise OptimizationCancelled()
+				writer.addFrame(prepared.popleft().result(), duration)
+				done += 1
+				# Emit the progress signal
+				self.parent.signalProgression.emit((done * 100) // len(self.images))
+
+class _CallbackSignal(object):
+	""" Mimic a Qt signal by forwarding emitted values to a plain callback """
+	def __init__(self, callback: Optional[Callable[[int], None]] = None):
+		super(_CallbackSignal, self).__init__()
+		self.callback = callback
+
+	def emit(self, value: int) -> None:
+		if self.callback:
+			self.callback(value)
+
+class HeadlessParent(object):
+	"""
+	Stand-in for the Qt application used as `ImageOptimizer.parent`, so the optimizer
+	can run without PyQt6 (scripts, cron jobs, containers).
+
+	Attributes:
+		basepath (str): The application base path.
+		signalProgression (object): Signal-like object whose `emit(int)` calls the progress callback.
+		signalImageDone (object): Signal-like object whose `emit(dict)` calls the result callback.
+	"""
+	def __init__(self,
+			on_progress: Optional[Callable[[int], None]] = None,
+			basepath: str = '',
+			on_result: Optional[Callable[[dict], None]] = None
+		):
+		super(HeadlessParent, self).__init__()
+		self.basepath = basepath
+		self.signalProgression = _CallbackSignal(on_progress)
+		self.signalImageDone = _CallbackSignal(on_result)
+
+def optimize(path: str = '',
+		images: List[str] = None,
+		config: dict = None,
+		overwrite: bool = False,
+		filemode: bool = False,
+		on_progress: Optional[Callable[[int], None]] = None,
+		on_result: Optional[Callable[[dict], None]] = None
+	) -> List[dict]:
+	"""
+	Compress and resize images without the GUI.
+
+	Args:
+		path (str): The folder containing images (folder mode).
+		images (List[str]): Image paths to compress. If None, every image of `path` is compressed.
+		config (dict): Same keys as `ImageOptimizer.config` (quality, base_width, format, prefix, timestamp, workers).
+		overwrite (bool): Whether to overwrite the original images. Defaults to False.
+		filemode (bool): Whether `images` are absolute paths. Defaults to False.
+		on_progress (Callable[[int], None]): Called with the progression (0-100) after each image.
+		on_result (Callable[[dict], None]): Called with the result of each image as soon as it is done.
+
+	Returns:
+		List[dict]: One result per image (see `ImageOptimizer.compress`).
+	"""
+	opt = ImageOptimizer(HeadlessParent(on_progress, on_result=on_result), path, {**DEFAULT_CONFIG, **(config or {})})
+	return opt.compress(overwrite, images, filemode=filemode)
+
+def _result(source: str, dest: str, error: Optional[str] = None, **details) -> dict:
+	return {'source': source, 'dest': dest, 'error': error, 'cached': False, **details}
+
+def _processPool(workers: int) -> ProcessPoolExecutor:
+	"""
+	Create a pool of worker processes and start them at once. Processes are forked when needed
+	otherwise: a process forked while another thread holds a lock (an import, stdout) waits for
+	it forever, so the pool is created before any thread of the caller is started.
+	"""
+	executor = ProcessPoolExecutor(max_workers=workers)
+	wait([executor.submit(os.getpid) for _ in range(workers)])
+	return executor
+
+def _jobPaths(job: tuple) -> Tuple[str, str]:
+	""" Source and destination paths of a compress job (the first rendition in rendition mode) """
+	image_path, dest_path = job
+	if isinstance(dest_path, list):
+		dest_path = dest_path[0][1] if dest_path else ''
+	return image_path, dest_path
+
+def _compressWorker(path: str, config: dict, image_path: str, dest_path: str) -> dict:
+	"""
+	Compress a single image. Defined at module level so it can be run in a worker process.
+
+	Args:
+		path (str): The path to the folder containing images.
+		config (dict): The optimizer configuration settings.
+		image_path (str): The source image path.
+		dest_path (str): The destination path of the optimized image.
+
+	Returns:
+		dict: The result of the image (see `ImageOptimizer.compress`).
+	"""
+	opt = None
+	try:
+		opt = ImageOptimizer(None, path, config)
+		details = opt.compressImage(image_path, dest_path)
+	except Exception as e:
+		if opt is not None:
+			opt.discardStaged()
+		return _result(image_path, dest_path, error=str(e))
+	# The output is committed by the process running `compress`
+	return _result(image_path, details.pop('dest', dest_path), staged=opt.staged, **details)
+
+def _renditionsWorker(path: str, config: dict, image_path: str, renditions: List[Tuple[int, str]]) -> dict:
+	"""
+	Write the renditions of a single image. Defined at module level so it can be run in a worker process.
+
+	Args:
+		path (str): The path to the folder containing images.
+		config (dict): The optimizer configuration settings.
+		image_path (str): The source image path.
+		renditions (List[Tuple[int, str]]): (width, destination path) of each rendition.
+
+	Returns:
+		dict: The result of the image, `dest` being the path of the first rendition.
+	"""
+	dest_path = renditions[0][1] if renditions else ''
+	opt = None
+	try:
+		opt = ImageOptimizer(None, path, config)
+		details = opt.compressRenditions(image_path, renditions)
+	except Exception as e:
+		if opt is not None:
+			opt.discardStaged()
+		return _result(image_path, dest_path, error=str(e))
+	return _result(image_path, dest_path, staged=opt.staged, **details)
+
+def _encodeWorker(path: str, config: dict, image_path: str, dest_path: str, source: Optional[bytes] = None) -> dict:
+	"""
+	Compress a single image in memory, without writing it. Defined at module level so it can be run in a worker process.
+
+	Args:
+		path (str): The path to the folder containing images.
+		config (dict): The optimizer configuration settings.
+		image_path (str): The source image path.
+		dest_path (str): The destination path of the optimized image, used for the format.
+		source (bytes, optional): The content of the source file, when it was already read.
+
+	Returns:
+		dict: The result of the image, with the encoded image in `data`.
+	"""
+	try:
+		opt = ImageOptimizer(None, path, config)
+		data, details = opt.encodeFile(image_path, dest_path, source)
+	except Exception as e:
+		return _result(image_path, dest_path, error=str(e))
+	return _result(image_path, details.pop('dest', dest_path), data=data, metrics=opt.timer.record(), **details)
+
+if __name__ == '__main__':
+	# python -m core.optimizer [options] <folder | images...>
+	from core.cli import main
+	raise SystemExit(main())
\ No newline at end of file
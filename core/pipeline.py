@@ -0,0 +1,124 @@
+import os, queue, threading
+from collections import deque
+from typing import Callable, List, Optional
+
+from core.atomic import AtomicWriter, writeTemp
+from core.kitbuilder import Kitbuilder
+from core.optimizer import DEFAULT_CONFIG, HeadlessParent, ImageOptimizer, _encodeWorker, _processPool, _result
+
+def optimizeAndUpload(kitbuilder: Kitbuilder,
+		path: str = '',
+		images: List[str] = None,
+		config: dict = None,
+		filemode: bool = False,
+		write_local: bool = False,
+		queue_size: int = 8,
+		on_result: Optional[Callable[[dict], None]] = None
+	) -> List[dict]:
+	"""
+	Compress images and upload them to Kitbuilder, without reading them back from the disk.
+
+	Images are encoded in memory (by a pool of `workers` processes, or one after another) and
+	handed to `kitbuilder.workers` upload threads through a queue of `queue_size` images: encoding
+	and uploading overlap, and encoding waits when uploads fall behind, so at most about
+	`queue_size` encoded images are held in memory.
+
+	Args:
+		kitbuilder (Kitbuilder): The logged in Kitbuilder client.
+		path (str): The folder containing images (folder mode).
+		images (List[str]): Image paths to compress. If None, every image of `path` is compressed.
+		config (dict): Same keys as `ImageOptimizer.config`. The result cache is not used.
+		filemode (bool): Whether `images` are absolute paths. Defaults to False.
+		write_local (bool): Also write the optimized images to their destination. Defaults to False.
+		queue_size (int): Maximum number of encoded images waiting to be uploaded.
+		on_result (Callable[[dict], None]): Called with the result of each image as soon as it is uploaded (and written, see `write_local`).
+
+	Returns:
+		List[dict]: One result per image, in the same order, with the keys of `ImageOptimizer.compress`
+			and the upload result (`url`, `id`, `duplicate`).
+	"""
+	config = {**DEFAULT_CONFIG, **(config or {})}
+	opt = ImageOptimizer(HeadlessParent(), path, config)
+	if not images:
+		# Same discovery as `compress`: recursive, include/exclude patterns, output folder left out
+		images = list(opt.findImages())
+	jobs = [(image_path, opt.getDestPath(image_path, False, filemode)) for image_path in images]
+	results = [None] * len(jobs)
+	uploads = queue.Queue(maxsize=queue_size)
+	uploaders = max(1, kitbuilder.workers)
+	writer = AtomicWriter.fromConfig(config)
+	workers = config.get('workers', 1) or os.cpu_count()
+	# The worker processes are started before the threads (see `_processPool`)
+	executor = _processPool(min(workers, len(jobs))) if workers > 1 and len(jobs) > 1 else None
+
+	def encode():
+		try:
+			if executor:
+				# Submit in order, a few images ahead: the queue holds the encoded ones
+				pending = deque()
+				for i, (image_path, dest_path) in enumerate(jobs):
+					pending.append((i, executor.submit(_encodeWorker, path, config, image_path, dest_path)))
+					while pending and (len(pending) > workers or i == len(jobs) - 1):
+						j, future = pending.popleft()
+						try:
+							result = future.result()
+						except Exception as e:
+							# The worker process itself died (ex: out of memory)
+							result = _result(*jobs[j], error=str(e))
+						uploads.put((j, result))
+			else:
+				for i, (image_path, dest_path) in enumerate(jobs):
+					try:
+						result = _encodeWorker(path, config, image_path, dest_path)
+					except Exception as e:
+						result = _result(image_path, dest_path, error=str(e))
+					uploads.put((i, result))
+		finally:
+			for _ in range(uploaders):
+				uploads.put(None)
+
+	def upload():
+		while True:
+			item = uploads.get()
+			if item is None:
+				return
+			i, result = item
+			data = result.pop('data', None)
+			staged = []
+			if result['error']:
+				print(f"Error optimizing image {result['source']}: {result['error']}")
+			else:
+				try:
+					if write_local:
+						staged.append((writeTemp(result['dest'], data), result['dest']))
+					result.update(kitbuilder.uploadBytes(data, os.path.basename(result['dest'])))
+				except Exception as e:
+					result['error'] = str(e)
+				if result['error']:
+					print(f"Error uploading image {result['source']}: {result['error']}")
+
+			def committed(i=i, result=result):
+				# The local copy could not replace its destination, which keeps its previous content
+				if result['dest'] in writer.failed and not result['error']:
+					result['error'] = writer.failed[result['dest']]
+				results[i] = result
+				if on_result:
+					on_result(result)
+
+			# The result is reported once the local copy is on the disk
+			writer.commitAll(staged, committed)
+
+	threads = [threading.Thread(target=encode)] + [threading.Thread(target=upload) for _ in range(uploaders)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	if executor:
+		executor.shutdown()
+	writer.close()
+	for i, result in enumerate(results):
+		if result is None:
+			# Left out when encoding stopped on an unexpected error
+			results[i] = _result(*jobs[i], error='Not encoded')
+	kitbuilder.saveUploadIndex()
+	return results
@@ -0,0 +1,107 @@
+from typing import Dict, Optional
+from PIL import Image
+
+from core import lossless
+
+# Encoder profiles, from the fastest encode to the smallest output
+PROFILES = ['fast', 'balanced', 'smallest']
+# 'balanced' is what every output was encoded with before profiles existed
+DEFAULT_PROFILE = 'balanced'
+# Pillow save parameters of each profile, per Pillow format (the quality is set separately)
+PROFILE_PARAMS = {
+	# Chroma is subsampled 4:2:0 by default, `encoder_params` can set another `subsampling`
+	'JPEG': {
+		'fast': {'optimize': False},
+		'balanced': {'optimize': True},
+		# Progressive scans are usually a few percent smaller, and display earlier
+		'smallest': {'optimize': True, 'progressive': True},
+	},
+	'WEBP': {
+		'fast': {'method': 1},
+		'balanced': {'method': 4},
+		'smallest': {'method': 6},
+	},
+	'AVIF': {
+		'fast': {'speed': 9},
+		'balanced': {'speed': 6},
+		'smallest': {'speed': 2},
+	},
+	'PNG': {
+		'fast': {'compress_level': 1},
+		'balanced': {'optimize': True},
+		'smallest': {'optimize': True},
+	},
+	'GIF': {
+		'fast': {'optimize': False},
+		'balanced': {'optimize': True},
+		# Interlacing reorders the rows, which compresses a little worse
+		'smallest': {'optimize': True, 'interlace': False},
+	},
+}
+# Parameters of the formats without profiles
+DEFAULT_PARAMS = {'optimize': True}
+# PNG profiles that run the lossless pass (palette reduction and zlib strategy search), and its
+# arguments (see `core.lossless.optimizePng`). The PNG parameters above are used without the pass
+LOSSLESS_PNG_PROFILES = {
+	'balanced': {'trials': lossless.PNG_TRIALS},
+	'smallest': {'trials': lossless.PNG_TRIALS_SMALLEST},
+}
+
+def formatName(extension: str) -> Optional[str]:
+	""" Pillow format of an extension of the config (ex: jpg => JPEG), None if it is unknown """
+	return Image.registered_extensions().get(f'.{extension.lower().lstrip(".")}')
+
+def profileName(config: dict, save_format: str) -> str:
+	"""
+	Get the encoder profile of an output format, from the `profiles` setting (profile per format,
+	ex: {"jpg": "smallest"}) or else the `profile` setting.
+
+	Args:
+		config (dict): The optimizer configuration.
+		save_format (str): The Pillow format.
+
+	Returns:
+		str: One of `PROFILES`.
+	"""
+	name = config.get('profile') or DEFAULT_PROFILE
+	for extension, profile in (config.get('profiles') or {}).items():
+		if formatName(extension) == save_format:
+			name = profile
+	if name not in PROFILES:
+		raise ValueError(f"Unknown encoder profile: {name} (expected one of {', '.join(PROFILES)})")
+	return name
+
+def saveParams(config: dict, save_format: str) -> Dict[str, object]:
+	"""
+	Get the Pillow save parameters of an output format: the parameters of its profile, updated
+	with the `encoder_params` setting of the format (ex: {"jpg": {"subsampling": "4:4:4"}}).
+
+	Args:
+		config (dict): The optimizer configuration.
+		save_format (str): The Pillow format.
+
+	Returns:
+		Dict[str, object]: The save parameters, without the quality.
+	"""
+	params = dict(PROFILE_PARAMS.get(save_format, {}).get(profileName(config, save_format), DEFAULT_PARAMS))
+	params.update(encoderParams(config, save_format))
+	return params
+
+def encoderParams(config: dict, save_format: str) -> Dict[str, object]:
+	""" Get the `encoder_params` setting of an output format (ex: {"jpg": {"subsampling": "4:4:4"}}) """
+	params = {}
+	for extension, overrides in (config.get('encoder_params') or {}).items():
+		if formatName(extension) == save_format:
+			params.update(overrides)
+	return params
+
+def losslessPng(config: dict) -> bool:
+	""" Whether PNG outputs go through the lossless pass """
+	return config.get('lossless_png', True) and profileName(config, 'PNG') in LOSSLESS_PNG_PROFILES
+
+def losslessPngArgs(config: dict) -> dict:
+	"""
+	Get the arguments of the PNG lossless pass (see `core.lossless.optimizePng`): the ones of the
+	profile, and the `encoder_params` of PNG, except the zlib settings that the pass searches.
+	"""
+	return {**LOSSLESS_PNG_PROFILES[profileName(config, 'PNG')], 'params': encoderParams(config, 'PNG')}
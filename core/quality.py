@@ -0,0 +1,96 @@
+import numpy as np
+from io import BytesIO
+from PIL import Image
+from typing import List
+
+# Constants of the SSIM formula (Wang et al. 2004), for 8-bit images
+SSIM_K1 = 0.01
+SSIM_K2 = 0.03
+# Side of the square window of the local statistics
+SSIM_WINDOW = 7
+# Score of two identical images, instead of an infinite PSNR
+MAX_PSNR = 100.0
+# ITU-R BT.601 luma weights
+LUMA = np.array([0.299, 0.587, 0.114])
+
+def hasTransparency(im: Image.Image) -> bool:
+	""" Whether an image has transparent pixels (not only an alpha channel) """
+	if im.mode == 'P' and 'transparency' in im.info:
+		im = im.convert('RGBA')
+	if 'A' not in im.getbands():
+		return False
+	return im.getchannel('A').getextrema()[0] < 255
+
+def channels(im: Image.Image, alpha: bool) -> List[np.ndarray]:
+	"""
+	Planes compared by the quality metrics: the luma of the image and, with `alpha`, its alpha channel.
+	Colors are premultiplied by the alpha, so changes under transparent pixels are not counted.
+
+	Args:
+		im (Image.Image): The image.
+		alpha (bool): Whether to compare the transparency.
+
+	Returns:
+		List[np.ndarray]: 2D float planes in the 0-255 range.
+	"""
+	pixels = np.asarray(im.convert('RGBA' if alpha else 'RGB'), dtype=np.float64)
+	luma = pixels[..., :3] @ LUMA
+	if not alpha:
+		return [luma]
+	return [luma * pixels[..., 3] / 255, pixels[..., 3]]
+
+def _windowMeans(plane: np.ndarray, window: int) -> np.ndarray:
+	""" Mean of every window x window block of a plane, from its summed-area table """
+	table = np.pad(plane, ((1, 0), (1, 0))).cumsum(0).cumsum(1)
+	sums = table[window:, window:] - table[:-window, window:] - table[window:, :-window] + table[:-window, :-window]
+	return sums / (window * window)
+
+def ssim(a: np.ndarray, b: np.ndarray, window: int = SSIM_WINDOW) -> float:
+	"""
+	Mean structural similarity of two planes, with uniform windows (as scikit-image does by default).
+
+	Args:
+		a (np.ndarray): The reference plane.
+		b (np.ndarray): The compared plane, of the same shape.
+		window (int): Side of the windows, reduced for tiny images.
+
+	Returns:
+		float: The SSIM, 1.0 for identical planes.
+	"""
+	window = max(1, min(window, *a.shape))
+	count = window * window
+	# Sample covariances over each window
+	normalize = count / (count - 1) if count > 1 else 1.0
+	mean_a, mean_b = _windowMeans(a, window), _windowMeans(b, window)
+	var_a = (_windowMeans(a * a, window) - mean_a * mean_a) * normalize
+	var_b = (_windowMeans(b * b, window) - mean_b * mean_b) * normalize
+	covariance = (_windowMeans(a * b, window) - mean_a * mean_b) * normalize
+	c1, c2 = (SSIM_K1 * 255) ** 2, (SSIM_K2 * 255) ** 2
+	ssim_map = ((2 * mean_a * mean_b + c1) * (2 * covariance + c2)) / ((mean_a ** 2 + mean_b ** 2 + c1) * (var_a + var_b + c2))
+	return float(ssim_map.mean())
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+	""" Peak signal-to-noise ratio of two planes in dB, `MAX_PSNR` when they are identical """
+	mse = float(np.mean((a - b) ** 2))
+	if mse == 0:
+		return MAX_PSNR
+	return min(MAX_PSNR, float(10 * np.log10(255 ** 2 / mse)))
+
+def compare(reference: Image.Image, data: bytes, alpha: bool) -> dict:
+	"""
+	Score an encoded image against the image it was encoded from.
+
+	Args:
+		reference (Image.Image): The image before encoding.
+		data (bytes): The encoded image.
+		alpha (bool): Whether to compare the transparency.
+
+	Returns:
+		dict: `ssim` and `psnr`, the worst score of the compared planes.
+	"""
+	with Image.open(BytesIO(data)) as decoded:
+		pairs = list(zip(channels(reference, alpha), channels(decoded, alpha)))
+	return {
+		'ssim': round(min(ssim(a, b) for a, b in pairs), 5),
+		'psnr': round(min(psnr(a, b) for a, b in pairs), 2)
+	}
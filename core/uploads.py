@@ -0,0 +1,78 @@
+import os, json, hashlib, tempfile, threading
+from typing import Dict, Optional
+
+class UploadIndex(object):
+	"""
+	Persistent record of the images uploaded to Kitbuilder, keyed on their content.
+
+	Uploading a file whose bytes were already uploaded returns the url of the existing image
+	instead of sending it again, whatever the name or the folder of the file.
+
+	Attributes:
+		path (str): The path of the index file.
+		entries (dict): SHA-256 of the content => {'url', 'id'}.
+	"""
+
+	def __init__(self, path: str):
+		super(UploadIndex, self).__init__()
+		self.path = path
+		self.entries: Dict[str, dict] = {}
+		self.lock = threading.Lock()
+		# Content hash => lock held while the content is being uploaded
+		self.uploading: Dict[str, threading.Lock] = {}
+		self.load()
+
+	@staticmethod
+	def hashBytes(content: bytes) -> str:
+		return hashlib.sha256(content).hexdigest()
+
+	def load(self) -> None:
+		try:
+			with open(self.path, encoding='utf-8') as json_data:
+				self.entries = json.load(json_data)
+		except FileNotFoundError:
+			self.entries = {}
+		except ValueError:
+			print(f'Invalid upload index, images will be uploaded again: {self.path}')
+			self.entries = {}
+
+	def save(self) -> None:
+		""" Write the index through a temporary file so a crash never leaves it truncated """
+		fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix='.tmp')
+		try:
+			with os.fdopen(fd, 'w', encoding='utf-8') as f, self.lock:
+				json.dump(self.entries, f, indent=1)
+			os.replace(tmp_path, self.path)
+		except OSError:
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+			raise
+
+	def get(self, digest: str) -> Optional[dict]:
+		return self.entries.get(digest)
+
+	def add(self, digest: str, url: str, image_id=None) -> None:
+		with self.lock:
+			self.entries[digest] = {'url': url, 'id': image_id}
+
+	def replace(self, entries: Dict[str, dict]) -> None:
+		with self.lock:
+			self.entries = entries
+
+	def update(self, entries: Dict[str, dict]) -> None:
+		with self.lock:
+			self.entries.update(entries)
+
+	def removeId(self, image_id) -> None:
+		""" Forget the images with this gallery id (ex: deleted from the gallery) """
+		with self.lock:
+			for digest in [digest for digest, entry in self.entries.items() if str(entry.get('id')) == str(image_id)]:
+				del self.entries[digest]
+
+	def uploadLock(self, digest: str) -> threading.Lock:
+		"""
+		Lock to hold while checking and uploading a content, so identical files uploaded at the
+		same time by several threads are only sent once.
+		"""
+		with self.lock:
+			return self.uploading.setdefault(digest, threading.Lock())
@@ -0,0 +1,156 @@
+import hashlib, json, threading
+from email import message_from_bytes
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+class StandinServer(ThreadingHTTPServer):
+	"""
+	Local stand-in of the Kitbuilder api, enough for `core.kitbuilder.Kitbuilder` to log in,
+	list, upload, download and delete images. It runs in a background thread on a free port.
+	Gallery pages have an ETag, and a request with the current one in If-None-Match is
+	answered 304 Not Modified, without content.
+
+	Usage:
+		with StandinServer() as server:
+			kitbuilder = Kitbuilder(StandinServer.creds, base_url=server.url)
+
+	Attributes:
+		url (str): Base url of the api, to pass as `base_url`.
+		token (str): The CSRF token expected by the api, see `expireToken`.
+		images (List[dict]): The gallery: {'id', 'name', 'url', 'content'}.
+		faults (List[Tuple[int, bool]]): (status, processed) answers of the next api requests:
+			the request fails with `status`, after it was carried out when `processed` is True.
+		requests (List[Tuple[str, str]]): (method, path) of every request received.
+	"""
+	creds = {'username': 'user@example.com', 'password': 'secret'}
+	page_size = 2
+
+	def __init__(self):
+		super(StandinServer, self).__init__(('127.0.0.1', 0), _Handler)
+		self.url = f'http://127.0.0.1:{self.server_address[1]}/'
+		self.token = 'token-1'
+		self.images: List[dict] = []
+		self.faults: List[Tuple[int, bool]] = []
+		self.requests: List[Tuple[str, str]] = []
+		self.lock = threading.Lock()
+		self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+	def __enter__(self):
+		self.thread.start()
+		return self
+
+	def __exit__(self, *args):
+		self.shutdown()
+		self.server_close()
+
+	def expireToken(self) -> None:
+		""" Reject the current CSRF token (HTTP 419) until the client fetches the new one """
+		with self.lock:
+			self.token = f'token-{int(self.token.split("-")[1]) + 1}'
+
+	def nextFault(self) -> Optional[Tuple[int, bool]]:
+		with self.lock:
+			return self.faults.pop(0) if self.faults else None
+
+class _Handler(BaseHTTPRequestHandler):
+	server: StandinServer
+
+	def log_message(self, format, *args):
+		pass
+
+	def send(self, status: int, body=b'', content_type: str = 'application/json', headers: Optional[dict] = None) -> None:
+		if not isinstance(body, bytes):
+			body = json.dumps(body).encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(body)))
+		for name, value in (headers or {}).items():
+			self.send_header(name, value)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def sendTokenPage(self) -> None:
+		html = f'<html><head><meta name="csrf-token" content="{self.server.token}"></head></html>'
+		self.send(200, html.encode('utf-8'), 'text/html')
+
+	def body(self) -> bytes:
+		return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+	def handle_one_request(self):
+		# Keep the client's connections alive, as a real server does
+		self.protocol_version = 'HTTP/1.1'
+		super(_Handler, self).handle_one_request()
+
+	def route(self, method: str) -> None:
+		url = urlparse(self.path)
+		self.server.requests.append((method, url.path))
+		body = self.body() if method in ('POST', 'PUT') else b''
+		if url.path == '/sanctum/csrf-cookie':
+			return self.send(204, headers={'Set-Cookie': 'XSRF-TOKEN=xsrf; Path=/'})
+		if url.path == '/login':
+			if method == 'GET':
+				return self.sendTokenPage()
+			form = {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+			creds = StandinServer.creds
+			if form.get('email') != creds['username'] or form.get('password') != creds['password']:
+				return self.send(422, {'message': 'These credentials do not match our records.'})
+			return self.send(200, {})
+		if url.path.startswith('/storage/'):
+			image = next((image for image in self.server.images if image['url'] == url.path), None)
+			return self.send(200, image['content'], 'image/octet-stream') if image else self.send(404, {'message': 'Not found'})
+		if not url.path.startswith('/api/images'):
+			return self.send(404, {'message': 'Not found'})
+		if method == 'GET' and 'application/json' not in (self.headers.get('Accept') or ''):
+			# Page of the gallery, where the client finds a new CSRF token
+			return self.sendTokenPage()
+		if self.headers.get('X-CSRF-TOKEN') != self.server.token:
+			return self.send(419, {'message': 'CSRF token mismatch.'})
+		fault = self.server.nextFault()
+		if fault and not fault[1]:
+			return self.send(fault[0], {'message': 'Fault'})
+		status, response = getattr(self, f'api{method.capitalize()}')(url, body)
+		if fault:
+			# Carried out, but the client only gets the error
+			return self.send(fault[0], {'message': 'Fault'})
+		if method == 'GET':
+			etag = '"' + hashlib.sha256(json.dumps(response, sort_keys=True).encode('utf-8')).hexdigest()[:16] + '"'
+			if self.headers.get('If-None-Match') == etag:
+				return self.send(304, headers={'ETag': etag})
+			return self.send(status, response, headers={'ETag': etag})
+		self.send(status, response)
+
+	def apiGet(self, url, body) -> Tuple[int, dict]:
+		page = int(parse_qs(url.query).get('page', ['1'])[0])
+		size = StandinServer.page_size
+		images = [{'id': image['id'], 'url': image['url'], 'name': image['name']} for image in self.server.images]
+		last_page = max(1, -(-len(images) // size))
+		return 200, {'data': images[(page - 1) * size:page * size], 'current_page': page, 'last_page': last_page}
+
+	def apiPost(self, url, body) -> Tuple[int, dict]:
+		message = message_from_bytes(b'Content-Type: ' + self.headers['Content-Type'].encode('latin-1') + b'\r\n\r\n' + body, policy=HTTP)
+		part = next((part for part in message.iter_parts() if part.get_param('name', header='content-disposition') == 'image_to_upload'), None)
+		if part is None:
+			return 422, {'error': 'No image'}
+		with self.server.lock:
+			image_id = len(self.server.images) + 1
+			name = part.get_filename()
+			image = {'id': image_id, 'name': name, 'url': f'/storage/{image_id}-{name}', 'content': part.get_payload(decode=True)}
+			self.server.images.append(image)
+		return 201, {'url': image['url'], 'id': image_id}
+
+	def apiDelete(self, url, body) -> Tuple[int, dict]:
+		image_id = int(url.path.rstrip('/').rsplit('/', 1)[1])
+		with self.server.lock:
+			self.server.images = [image for image in self.server.images if image['id'] != image_id]
+		return 200, {'response': 'Image deleted'}
+
+	def do_GET(self):
+		self.route('GET')
+
+	def do_POST(self):
+		self.route('POST')
+
+	def do_DELETE(self):
+		self.route('DELETE')
@@ -0,0 +1,80 @@
+import os, time
+import numpy as np
+import pytest
+from PIL import Image
+
+from core.atomic import AtomicWriter, TEMP_SUFFIX, writeTemp
+from core.optimizer import HeadlessParent, ImageOptimizer
+
+def commit(writer, path, data, done):
+	writer.commitAll([(writeTemp(str(path), data), str(path))], lambda: done.append((path.name, path.read_bytes())))
+
+def test_batch_reports_after_rename(tmp_path):
+	writer = AtomicWriter('batch', batch_size=2)
+	done = []
+	commit(writer, tmp_path / 'a.bin', b'a', done)
+	assert done == [] and not (tmp_path / 'a.bin').exists()
+	commit(writer, tmp_path / 'b.bin', b'b', done)
+	assert done == [('a.bin', b'a'), ('b.bin', b'b')]
+	commit(writer, tmp_path / 'c.bin', b'c', done)
+	writer.close()
+	assert done[-1] == ('c.bin', b'c')
+	assert not [name for name in os.listdir(tmp_path) if name.endswith(TEMP_SUFFIX)]
+
+def test_callbacks_keep_commit_order(tmp_path):
+	writer = AtomicWriter('batch', batch_size=10)
+	done = []
+	commit(writer, tmp_path / 'a.bin', b'a', done)
+	# Nothing to commit (ex: a failed image), it still waits for the previous files
+	writer.commitAll([], lambda: done.append('empty'))
+	assert done == []
+	writer.close()
+	assert done == [('a.bin', b'a'), 'empty']
+
+def test_new_files_follow_umask(tmp_path):
+	umask = os.umask(0o027)
+	try:
+		writer = AtomicWriter('none')
+		writer.write(str(tmp_path / 'a.bin'), b'a')
+	finally:
+		os.umask(umask)
+	assert os.stat(tmp_path / 'a.bin').st_mode & 0o777 == 0o640
+
+def test_replaced_files_keep_their_mode(tmp_path):
+	path = tmp_path / 'a.bin'
+	path.write_bytes(b'old')
+	os.chmod(path, 0o604)
+	with AtomicWriter('always') as writer:
+		writer.write(str(path), b'new')
+	assert path.read_bytes() == b'new'
+	assert os.stat(path).st_mode & 0o777 == 0o604
+
+def test_group_flushed_after_batch_seconds(tmp_path):
+	writer = AtomicWriter('batch', batch_size=10, batch_seconds=0.1)
+	done = []
+	commit(writer, tmp_path / 'a.bin', b'a', done)
+	deadline = time.monotonic() + 2
+	while not done and time.monotonic() < deadline:
+		time.sleep(0.01)
+	# No later commit is needed: the timer flushes the group
+	assert done == [('a.bin', b'a')]
+	writer.close()
+
+@pytest.mark.parametrize('io_threads', [0, 2])
+def test_progress_and_cancel_during_batch(tmp_path, io_threads):
+	rng = np.random.default_rng(1)
+	for i in range(40):
+		Image.fromarray((rng.random((300, 400, 3)) * 255).astype('uint8')).save(tmp_path / f'{i:02}.png')
+	progress = []
+
+	def onProgress(value):
+		if not progress:
+			progress.append(time.monotonic() - start)
+			opt.cancel()
+
+	config = {'timestamp': False, 'base_width': 400, 'io_threads': io_threads, 'durability_seconds': 0.1}
+	opt = ImageOptimizer(HeadlessParent(onProgress), str(tmp_path), config)
+	start = time.monotonic()
+	results = opt.compress()
+	assert progress and progress[0] < 1
+	assert any(result.get('cancelled') for result in results)
@@ -0,0 +1,24 @@
+import numpy as np
+from PIL import Image
+
+from core.optimizer import HeadlessParent, ImageOptimizer
+
+def noise(path):
+	Image.fromarray((np.random.default_rng(1).random((120, 160, 3)) * 255).astype('uint8')).save(path)
+
+def compress(folder, **settings):
+	config = {'timestamp': False, 'base_width': 160, 'max_bytes': 2000, **settings}
+	return ImageOptimizer(HeadlessParent(), str(folder), config).compress()[0]
+
+def test_png_over_budget(tmp_path, capsys):
+	noise(tmp_path / 'a.png')
+	result = compress(tmp_path)
+	assert result['error'] is None and result['over_budget']
+	assert 'PNG is lossless' in capsys.readouterr().out
+
+def test_lossy_over_budget(tmp_path):
+	for name in ['small', 'large']:
+		(tmp_path / name).mkdir()
+		noise(tmp_path / name / 'a.jpg')
+	assert compress(tmp_path / 'small', max_bytes=500)['over_budget']
+	assert 'over_budget' not in compress(tmp_path / 'large', max_bytes=10 ** 7)
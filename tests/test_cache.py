@@ -0,0 +1,52 @@
+import os, time
+import pytest
+
+from core import cache
+from core.cache import ResultCache
+
+@pytest.fixture(autouse=True)
+def sizes(monkeypatch):
+	# Every test starts as a new process
+	monkeypatch.setattr(cache, '_sizes', {})
+
+def output(tmp_path, name, size):
+	path = tmp_path / name
+	path.write_bytes(b'x' * size)
+	return str(path)
+
+def test_hit_and_miss(tmp_path):
+	results = ResultCache(str(tmp_path / 'cache'))
+	assert not results.get('k', str(tmp_path / 'out'))
+	results.put('k', output(tmp_path, 'a', 10))
+	assert results.get('k', str(tmp_path / 'out'))
+	assert (tmp_path / 'out').read_bytes() == b'x' * 10
+	assert (results.hits, results.misses) == (1, 1)
+
+def test_lru_eviction(tmp_path):
+	results = ResultCache(str(tmp_path / 'cache'), max_size=30)
+	for i, key in enumerate(['a', 'b', 'c']):
+		results.put(key, output(tmp_path, key, 10))
+		os.utime(results.entryPath(key), (time.time() - 100 + i, time.time() - 100 + i))
+	# A hit makes the oldest entry the most recently used one
+	assert results.get('a', str(tmp_path / 'out'))
+	results.put('d', output(tmp_path, 'd', 10))
+	assert sorted(os.listdir(tmp_path / 'cache')) == ['a', 'c', 'd']
+	assert results.size == 30
+
+def test_folder_scanned_once(tmp_path, monkeypatch):
+	scans = []
+	scandir = os.scandir
+	monkeypatch.setattr(cache.os, 'scandir', lambda path: scans.append(path) or scandir(path))
+	for key in ['a', 'b', 'c']:
+		# A new cache per image, as in the worker processes
+		ResultCache(str(tmp_path / 'cache'), max_size=1000).put(key, output(tmp_path, key, 10))
+	assert len(scans) == 1
+	assert ResultCache(str(tmp_path / 'cache')).size == 30
+
+def test_key(tmp_path, monkeypatch):
+	source = output(tmp_path, 'source', 10)
+	key = ResultCache.key(source, {'quality': 80})
+	assert key == ResultCache.key(source, {'quality': 80, 'workers': 4})
+	assert key != ResultCache.key(source, {'quality': 70})
+	monkeypatch.setattr(cache, 'CACHE_VERSION', cache.CACHE_VERSION + 1)
+	assert key != ResultCache.key(source, {'quality': 80})
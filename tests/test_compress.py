@@ -0,0 +1,70 @@
+import os, threading, time
+import numpy as np
+import pytest
+from PIL import Image
+
+from core import optimizer
+from core.optimizer import HeadlessParent, ImageOptimizer
+
+@pytest.fixture(scope='module')
+def sources(tmp_path_factory):
+	folder = tmp_path_factory.mktemp('sources')
+	rng = np.random.default_rng(1)
+	for i, ext in enumerate(['jpg', 'png', 'webp', 'bmp', 'jpg', 'png', 'gif', 'jpg']):
+		Image.fromarray((rng.random((90 + i * 10, 120, 3)) * 255).astype('uint8')).save(folder / f'{i:02}.{ext}')
+	(folder / '08.jpg').write_bytes(b'not an image')
+	return folder
+
+def run(sources, folder, **settings):
+	for name in os.listdir(sources):
+		(folder / name).write_bytes((sources / name).read_bytes())
+	progress, done = [], []
+	parent = HeadlessParent(progress.append, on_result=lambda result: done.append(result['source']))
+	config = {'timestamp': False, 'base_width': 100, **settings}
+	results = ImageOptimizer(parent, str(folder), config).compress(images=sorted(os.listdir(sources)))
+	outputs = {name: (folder / name).read_bytes() for name in sorted(os.listdir(folder)) if '-export' in name}
+	return results, outputs, progress, done
+
+@pytest.mark.parametrize('workers, io_threads', [(1, 2), (4, 0), (4, 2)])
+def test_same_outputs_in_every_mode(sources, tmp_path, workers, io_threads):
+	(tmp_path / 'reference').mkdir()
+	(tmp_path / 'mode').mkdir()
+	reference = run(sources, tmp_path / 'reference', workers=1, io_threads=0)
+	results, outputs, progress, done = run(sources, tmp_path / 'mode', workers=workers, io_threads=io_threads)
+	assert outputs == reference[1] and len(outputs) == 8
+	# Results follow the order of the images, and so do the result signals of the staged pipeline
+	# (the process pool alone reports the images as they complete)
+	names = sorted(os.listdir(sources))
+	assert [result['source'] for result in results] == names == reference[3]
+	assert (done if io_threads else sorted(done)) == names
+	assert [result['error'] is None for result in results] == [result['error'] is None for result in reference[0]]
+	assert results[-1]['error']
+	assert progress == sorted(progress) and progress[-1] == 100
+
+def test_prefetch_bounds_the_pipeline(sources, tmp_path, monkeypatch):
+	encode = optimizer._encodeWorker
+	def slowEncode(*args):
+		time.sleep(0.05)
+		return encode(*args)
+	# One worker is a thread: the patched encoder is used
+	monkeypatch.setattr(optimizer, '_encodeWorker', slowEncode)
+	for name in os.listdir(sources):
+		(tmp_path / name).write_bytes((sources / name).read_bytes())
+	opt = ImageOptimizer(HeadlessParent(), str(tmp_path), {'timestamp': False, 'base_width': 100, 'workers': 1, 'io_threads': 2, 'prefetch': 2})
+	lock = threading.Lock()
+	inflight, peak = [0], [0]
+	readSource, commitResult = opt.readSource, opt.commitResult
+	def read(*args):
+		with lock:
+			inflight[0] += 1
+			peak[0] = max(peak[0], inflight[0])
+		return readSource(*args)
+	def commit(*args):
+		with lock:
+			inflight[0] -= 1
+		return commitResult(*args)
+	opt.readSource, opt.commitResult = read, commit
+	results = opt.compress(images=sorted(os.listdir(sources)))
+	assert len(results) == 9 and inflight[0] == 0
+	# Reading waits for the slow encoder: never more than `prefetch` images between read and result
+	assert peak[0] == 2
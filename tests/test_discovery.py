@@ -0,0 +1,53 @@
+import os
+import pytest
+
+from core.discovery import IMAGE_EXTENSIONS, findImages, walkImages
+
+@pytest.fixture
+def tree(tmp_path):
+	for name in ['a.jpg', 'B.PNG', 'c.Tiff', 'd.bmp', 'notes.txt', 'noext', 'icons/e.png', 'icons/f-export.jpg', 'raw/deep/g.gif']:
+		path = tmp_path / name
+		os.makedirs(path.parent, exist_ok=True)
+		path.write_bytes(b'')
+	return tmp_path
+
+def names(folder, **options):
+	return sorted(os.path.relpath(entry.path, folder).replace(os.sep, '/') for entry in walkImages(str(folder), **options))
+
+def test_extensions(tree):
+	# Case insensitive, tiff and bmp included, other files and folders left out
+	assert names(tree) == ['B.PNG', 'a.jpg', 'c.Tiff', 'd.bmp']
+	assert names(tree, extensions=['png']) == ['B.PNG']
+	assert {'tiff', 'bmp'} <= set(IMAGE_EXTENSIONS)
+
+def test_recursive(tree):
+	assert names(tree, recursive=True) == ['B.PNG', 'a.jpg', 'c.Tiff', 'd.bmp', 'icons/e.png', 'icons/f-export.jpg', 'raw/deep/g.gif']
+
+def test_include_exclude(tree):
+	assert names(tree, recursive=True, include=['*.png', '*.PNG']) == ['B.PNG', 'icons/e.png']
+	assert names(tree, recursive=True, include=['icons/*']) == ['icons/e.png', 'icons/f-export.jpg']
+	assert names(tree, recursive=True, exclude=['*-export*', 'raw']) == ['B.PNG', 'a.jpg', 'c.Tiff', 'd.bmp', 'icons/e.png']
+
+def test_output_dir_is_not_walked(tree):
+	found = sorted(path.replace(os.sep, '/') for path in findImages(str(tree), {'recursive': True, 'output_dir': str(tree / 'icons')}))
+	assert found == ['B.PNG', 'a.jpg', 'c.Tiff', 'd.bmp', 'raw/deep/g.gif']
+
+@pytest.mark.skipif(not hasattr(os, 'symlink') or os.name == 'nt', reason='symbolic links')
+def test_symlinks(tree):
+	os.symlink(tree / 'a.jpg', tree / 'link.jpg')
+	os.symlink(tree / 'raw', tree / 'linked')
+	# A loop back to the root
+	os.symlink(tree, tree / 'raw' / 'loop')
+	assert 'link.jpg' not in names(tree, symlinks='skip')
+	files = names(tree, recursive=True, symlinks='files')
+	assert 'link.jpg' in files and not [name for name in files if name.startswith(('linked/', 'raw/loop/'))]
+	followed = names(tree, recursive=True, symlinks='follow')
+	# Each folder is walked once: raw/deep through raw or through linked, and the loop is cut
+	assert sum(name.endswith('g.gif') for name in followed) == 1
+	assert not [name for name in followed if name.startswith('raw/loop/')]
+
+def test_image_helper(tree):
+	ui_util = pytest.importorskip('ui_util')
+	assert sorted(ui_util.ImageHelper.parseImages(str(tree))) == ['B.PNG', 'a.jpg', 'c.Tiff', 'd.bmp']
+	found = ui_util.ImageHelper.parseImages(str(tree), relative=False, recursive=True, exclude=['icons'])
+	assert sorted(os.path.relpath(path, tree).replace(os.sep, '/') for path in found) == ['B.PNG', 'a.jpg', 'c.Tiff', 'd.bmp', 'raw/deep/g.gif']
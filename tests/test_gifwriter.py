@@ -0,0 +1,70 @@
+import numpy as np
+from PIL import Image
+
+from core.gifwriter import GifStreamWriter, TRANSPARENT_INDEX
+from core.optimizer import HeadlessParent, ImageOptimizer
+
+def decodeFrames(path):
+	""" Composited RGB frames, with their durations, and the loop count """
+	with Image.open(path) as im:
+		frames, durations = [], []
+		for i in range(im.n_frames):
+			im.seek(i)
+			frames.append(np.asarray(im.convert('RGB')))
+			durations.append(im.info['duration'])
+		return frames, durations, im.info.get('loop')
+
+def frameBlocks(path):
+	""" Transparent index (None without), width and height of each image block of a GIF """
+	data = path.read_bytes()
+	blocks = []
+	start = data.find(b'!\xf9\x04')
+	while start >= 0:
+		# Graphic control extension followed by an image descriptor
+		if data[start + 8:start + 9] == b',':
+			transparency = data[start + 6] if data[start + 3] & 1 else None
+			blocks.append((transparency, int.from_bytes(data[start + 13:start + 15], 'little'), int.from_bytes(data[start + 15:start + 17], 'little')))
+		start = data.find(b'!\xf9\x04', start + 1)
+	return blocks
+
+def movingSquare(step, size=(48, 32)):
+	""" A red square moving over a gray background: consecutive frames differ in a small area """
+	frame = np.full((size[1], size[0], 3), 128, 'uint8')
+	frame[4:12, 4 + step * 6:12 + step * 6] = (255, 0, 0)
+	return frame
+
+def test_global_palette_transparent_deltas(tmp_path):
+	palette = bytes([128, 128, 128, 255, 0, 0])
+	colors = np.array([[128, 128, 128], [255, 0, 0]], 'uint8')
+	sources = [movingSquare(step) for step in [0, 1, 2, 2, 3]]
+	with GifStreamWriter(str(tmp_path / 'a.gif'), (48, 32), loop=3, palette=palette) as writer:
+		for source in sources:
+			indexes = (source == colors[1]).all(axis=2).astype('uint8')
+			writer.addFrame(Image.fromarray(indexes, 'P'), 40)
+	# The repeated frame is merged into the previous one
+	assert writer.frames == 4
+	frames, durations, loop = decodeFrames(tmp_path / 'a.gif')
+	assert durations == [40, 40, 80, 40] and loop == 3
+	for frame, source in zip(frames, [sources[0], sources[1], sources[2], sources[4]]):
+		assert np.array_equal(frame, source)
+	# Later frames only store a changed rectangle, its unchanged pixels being transparent
+	assert frameBlocks(tmp_path / 'a.gif')[1:] == [
+		(TRANSPARENT_INDEX, 14, 8)] * 3
+
+def test_build_gif_matches_the_frames(tmp_path):
+	paths = []
+	for step in range(4):
+		paths.append(str(tmp_path / f'{step}.png'))
+		Image.fromarray(movingSquare(step)).save(paths[-1])
+	reference = tmp_path / 'reference.gif'
+	frames = [Image.open(path).convert('RGB') for path in paths]
+	frames[0].save(reference, save_all=True, append_images=frames[1:], duration=50, loop=2)
+
+	dest_path = ImageOptimizer(HeadlessParent(), str(tmp_path), {'timestamp': False, 'base_width': 48}).buildGif(paths, duration=50, loop=2)
+	built, durations, loop = decodeFrames(dest_path)
+	expected, expected_durations, expected_loop = decodeFrames(reference)
+	assert len(built) == len(expected) == 4
+	assert durations == expected_durations and loop == expected_loop
+	for frame, source in zip(built, expected):
+		# Colors come from the global palette
+		assert np.abs(frame.astype(int) - source).max() <= 8
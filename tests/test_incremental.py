@@ -0,0 +1,73 @@
+import os, threading, time
+from PIL import Image
+
+from core import discovery
+from core.discovery import FolderScanner
+from core.manifest import Manifest
+from core.optimizer import HeadlessParent, ImageOptimizer
+
+def config(**settings):
+	return {'timestamp': False, 'base_width': 32, 'incremental': True, **settings}
+
+def image(path, color=(200, 0, 0)):
+	Image.new('RGB', (64, 48), color).save(path)
+
+def sources(results):
+	return sorted(result['source'] for result in results)
+
+def test_incremental_skip(tmp_path):
+	image(tmp_path / 'a.jpg')
+	image(tmp_path / 'b.png')
+	assert sources(ImageOptimizer(HeadlessParent(), str(tmp_path), config()).compress()) == ['a.jpg', 'b.png']
+	# Nothing new: the outputs of the first run are not taken as sources
+	assert ImageOptimizer(HeadlessParent(), str(tmp_path), config()).compress() == []
+	image(tmp_path / 'b.png', (0, 200, 0))
+	image(tmp_path / 'c.jpg')
+	assert sources(ImageOptimizer(HeadlessParent(), str(tmp_path), config()).compress()) == ['b.png', 'c.jpg']
+	assert sorted(Manifest(str(tmp_path)).entries) == ['a.jpg', 'b.png', 'c.jpg']
+
+def test_scanner_lists_changed_folders_only(tmp_path, monkeypatch):
+	os.makedirs(tmp_path / 'sub')
+	image(tmp_path / 'a.jpg')
+	image(tmp_path / 'sub' / 'b.jpg')
+	old = time.time() - 60
+	for folder in [tmp_path, tmp_path / 'sub']:
+		os.utime(folder, (old, old))
+	listed = []
+	scandir = os.scandir
+	monkeypatch.setattr(discovery.os, 'scandir', lambda path: listed.append(path) or scandir(path))
+
+	scanner = FolderScanner(str(tmp_path), {'recursive': True})
+	images, changed = scanner.scan()
+	assert sorted(images) == sorted(changed) == ['a.jpg', os.path.join('sub', 'b.jpg')]
+	listed.clear()
+	assert scanner.scan()[1] == [] and listed == []
+
+	image(tmp_path / 'sub' / 'c.jpg')
+	images, changed = scanner.scan()
+	assert listed == [str(tmp_path / 'sub')]
+	assert sorted(changed) == [os.path.join('sub', 'b.jpg'), os.path.join('sub', 'c.jpg')]
+	assert len(images) == 3
+
+def test_watch(tmp_path):
+	image(tmp_path / 'a.jpg')
+	opt = ImageOptimizer(HeadlessParent(), str(tmp_path), config())
+	compressed = []
+	compress = opt.compress
+	opt.compress = lambda *args, **kwargs: compressed.append(list(args[1])) or compress(*args, **kwargs)
+	stop = threading.Event()
+	thread = threading.Thread(target=opt.watch, kwargs={'interval': 0.05, 'stop': stop})
+	thread.start()
+	try:
+		deadline = time.monotonic() + 10
+		while not os.path.exists(tmp_path / 'a-export.jpg') and time.monotonic() < deadline:
+			time.sleep(0.02)
+		image(tmp_path / 'b.jpg')
+		while not os.path.exists(tmp_path / 'b-export.jpg') and time.monotonic() < deadline:
+			time.sleep(0.02)
+		time.sleep(0.2)
+	finally:
+		stop.set()
+		thread.join()
+	# Every image once, its output never
+	assert compressed == [['a.jpg'], ['b.jpg']]
@@ -0,0 +1,157 @@
+import os
+import pytest, requests
+
+from core.gallery import GalleryCache
+from core.kitbuilder import Kitbuilder
+from core.uploads import UploadIndex
+from tests.standin import StandinServer
+
+@pytest.fixture
+def server():
+	with StandinServer() as server:
+		yield server
+
+def client(server: StandinServer, **kwargs) -> Kitbuilder:
+	kitbuilder = Kitbuilder(StandinServer.creds, base_url=server.url, backoff=0.01, **kwargs)
+	assert kitbuilder.status == 'on'
+	return kitbuilder
+
+def writeImages(folder: str, count: int) -> list:
+	paths = []
+	for i in range(count):
+		paths.append(os.path.join(folder, f'image{i}.jpg'))
+		with open(paths[-1], 'wb') as f:
+			f.write(f'content {i}'.encode())
+	return paths
+
+def test_bulk_upload_returns_results_in_order(server, tmp_path):
+	paths = writeImages(tmp_path, 5)
+	results = client(server).storeImages(paths)
+	assert [result['path'] for result in results] == paths
+	assert all(result['error'] is None for result in results)
+	assert sorted(result['id'] for result in results) == [1, 2, 3, 4, 5]
+	assert [image['content'] for image in sorted(server.images, key=lambda image: image['name'])] == [f'content {i}'.encode() for i in range(5)]
+
+def test_expired_token_is_fetched_once(server, tmp_path):
+	kitbuilder = client(server)
+	server.expireToken()
+	results = kitbuilder.storeImages(writeImages(tmp_path, 4))
+	assert all(result['error'] is None for result in results)
+	assert kitbuilder.headers['X-CSRF-TOKEN'] == server.token
+	assert server.requests.count(('GET', '/api/images')) == 1
+
+def test_processed_upload_is_not_sent_again(server, tmp_path):
+	# The server stored the image, then failed: sending it again would add a duplicate
+	server.faults = [(500, True)]
+	result = client(server).uploadImage(writeImages(tmp_path, 1)[0])
+	assert result['error'] is not None
+	assert len(server.images) == 1
+	assert server.requests.count(('POST', '/api/images')) == 1
+
+def test_refused_upload_is_retried(server, tmp_path):
+	server.faults = [(503, False), (429, False)]
+	result = client(server).uploadImage(writeImages(tmp_path, 1)[0])
+	assert result['error'] is None
+	assert len(server.images) == 1
+	assert server.requests.count(('POST', '/api/images')) == 3
+
+def test_gallery_read_is_retried(server, tmp_path):
+	kitbuilder = client(server)
+	kitbuilder.storeImages(writeImages(tmp_path, 3))
+	server.faults = [(502, False)]
+	assert [image['id'] for image in kitbuilder.iterImages()] == [1, 2, 3]
+
+def test_delete(server, tmp_path):
+	kitbuilder = client(server)
+	kitbuilder.storeImages(writeImages(tmp_path, 2))
+	results = kitbuilder.deleteImages([1])
+	assert results[0]['error'] is None
+	assert [image['id'] for image in server.images] == [2]
+
+def test_rejected_login(server):
+	kitbuilder = Kitbuilder({'username': 'user@example.com', 'password': 'wrong'}, base_url=server.url)
+	assert kitbuilder.status == 'off'
+
+def test_unreachable_upload_is_retried(monkeypatch):
+	with StandinServer() as server:
+		url = server.url
+	# The server is gone: connections are refused, so the upload never reached it
+	kitbuilder = Kitbuilder(StandinServer.creds, base_url=url, retries=2, backoff=0.01)
+	kitbuilder.headers = {'X-CSRF-TOKEN': 'token-1'}
+	attempts = []
+	send = kitbuilder.session.request
+	def request(*args, **kwargs):
+		attempts.append(args[0])
+		try:
+			return send(*args, **kwargs)
+		except requests.ConnectionError as e:
+			assert Kitbuilder.isConnectError(e)
+			raise
+	monkeypatch.setattr(kitbuilder.session, 'request', request)
+	result = kitbuilder.postImage(b'content', 'image.jpg')
+	assert result['error'] is not None
+	assert attempts == ['POST'] * 3
+
+def test_rebuilt_index_matches_uploads(server, tmp_path):
+	uploaded = client(server, upload_index=UploadIndex(str(tmp_path / 'uploads.json')))
+	uploaded.storeImages(writeImages(tmp_path, 3))
+	rebuilt = client(server, upload_index=UploadIndex(str(tmp_path / 'rebuilt.json')))
+	assert rebuilt.rebuildUploadIndex() == 3
+	assert rebuilt.upload_index.entries == uploaded.upload_index.entries
+
+def test_failed_downloads_keep_the_index(server, tmp_path):
+	index = UploadIndex(str(tmp_path / 'uploads.json'))
+	kitbuilder = client(server, upload_index=index)
+	kitbuilder.storeImages(writeImages(tmp_path, 3))
+	entries = dict(index.entries)
+	for image in server.images:
+		image['url'] = image['url'].replace('/storage/', '/missing/')
+	assert kitbuilder.rebuildUploadIndex() == 0
+	assert UploadIndex(index.path).entries == entries
+
+def test_rebuild_without_index(server):
+	with pytest.raises(ValueError):
+		client(server).rebuildUploadIndex()
+
+def galleryRequests(server):
+	return server.requests.count(('GET', '/api/images/'))
+
+def test_fresh_gallery_page_is_reused(server, tmp_path):
+	kitbuilder = client(server, gallery_cache=GalleryCache(str(tmp_path / 'gallery.json'), ttl=60))
+	kitbuilder.storeImages(writeImages(tmp_path, 1))
+	first = kitbuilder.getImages()
+	requests_before = galleryRequests(server)
+	assert kitbuilder.getImages() == first
+	assert galleryRequests(server) == requests_before
+
+def test_not_modified_gallery_page_is_reused(server, tmp_path, monkeypatch):
+	cache = GalleryCache(str(tmp_path / 'gallery.json'), ttl=0)
+	kitbuilder = client(server, gallery_cache=cache)
+	kitbuilder.storeImages(writeImages(tmp_path, 1))
+	first = kitbuilder.getImages()
+	revalidated = []
+	touch = cache.touch
+	monkeypatch.setattr(cache, 'touch', lambda key: revalidated.append(key) or touch(key))
+	requests_before = galleryRequests(server)
+	assert kitbuilder.getImages() == first
+	assert galleryRequests(server) == requests_before + 1
+	assert revalidated == [GalleryCache.key(1, 'all')]
+
+def test_changed_gallery_page_is_downloaded(server, tmp_path):
+	kitbuilder = client(server, gallery_cache=GalleryCache(str(tmp_path / 'gallery.json'), ttl=0))
+	kitbuilder.storeImages(writeImages(tmp_path, 1))
+	assert [image['id'] for image in kitbuilder.getImages()['data']] == [1]
+	server.images.append({'id': 2, 'name': 'other.jpg', 'url': '/storage/2-other.jpg', 'content': b''})
+	assert [image['id'] for image in kitbuilder.getImages()['data']] == [1, 2]
+	assert GalleryCache(str(tmp_path / 'gallery.json')).get(GalleryCache.key(1, 'all'))['body']['data'][1]['id'] == 2
+
+def test_not_modified_without_cached_page(server, tmp_path, monkeypatch):
+	cache = GalleryCache(str(tmp_path / 'gallery.json'), ttl=0)
+	kitbuilder = client(server, gallery_cache=cache)
+	kitbuilder.getImages()
+	etag = cache.get(GalleryCache.key(1, 'all'))['etag']
+	# The page left the cache, but the request still carries its validator
+	cache.entries.clear()
+	monkeypatch.setattr(GalleryCache, 'validators', staticmethod(lambda entry: {'If-None-Match': etag}))
+	with pytest.raises(requests.HTTPError, match='not in the gallery cache'):
+		kitbuilder.getImages()
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from io import BytesIO
+from PIL import Image
+
+from core.lossless import encodePng, optimizePng
+from core.optimizer import ImageOptimizer
+
+def pixels(mode, colors):
+	""" A gradient image, or one drawn from a few colors """
+	rng = np.random.default_rng(1)
+	bands = len(mode)
+	if colors:
+		palette = rng.integers(0, 256, (colors, bands), dtype=np.uint8)
+		data = palette[rng.integers(0, colors, (48, 64))]
+	else:
+		y, x = np.mgrid[0:48, 0:64]
+		data = np.stack([(x * 4 + y * band) % 256 for band in range(bands)], axis=-1).astype(np.uint8)
+	if mode == 'RGBA':
+		# Partial alpha, and fully transparent pixels
+		data[..., 3] = np.where(data[..., 3] < 40, 0, data[..., 3])
+	return Image.fromarray(data, mode)
+
+def decoded(data, mode):
+	with Image.open(BytesIO(data)) as im:
+		return np.asarray(im.convert(mode))
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+@pytest.mark.parametrize('colors', [0, 5, 200])
+def test_round_trip(mode, colors):
+	im = pixels(mode, colors)
+	data, report = optimizePng(im)
+	assert np.array_equal(decoded(data, mode), np.asarray(im))
+	# Never bigger than the plain save
+	assert len(data) <= len(encodePng(im)) == report['baseline_bytes']
+	if colors:
+		assert report['mode'] == 'P'
+
+def test_opaque_alpha_dropped():
+	im = pixels('RGBA', 0)
+	im.putalpha(255)
+	data, report = optimizePng(im)
+	assert report['mode'] == 'RGB'
+	assert np.array_equal(decoded(data, 'RGBA'), np.asarray(im))
+
+def test_encode_image_png():
+	im = pixels('RGBA', 12)
+	opt = ImageOptimizer(None, '', {})
+	data, details = opt.encodeImage(im, 'a.png', 'a-export.png')
+	assert np.array_equal(decoded(data, 'RGBA'), np.asarray(im))
+	assert details['png']['saved_bytes'] >= 0
@@ -0,0 +1,25 @@
+from PIL import Image
+
+from core import metadata
+
+def test_index_keeps_recently_used_entries(tmp_path):
+	for name in 'abc':
+		Image.new('RGB', (8, 8)).save(tmp_path / f'{name}.png')
+	index = metadata.MetadataIndex(max_entries=2)
+	index.get(str(tmp_path / 'a.png'))
+	index.get(str(tmp_path / 'b.png'))
+	index.get(str(tmp_path / 'a.png'))
+	index.get(str(tmp_path / 'c.png'))
+	assert list(index.entries) == [str(tmp_path / 'a.png'), str(tmp_path / 'c.png')]
+
+def test_frames_counted_for_animations_only(tmp_path, monkeypatch):
+	frames = [Image.new('RGB', (8, 8), (i * 60, 0, 0)) for i in range(4)]
+	frames[0].save(tmp_path / 'a.gif', save_all=True, append_images=frames[1:])
+	frames[0].save(tmp_path / 'b.gif')
+	index = metadata.MetadataIndex()
+	animated, still = index.get(str(tmp_path / 'a.gif')), index.get(str(tmp_path / 'b.gif'))
+	assert animated.animated and not still.animated
+	assert animated.frames == 4
+	# A still image is not opened again
+	monkeypatch.setattr(metadata.Image, 'open', None)
+	assert still.frames == 1
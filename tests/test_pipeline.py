@@ -0,0 +1,41 @@
+import os
+import pytest
+from PIL import Image
+
+from core import pipeline
+from core.kitbuilder import Kitbuilder
+from core.pipeline import optimizeAndUpload
+from tests.standin import StandinServer
+
+@pytest.fixture
+def kitbuilder():
+	with StandinServer() as server:
+		yield Kitbuilder(StandinServer.creds, base_url=server.url, backoff=0.01)
+
+@pytest.fixture
+def folder(tmp_path):
+	os.makedirs(tmp_path / 'sub')
+	for i, name in enumerate(['a.jpg', 'b.png', os.path.join('sub', 'c.jpg')]):
+		Image.new('RGB', (64, 48), (i * 80, 0, 0)).save(tmp_path / name)
+	return tmp_path
+
+def config(**settings):
+	return {'timestamp': False, 'base_width': 32, **settings}
+
+def test_discovery_settings(kitbuilder, folder):
+	results = optimizeAndUpload(kitbuilder, str(folder), config=config(recursive=True, exclude=['b.png']))
+	assert sorted(os.path.basename(result['source']) for result in results) == ['a.jpg', 'c.jpg']
+	assert all(result['error'] is None and result['url'] for result in results)
+
+def test_parallel_workers(kitbuilder, folder):
+	results = optimizeAndUpload(kitbuilder, str(folder), config=config(recursive=True, workers=2))
+	assert len(results) == 3
+	assert all(result['error'] is None for result in results)
+
+def test_encode_failure(kitbuilder, folder, monkeypatch):
+	def fail(*args):
+		raise RuntimeError('encoder crashed')
+	monkeypatch.setattr(pipeline, '_encodeWorker', fail)
+	results = optimizeAndUpload(kitbuilder, str(folder), config=config())
+	assert len(results) == 2
+	assert all(result['error'] for result in results)
@@ -0,0 +1,19 @@
+from io import BytesIO
+from PIL import Image
+
+from core import profiles
+from core.lossless import PNG_TRIALS_SMALLEST, optimizePng
+
+def test_smallest_differs_from_balanced():
+	assert profiles.saveParams({'profile': 'smallest'}, 'GIF') != profiles.saveParams({'profile': 'balanced'}, 'GIF')
+	assert profiles.losslessPngArgs({'profile': 'balanced'})['trials'] != PNG_TRIALS_SMALLEST
+	assert profiles.losslessPngArgs({'profile': 'smallest'})['trials'] == PNG_TRIALS_SMALLEST
+
+def test_png_encoder_params_in_lossless_pass():
+	config = {'encoder_params': {'png': {'dpi': (300, 300), 'compress_level': 1}}}
+	assert profiles.losslessPngArgs(config)['params'] == {'dpi': (300, 300), 'compress_level': 1}
+	data, report = optimizePng(Image.new('RGB', (32, 32), (10, 20, 30)), **profiles.losslessPngArgs(config))
+	with Image.open(BytesIO(data)) as im:
+		assert round(im.info['dpi'][0]) == 300
+	# The zlib settings are searched by the pass
+	assert report['compress_level'] == 9
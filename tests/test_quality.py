@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from io import BytesIO
+from PIL import Image
+
+from core.optimizer import ImageOptimizer
+from core.quality import MAX_PSNR, channels, compare, psnr, ssim
+
+def photo(width=160, height=120):
+	# Smooth gradients with some noise: lossy formats lose a little of it
+	y, x = np.mgrid[0:height, 0:width]
+	noise = np.random.default_rng(1).normal(0, 12, (height, width, 3))
+	pixels = np.stack([x * 255 / width, y * 255 / height, (x + y) * 127 / (width + height)], axis=-1) + noise
+	return Image.fromarray(np.clip(pixels, 0, 255).astype('uint8'))
+
+def test_identical_planes():
+	plane = channels(photo(), False)[0]
+	assert ssim(plane, plane) == pytest.approx(1.0)
+	assert psnr(plane, plane) == MAX_PSNR
+
+def test_known_psnr():
+	a = np.zeros((16, 16))
+	# A difference of 1 everywhere: MSE 1, PSNR 10 * log10(255²)
+	assert psnr(a, a + 1) == pytest.approx(48.1308, abs=1e-4)
+
+def test_noise_lowers_ssim():
+	plane = channels(photo(), False)[0]
+	rng = np.random.default_rng(2)
+	scores = [ssim(plane, np.clip(plane + rng.normal(0, sigma, plane.shape), 0, 255)) for sigma in (2, 10, 40)]
+	assert 1.0 > scores[0] > scores[1] > scores[2]
+
+def test_compare_lossless():
+	buffer = BytesIO()
+	im = photo()
+	im.save(buffer, format='PNG')
+	assert compare(im, buffer.getvalue(), False) == {'ssim': 1.0, 'psnr': MAX_PSNR}
+
+def encodeAuto(**settings):
+	opt = ImageOptimizer(None, '', {'auto_formats': ['WebP', 'png', 'jpg'], 'quality': 60, **settings})
+	return opt.encodeAuto(photo(), 'a.jpg', 'a-export.auto')
+
+def test_smallest_passing_candidate():
+	data, details = encodeAuto(min_ssim=0.5)
+	passed = [scores for scores in details['scores'] if scores['passed']]
+	assert len(passed) == 3
+	assert details['bytes'] == len(data) == min(scores['bytes'] for scores in passed)
+	assert details['dest'] == f"a-export.{details['format']}"
+
+def test_candidates_under_the_gate_are_rejected():
+	# Only the lossless candidate keeps every pixel
+	data, details = encodeAuto(min_ssim=0.9999)
+	assert [scores['format'] for scores in details['scores'] if scores['passed']] == ['png']
+	assert details['format'] == 'png'
+
+def test_best_candidate_when_none_passes(capsys):
+	data, details = encodeAuto(auto_formats=['WebP', 'jpg'], min_ssim=1.01)
+	assert not any(scores['passed'] for scores in details['scores'])
+	assert details['format'] == max(details['scores'], key=lambda scores: scores['ssim'])['format']
+	assert 'No format passes the quality gate' in capsys.readouterr().out
@@ -0,0 +1,26 @@
+import os
+from PIL import Image
+
+from core.optimizer import HeadlessParent, ImageOptimizer
+
+def test_widths_above_the_source(tmp_path):
+	Image.new('RGB', (1600, 900), (120, 60, 30)).save(tmp_path / 'a.jpg')
+	config = {'timestamp': False, 'renditions': [640, 1280, 1920, 2000]}
+	results = ImageOptimizer(HeadlessParent(), str(tmp_path), config).compress()
+	outputs = results[0]['renditions']
+	assert [(output['width'], os.path.basename(output['dest'])) for output in outputs] == [
+		(1600, 'a-export-1600w.jpg'), (1280, 'a-export-1280w.jpg'), (640, 'a-export-640w.jpg')]
+	assert sorted(name for name in os.listdir(tmp_path) if name != 'a.jpg') == ['a-export-1280w.jpg', 'a-export-1600w.jpg', 'a-export-640w.jpg']
+
+def test_animated_renditions(tmp_path):
+	frames = [Image.new('RGB', (200, 100), color) for color in [(255, 0, 0), (0, 255, 0), (0, 0, 255)]]
+	frames[0].save(tmp_path / 'a.gif', save_all=True, append_images=frames[1:], duration=100, loop=0)
+	config = {'timestamp': False, 'renditions': [64, 128]}
+	results = ImageOptimizer(HeadlessParent(), str(tmp_path), config).compress()
+	outputs = results[0]['renditions']
+	assert sorted(output['width'] for output in outputs) == [64, 128]
+	for output in outputs:
+		# Not flattened to the first frame
+		assert output['frames'] == 3
+		with Image.open(output['dest']) as im:
+			assert im.width == output['width'] and im.n_frames == 3
@@ -0,0 +1,23 @@
+import pytest
+
+ui_util = pytest.importorskip('ui_util')
+
+class Signal(object):
+	def __init__(self):
+		self.values = []
+
+	def emit(self, value):
+		self.values.append(value)
+
+def test_flush_sends_the_last_held_value():
+	signal = Signal()
+	throttled = ui_util.ThrottledSignal(signal, rate=0.001)
+	for value in [0, 10, 20, 30, 100]:
+		throttled.emit(value)
+	throttled.emit(40)
+	assert signal.values == [0, 100]
+	throttled.flush()
+	assert signal.values == [0, 100, 40]
+	# Nothing held back
+	throttled.flush()
+	assert signal.values == [0, 100, 40]
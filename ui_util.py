@@ -1,9 +1,12 @@
 from pathlib import Path
-from PyQt6.QtCore import pyqtSignal, QObject, QTimer
+from PyQt6.QtCore import pyqtSignal, QObject, QRunnable, QTimer
+from PyQt6.QtGui import QGuiApplication
 from PyQt6.QtWidgets import QMessageBox
 import threading
 import webbrowser
-import os, json
+import os, json, time
+from core.discovery import IMAGE_EXTENSIONS, walkImages
+from core.optimizer import ImageOptimizer
 
 class JsonConfig:
 	@staticmethod
@@ -18,20 +21,10 @@ class JsonConfig:
 
 class ImageHelper:
 	@staticmethod
-	def parseImages(folder, allowed_extensions=['WebP', 'png', 'jpeg', 'jpg', 'gif', 'ico', 'tiff' 'bmp'], relative=True):
-		# keep only allowed images		
-		images = []
-		extensions = [ext.lower() for ext in allowed_extensions]
-		for item in os.listdir(folder):			
-			item_abs_path = os.path.join(folder, item)			
-			if os.path.isfile(item_abs_path):				
-				_, ext = os.path.splitext(os.path.basename(item))				
-				if ('.' in ext) and (ext.lstrip('.').lower() in extensions):
-					if relative:
-						images.append(item)
-					else:
-						images.append(item_abs_path)		
-		return images
+	def parseImages(folder, allowed_extensions=IMAGE_EXTENSIONS, relative=True, **options):
+		# keep only allowed images (options: recursive, include, exclude, symlinks)
+		return [os.path.relpath(entry.path, folder) if relative else entry.path
+			for entry in walkImages(folder, allowed_extensions, **options)]
 
 def is_visible(visible, widget):
 	''' Set widget visibility according to a variable state '''
@@ -217,4 +210,81 @@ class CustomSignal(QObject):
 		super(CustomSignal, self).__init__()
 		pass
 
-signal_g_card_edit = CustomSignal()
\ No newline at end of file
+signal_g_card_edit = CustomSignal()
+
+class WorkerSignals(QObject):
+	""" Signals of an OptimizeWorker. Connected slots run in the GUI thread """
+	progress = pyqtSignal(int)
+	imageDone = pyqtSignal(object)
+	finished = pyqtSignal(object)
+	failed = pyqtSignal(str)
+
+class ThrottledSignal(object):
+	"""
+	Forward values to a signal at most `rate` times per second, so a fast batch does not flood
+	the event loop with repaints nobody can see. 0 and 100 are always forwarded, and `flush`
+	forwards the last value that was held back.
+	"""
+	def __init__(self, signal, rate=60.0):
+		super(ThrottledSignal, self).__init__()
+		self.signal = signal
+		self.interval = 1 / (rate or 60.0)
+		self.last = 0.0
+		# Last value not forwarded yet, None when the signal is up to date
+		self.pending = None
+
+	def emit(self, value):
+		now = time.monotonic()
+		if value in (0, 100) or now - self.last >= self.interval:
+			self.last = now
+			self.pending = None
+			self.signal.emit(value)
+		else:
+			self.pending = value
+
+	def flush(self):
+		""" Forward the last value held back, if any """
+		if self.pending is not None:
+			value, self.pending = self.pending, None
+			self.last = time.monotonic()
+			self.signal.emit(value)
+
+class OptimizeWorker(QRunnable):
+	"""
+	Run an ImageOptimizer operation (compress, buildGif) in a QThreadPool thread.
+
+	The worker is the parent of its optimizer: progress is throttled to the screen refresh rate
+	and each image result is sent through `signals.imageDone` as soon as it is done.
+
+	Usage:
+		worker = OptimizeWorker(path, config, 'compress', overwrite, images, filemode=True)
+		worker.signals.finished.connect(onFinished)
+		QThreadPool.globalInstance().start(worker)
+	"""
+	def __init__(self, path, config, operation, *args, basepath='', **kwargs):
+		super(OptimizeWorker, self).__init__()
+		self.basepath = basepath
+		self.signals = WorkerSignals()
+		screen = QGuiApplication.primaryScreen()
+		self.signalProgression = ThrottledSignal(self.signals.progress, screen.refreshRate() if screen else 60.0)
+		self.signalImageDone = self.signals.imageDone
+		self.optimizer = ImageOptimizer(self, path, config)
+		self.operation = getattr(self.optimizer, operation)
+		self.args = args
+		self.kwargs = kwargs
+
+	def run(self):
+		try:
+			result = self.operation(*self.args, **self.kwargs)
+		except Exception as e:
+			print(f'Error during {self.operation.__name__}: {e}')
+			self.signalProgression.flush()
+			self.signals.failed.emit(str(e))
+			return
+		# The bar ends on the last progress, even when it came right after the previous one
+		self.signalProgression.flush()
+		self.signals.finished.emit(result)
+
+	def cancel(self):
+		""" Stop the operation. Can be called from the GUI thread """
+		self.optimizer.cancel()